@@ -0,0 +1,272 @@
+"""
+Benchmarks every way of building the customer_x report (generate_customer_x_report_v1, and
+generate_customer_x_report with each fetch strategy) on synthetic data, measuring the wall time,
+the peak memory and the throughput of each.
+
+Every measurement runs in a fresh interpreter, so one run's memory or caches don't leak into the next.
+The results are written to a json file, which a later run can be compared against:
+
+    python -m benchmarks.customer_x --scales 10k 1m --output benchmarks/results/before.json
+    python -m benchmarks.customer_x --scales 10k 1m --compare benchmarks/results/before.json
+
+The report code reads the .env like the script does, so a .env is needed even for the SQLite stand-ins.
+"""
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+from benchmarks.synthetic_data import (
+    SCALES,
+    add_data_arguments,
+    config_from_args,
+    get_engines,
+    load_synthetic_data,
+    parse_rows
+)
+from report.report_types import FetchStrategy
+from services.instrumentation import current_rss_bytes
+
+
+PROJECT_ROOT = Path(__file__).parents[1]
+DEFAULT_RESULTS_DIR = PROJECT_ROOT / 'benchmarks' / 'results'
+
+# The incremental strategy is measured twice: once building the rollup from scratch,
+# and once more on top of it, which is what a nightly run pays.
+BENCHMARK_CASES = ['v1'] + [strategy.value for strategy in FetchStrategy] + ['incremental_warm']
+
+
+class PeakMemorySampler:
+    """
+    Samples the resident memory of the process in the background, to find the peak reached in a block of code.
+    Falls back to ru_maxrss where /proc is not available, which can't see below the peak of the imports.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.baseline_bytes = 0
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak_bytes = max(self.peak_bytes, current_rss_bytes())
+            time.sleep(self.interval)
+
+    def __enter__(self) -> 'PeakMemorySampler':
+        self.baseline_bytes = self.peak_bytes = current_rss_bytes()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, current_rss_bytes())
+
+    @property
+    def peak_increase_mb(self) -> float:
+        return (self.peak_bytes - self.baseline_bytes) / (1024 * 1024)
+
+
+def run_case(case: str, postgres_url: str, mysql_url: str) -> Dict:
+    """
+    Builds the report once with one of the BENCHMARK_CASES, and measures it. Runs in the child interpreter.
+    """
+    from sqlalchemy import create_engine, delete
+    from sqlalchemy.orm import sessionmaker
+    from database.models import LessonCompletionRollup, LessonCompletionRollupDay
+    from report.checkpoints import clear_report_checkpoints
+    from report.customer_x_report import generate_customer_x_report, generate_customer_x_report_v1
+    from config import settings
+
+    PostgresSession = sessionmaker(bind=create_engine(postgres_url))
+    MysqlSession = sessionmaker(bind=create_engine(mysql_url))
+
+    with PostgresSession() as postgres_session, MysqlSession() as mysql_session:
+        if case == FetchStrategy.INCREMENTAL.value:
+            # The cold run starts without a rollup.
+            postgres_session.execute(delete(LessonCompletionRollup))
+            postgres_session.execute(delete(LessonCompletionRollupDay))
+            postgres_session.commit()
+        if case == FetchStrategy.RESUMABLE.value:
+            # Measures a run from scratch, not one reading back the checkpoints of the previous measurement.
+            clear_report_checkpoints(settings.report_checkpoint_dir, 'customer_x')
+
+        with PeakMemorySampler() as memory:
+            started = time.perf_counter()
+            if case == 'v1':
+                report = generate_customer_x_report_v1(postgres_session, mysql_session)
+            else:
+                fetch_strategy = FetchStrategy.INCREMENTAL.value if case == 'incremental_warm' else case
+                report = generate_customer_x_report(postgres_session, mysql_session, fetch_strategy)
+            wall_seconds = time.perf_counter() - started
+    clear_report_checkpoints(settings.report_checkpoint_dir, 'customer_x')
+
+    return {
+        'case': case,
+        'wall_seconds': round(wall_seconds, 4),
+        'peak_memory_mb': round(memory.peak_increase_mb, 2),
+        'report_rows': len(report),
+    }
+
+
+def run_case_in_subprocess(case: str, postgres_url: str, mysql_url: str, extra_env: Dict[str, str]) -> Dict:
+    result = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.customer_x', '--run-case', case, '--postgres-url', postgres_url, '--mysql-url', mysql_url],
+        cwd=PROJECT_ROOT,
+        env={**os.environ, **extra_env},
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f'Benchmark case {case} failed:\n{result.stderr}')
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run_suite(args: argparse.Namespace) -> Dict:
+    """
+    Loads the synthetic data for every scale, and measures every case on it.
+    """
+    extra_env = {'DB_STREAM_RESULTS': str(args.db_stream_results).lower()}
+    results = []
+    for scale in args.scales:
+        config = config_from_args(args, parse_rows(scale))
+        postgres_engine, mysql_engine = get_engines(args.target, args.data_dir / scale)
+        load_started = time.perf_counter()
+        _, lesson_completion_rows = load_synthetic_data(config, postgres_engine, mysql_engine, replace=True)
+        print(f'[{scale}] loaded {config.users} users, {lesson_completion_rows} lesson completions '
+              f'in {time.perf_counter() - load_started:.1f}s', flush=True)
+
+        postgres_url = postgres_engine.url.render_as_string(hide_password=False)
+        mysql_url = mysql_engine.url.render_as_string(hide_password=False)
+        for case in args.cases:
+            try:
+                measurement = run_case_in_subprocess(case, postgres_url, mysql_url, extra_env)
+            except RuntimeError as e:
+                # E.g. v1 going over the bind parameter limit of the database, the other cases are still measured.
+                results.append({'scale': scale, 'case': case, 'error': str(e)})
+                print(f'[{scale}] {case:<17} failed', flush=True)
+                continue
+            measurement.update({
+                'scale': scale,
+                'users': config.users,
+                'lesson_completion_rows': lesson_completion_rows,
+                'rows_per_second': round(lesson_completion_rows / measurement['wall_seconds'], 1),
+            })
+            results.append(measurement)
+            print(f"[{scale}] {case:<17} {measurement['wall_seconds']:>9.3f}s "
+                  f"{measurement['peak_memory_mb']:>9.1f} MB {measurement['rows_per_second']:>13,.0f} rows/s "
+                  f"({measurement['report_rows']} report rows)", flush=True)
+
+    return {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': _get_git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'target': args.target,
+        'db_stream_results': args.db_stream_results,
+        'data': {
+            'active_ratio': args.active_ratio,
+            'lessons_per_day': args.lessons_per_day,
+            'days': args.days,
+            'skew': args.skew,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+
+
+def compare_results(current: Dict, baseline: Dict, threshold: float = 0.1) -> List[str]:
+    """
+    Compares two benchmark runs, case by case.
+
+    Args:
+        current: Dict: The results of this run
+        baseline: Dict: The results to compare against
+        threshold: float: Relative increase of the wall time or peak memory that counts as a regression
+
+    Returns:
+        A description of every regression, empty if there are none
+    """
+    baseline_results = {(result['scale'], result['case']): result for result in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        baseline_result = baseline_results.get((result['scale'], result['case']))
+        if baseline_result is None or 'error' in baseline_result:
+            continue
+        if 'error' in result:
+            regressions.append(f"[{result['scale']}] {result['case']}: failed, it passed in the baseline")
+            continue
+        for metric in ('wall_seconds', 'peak_memory_mb'):
+            # Memory increases below a megabyte are noise from the sampling.
+            if metric == 'peak_memory_mb' and result[metric] - baseline_result[metric] < 1:
+                continue
+            if baseline_result[metric] > 0 and result[metric] > baseline_result[metric] * (1 + threshold):
+                regressions.append(
+                    f"[{result['scale']}] {result['case']}: {metric} went from "
+                    f"{baseline_result[metric]} to {result[metric]} "
+                    f"(+{(result[metric] / baseline_result[metric] - 1) * 100:.0f}%)"
+                )
+    return regressions
+
+
+def _get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=PROJECT_ROOT,
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the customer_x report on synthetic data.')
+    parser.add_argument('--scales', nargs='+', default=['10k'], help=f'Data sizes to run: {", ".join(SCALES)} or a number of rows.')
+    parser.add_argument('--cases', nargs='+', choices=BENCHMARK_CASES, default=BENCHMARK_CASES)
+    parser.add_argument('--db-stream-results', action='store_true', help='Run with db_stream_results enabled.')
+    parser.add_argument('--output', type=Path, help='Where to write the results. Default: benchmarks/results/<timestamp>.json')
+    parser.add_argument('--compare', type=Path, help='Results of an earlier run, to check for regressions.')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Relative slowdown that counts as a regression.')
+    parser.add_argument('--replace', action='store_true', help='Needed with --target docker, the tables are overwritten.')
+    add_data_arguments(parser)
+    # Internal, used for the measurements in a fresh interpreter.
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    parser.add_argument('--postgres-url', help=argparse.SUPPRESS)
+    parser.add_argument('--mysql-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args.postgres_url, args.mysql_url)))
+        return
+
+    if args.target == 'docker' and not args.replace:
+        parser.error('--target docker overwrites mindtickle_users and lesson_completion, pass --replace to confirm.')
+
+    results = run_suite(args)
+    output = args.output or DEFAULT_RESULTS_DIR / f"customer_x-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f'Results written to {output}')
+
+    if args.compare:
+        regressions = compare_results(results, json.loads(args.compare.read_text()), args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
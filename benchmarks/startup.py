@@ -0,0 +1,71 @@
+"""
+Measures how long the report generation script takes to start, for the invocations that should stay fast
+(argument validation, listing the report types), next to the cost of loading the full report generation code.
+
+Run it from the project root:
+    python -m benchmarks.startup --runs 20
+"""
+from pathlib import Path
+from typing import Dict, List
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+
+PROJECT_ROOT = Path(__file__).parents[1]
+
+# Every invocation runs in a fresh interpreter, the same way the scheduler runs the script.
+INVOCATIONS = {
+    'help': [sys.executable, 'main.py', '--help'],
+    'list': [sys.executable, 'main.py', '--list'],
+    'invalid_report_type': [sys.executable, 'main.py', 'not_a_report'],
+    'bare_interpreter': [sys.executable, '-c', 'pass'],
+    # What a real report run pays for on top of the startup, before it talks to any database.
+    'import_report_generator': [sys.executable, '-c', 'import report.generator'],
+}
+
+
+def time_invocation(command: List[str], runs: int) -> Dict[str, float]:
+    """
+    Runs a command a number of times, and returns its wall times in milliseconds.
+
+    Args:
+        command: List[str]: The command to run.
+        runs: int: Number of timed runs, after one warm up run.
+
+    Returns:
+        The min, median and max wall time of the runs.
+    """
+    subprocess.run(command, cwd=PROJECT_ROOT, capture_output=True, check=False)
+    wall_times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(command, cwd=PROJECT_ROOT, capture_output=True, check=False)
+        wall_times.append((time.perf_counter() - started) * 1000)
+
+    return {
+        'min_ms': round(min(wall_times), 1),
+        'median_ms': round(statistics.median(wall_times), 1),
+        'max_ms': round(max(wall_times), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the startup time of main.py.')
+    parser.add_argument('--runs', type=int, default=10, help='Number of timed runs per invocation.')
+    parser.add_argument('--output', type=Path, help='Also write the results to this json file.')
+    args = parser.parse_args()
+
+    results = {name: time_invocation(command, args.runs) for name, command in INVOCATIONS.items()}
+
+    for name, timings in results.items():
+        print(f"{name:<25} min {timings['min_ms']:>8} ms   median {timings['median_ms']:>8} ms   max {timings['max_ms']:>8} ms")
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+"""
+Deterministic synthetic data for the customer_x report: mindtickle_users for PostgreSQL and lesson_completion
+for MySQL, at any scale. The same config (and reference date) always produces exactly the same rows.
+
+Load the dockerised databases from setup/ (using the connection details in the .env):
+    python -m benchmarks.synthetic_data --rows 1m --target docker --replace
+
+Or a pair of local SQLite files standing in for them:
+    python -m benchmarks.synthetic_data --rows 1m --target sqlite --data-dir /tmp/customer_x_bench
+"""
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Iterator, Tuple
+import argparse
+import io
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Table, create_engine, delete, func, insert, select
+from sqlalchemy.engine import Connection, Engine
+
+from database.models import MindUsers, LessonCompletion, LessonCompletionRollup, LessonCompletionRollupDay
+
+
+logger = logging.getLogger(__name__)
+
+# Shorthands for the benchmark scales, in lesson_completion rows.
+SCALES = {
+    '10k': 10_000,
+    '1m': 1_000_000,
+    '10m': 10_000_000,
+}
+
+NUMBER_OF_LESSONS = 1000
+
+
+@dataclass(frozen=True)
+class SyntheticDataConfig:
+    """
+    Shape of the synthetic data.
+
+    users: Number of rows in mindtickle_users.
+    active_ratio: Share of the users that are active.
+    lessons_per_day: Average number of lessons completed per user per day.
+    days: Number of days, ending on the reference date, the completions are spread over.
+        The report only looks at the last 60 days (excluding today), so anything above that is filtered out.
+    skew: Zipf exponent of the lessons completed per user. 0 gives every user the same expected number of
+        lessons, 1 gives the busiest user about as many as the 100 quietest users together.
+    seed: Seed of the random generator.
+    reference_date: The last day with completions. Defaults to today, since the report window is relative to today.
+    """
+    users: int = 10_000
+    active_ratio: float = 0.8
+    lessons_per_day: float = 0.5
+    days: int = 70
+    skew: float = 1.0
+    seed: int = 42
+    reference_date: date = field(default_factory=date.today)
+
+    @classmethod
+    def for_rows(cls, rows: int, **options) -> 'SyntheticDataConfig':
+        """
+        Builds a config with about `rows` lesson completions, by picking the number of users.
+        """
+        lessons_per_day = options.get('lessons_per_day', cls.lessons_per_day)
+        days = options.get('days', cls.days)
+        users = max(1, round(rows / (lessons_per_day * days)))
+        return cls(users=users, **options)
+
+    @property
+    def lesson_completion_rows(self) -> int:
+        return round(self.users * self.lessons_per_day * self.days)
+
+
+def generate_users(config: SyntheticDataConfig) -> pd.DataFrame:
+    """
+    Generates mindtickle_users.
+
+    Args:
+        config: SyntheticDataConfig: Shape of the data
+
+    Returns:
+        A dataframe with the user_id, user_name and active_status columns
+    """
+    rng = np.random.default_rng([config.seed, 0])
+    user_ids = np.arange(1, config.users + 1)
+    active = rng.random(config.users) < config.active_ratio
+    return pd.DataFrame({
+        'user_id': user_ids,
+        'user_name': [f'User{user_id}' for user_id in user_ids],
+        'active_status': np.where(active, 'active', 'inactive'),
+    })
+
+
+def get_user_weights(config: SyntheticDataConfig) -> np.ndarray:
+    """
+    Returns the probability of every user to be the one completing a lesson. The busiest users are spread
+    randomly over the user ids, so the skew hits every chunk of the report, not just the first one.
+    """
+    rng = np.random.default_rng([config.seed, 1])
+    ranks = rng.permutation(config.users) + 1
+    weights = 1.0 / np.power(ranks, config.skew)
+    return weights / weights.sum()
+
+
+def iter_lesson_completion_chunks(config: SyntheticDataConfig, chunk_rows: int = 100_000) -> Iterator[pd.DataFrame]:
+    """
+    Generates lesson_completion in chunks, so even 10M rows never have to be held in memory at once.
+    Every chunk has its own random stream, derived from the seed and the position of the chunk.
+
+    Args:
+        config: SyntheticDataConfig: Shape of the data
+        chunk_rows: int: Number of rows per chunk
+
+    Returns:
+        An iterator over the chunks, with the user_id, lesson_id and completion_date columns
+    """
+    user_weights = get_user_weights(config)
+    user_ids = np.arange(1, config.users + 1)
+    reference_day = np.datetime64(config.reference_date, 'D')
+
+    total_rows = config.lesson_completion_rows
+    for chunk_number, chunk_start in enumerate(range(0, total_rows, chunk_rows)):
+        rows = min(chunk_rows, total_rows - chunk_start)
+        rng = np.random.default_rng([config.seed, 2, chunk_number])
+        completion_days = reference_day - rng.integers(0, config.days, size=rows).astype('timedelta64[D]')
+        yield pd.DataFrame({
+            'user_id': rng.choice(user_ids, size=rows, p=user_weights),
+            'lesson_id': rng.integers(1, NUMBER_OF_LESSONS + 1, size=rows),
+            'completion_date': pd.Series(completion_days).dt.date,
+        })
+
+
+def insert_frame(connection: Connection, table: Table, frame: pd.DataFrame):
+    """
+    Bulk inserts a dataframe. PostgreSQL gets a COPY, everything else a single executemany.
+    """
+    if connection.dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        frame.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert(f'COPY {table.name} ({", ".join(frame.columns)}) FROM STDIN WITH (FORMAT csv)', buffer)
+        finally:
+            cursor.close()
+    else:
+        connection.execute(insert(table), frame.to_dict('records'))
+
+
+def load_synthetic_data(
+        config: SyntheticDataConfig,
+        postgres_engine: Engine,
+        mysql_engine: Engine,
+        replace: bool = False,
+        chunk_rows: int = 100_000
+) -> Tuple[int, int]:
+    """
+    Loads the synthetic data into the users (PostgreSQL) and lessons (MySQL) databases, creating the tables
+    if they don't exist yet. The rollup of the incremental strategy is emptied, since it belongs to the old data.
+
+    Args:
+        config: SyntheticDataConfig: Shape of the data
+        postgres_engine: Engine: Engine of the users database, or its stand-in
+        mysql_engine: Engine: Engine of the lessons database, or its stand-in
+        replace: bool: Delete the rows already in the tables. Without it, loading into non-empty tables fails.
+        chunk_rows: int: Number of lesson_completion rows generated and inserted at a time
+
+    Returns:
+        The number of users and lesson completions loaded
+    """
+    user_tables = [MindUsers.__table__, LessonCompletionRollup.__table__, LessonCompletionRollupDay.__table__]
+    MindUsers.metadata.create_all(postgres_engine, tables=user_tables)
+    LessonCompletion.metadata.create_all(mysql_engine, tables=[LessonCompletion.__table__])
+
+    with postgres_engine.begin() as postgres_connection, mysql_engine.begin() as mysql_connection:
+        for connection, table in ((postgres_connection, MindUsers.__table__), (mysql_connection, LessonCompletion.__table__)):
+            existing_rows = connection.execute(select(func.count()).select_from(table)).scalar()
+            if existing_rows and not replace:
+                raise ValueError(f'{table.name} already has {existing_rows} rows, pass replace=True to overwrite them.')
+            connection.execute(delete(table))
+        for table in user_tables[1:]:
+            postgres_connection.execute(delete(table))
+
+        insert_frame(postgres_connection, MindUsers.__table__, generate_users(config))
+
+        loaded_rows = 0
+        for lesson_completion_chunk in iter_lesson_completion_chunks(config, chunk_rows):
+            insert_frame(mysql_connection, LessonCompletion.__table__, lesson_completion_chunk)
+            loaded_rows += len(lesson_completion_chunk)
+            logger.debug(f'Loaded {loaded_rows} of {config.lesson_completion_rows} lesson completions.')
+
+    return config.users, loaded_rows
+
+
+def get_sqlite_engines(data_dir: Path) -> Tuple[Engine, Engine]:
+    """
+    Returns the engines of the SQLite files standing in for the users and lessons databases.
+    """
+    data_dir.mkdir(parents=True, exist_ok=True)
+    return create_engine(f'sqlite:///{data_dir / "users.db"}'), create_engine(f'sqlite:///{data_dir / "lessons.db"}')
+
+
+def get_engines(target: str, data_dir: Path) -> Tuple[Engine, Engine]:
+    """
+    Returns the users and lessons engines of a benchmark target: `docker` for the databases in the .env
+    (like the ones from setup/docker-compose.yaml), `sqlite` for local stand-ins in data_dir.
+    """
+    if target == 'sqlite':
+        return get_sqlite_engines(data_dir)
+    from database.connections import get_postgres_engine, get_mysql_engine
+    return get_postgres_engine(), get_mysql_engine()
+
+
+def parse_rows(rows: str) -> int:
+    return SCALES[rows.lower()] if rows.lower() in SCALES else int(rows)
+
+
+def add_data_arguments(parser: argparse.ArgumentParser):
+    """
+    The options shaping the synthetic data, shared by the loader and the benchmark suite.
+    """
+    defaults = SyntheticDataConfig()
+    parser.add_argument('--target', choices=['sqlite', 'docker'], default='sqlite', help='Where to load the data.')
+    parser.add_argument('--data-dir', type=Path, default=Path('benchmarks/data'), help='Directory of the SQLite stand-ins.')
+    parser.add_argument('--active-ratio', type=float, default=defaults.active_ratio)
+    parser.add_argument('--lessons-per-day', type=float, default=defaults.lessons_per_day)
+    parser.add_argument('--days', type=int, default=defaults.days)
+    parser.add_argument('--skew', type=float, default=defaults.skew)
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+
+
+def config_from_args(args: argparse.Namespace, rows: int) -> SyntheticDataConfig:
+    return SyntheticDataConfig.for_rows(
+        rows,
+        active_ratio=args.active_ratio,
+        lessons_per_day=args.lessons_per_day,
+        days=args.days,
+        skew=args.skew,
+        seed=args.seed
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load deterministic synthetic data for the customer_x report.')
+    parser.add_argument('--rows', default='10k', help=f'Lesson completions to generate: {", ".join(SCALES)} or a number.')
+    parser.add_argument('--replace', action='store_true', help='Delete the rows already in the tables.')
+    add_data_arguments(parser)
+    args = parser.parse_args()
+
+    config = config_from_args(args, parse_rows(args.rows))
+    postgres_engine, mysql_engine = get_engines(args.target, args.data_dir)
+    started = time.perf_counter()
+    users, lesson_completions = load_synthetic_data(config, postgres_engine, mysql_engine, replace=args.replace)
+    print(f'Loaded {users} users and {lesson_completions} lesson completions in {time.perf_counter() - started:.1f}s.')
+
+
+if __name__ == '__main__':
+    main()
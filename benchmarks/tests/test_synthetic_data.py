@@ -0,0 +1,87 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select
+
+from benchmarks.customer_x import compare_results, run_case
+from benchmarks.synthetic_data import (
+    SyntheticDataConfig,
+    generate_users,
+    get_sqlite_engines,
+    get_user_weights,
+    iter_lesson_completion_chunks,
+    load_synthetic_data
+)
+from database.models import LessonCompletion
+
+
+CONFIG = SyntheticDataConfig.for_rows(20_000, reference_date=date(2023, 9, 20))
+
+
+def test_for_rows_picks_the_number_of_users():
+    assert CONFIG.users == 571
+    assert abs(CONFIG.lesson_completion_rows - 20_000) < CONFIG.lessons_per_day * CONFIG.days
+
+
+def test_generated_data_is_deterministic_and_independent_of_the_chunk_size():
+    first = pd.concat(iter_lesson_completion_chunks(CONFIG, chunk_rows=5_000), ignore_index=True)
+    second = pd.concat(iter_lesson_completion_chunks(CONFIG, chunk_rows=5_000), ignore_index=True)
+    pd.testing.assert_frame_equal(first, second)
+    pd.testing.assert_frame_equal(generate_users(CONFIG), generate_users(CONFIG))
+
+    other_seed = pd.concat(iter_lesson_completion_chunks(SyntheticDataConfig.for_rows(20_000, seed=7, reference_date=CONFIG.reference_date)))
+    assert not first['user_id'].equals(other_seed['user_id'].reset_index(drop=True))
+
+
+def test_generated_data_follows_the_config():
+    users = generate_users(CONFIG)
+    lesson_completions = pd.concat(iter_lesson_completion_chunks(CONFIG, chunk_rows=5_000), ignore_index=True)
+
+    assert len(lesson_completions) == CONFIG.lesson_completion_rows
+    assert users['user_id'].tolist() == list(range(1, CONFIG.users + 1))
+    assert abs((users['active_status'] == 'active').mean() - CONFIG.active_ratio) < 0.05
+    assert lesson_completions['user_id'].between(1, CONFIG.users).all()
+    assert lesson_completions['completion_date'].max() == CONFIG.reference_date
+    assert lesson_completions['completion_date'].min() > date(2023, 9, 20) - pd.Timedelta(days=CONFIG.days)
+
+
+def test_skew_concentrates_the_lessons_on_a_few_users():
+    def top_share(skew):
+        weights = np.sort(get_user_weights(SyntheticDataConfig(users=1000, skew=skew)))[::-1]
+        return weights[:10].sum()
+
+    assert abs(top_share(0) - 0.01) < 1e-9
+    assert top_share(1.0) > 0.3
+
+
+def test_load_and_benchmark_a_case(tmp_path):
+    config = SyntheticDataConfig.for_rows(2_000)
+    postgres_engine, mysql_engine = get_sqlite_engines(tmp_path)
+    load_synthetic_data(config, postgres_engine, mysql_engine)
+
+    with mysql_engine.connect() as connection:
+        assert connection.execute(select(func.count()).select_from(LessonCompletion.__table__)).scalar() == config.lesson_completion_rows
+
+    serial = run_case('serial', str(postgres_engine.url), str(mysql_engine.url))
+    v1 = run_case('v1', str(postgres_engine.url), str(mysql_engine.url))
+    assert serial['report_rows'] == v1['report_rows'] > 0
+    assert serial['wall_seconds'] > 0
+
+
+def test_compare_results():
+    baseline = {'results': [
+        {'scale': '10k', 'case': 'serial', 'wall_seconds': 1.0, 'peak_memory_mb': 10.0},
+        {'scale': '10k', 'case': 'staged_join', 'wall_seconds': 1.0, 'peak_memory_mb': 10.0},
+    ]}
+    current = {'results': [
+        {'scale': '10k', 'case': 'serial', 'wall_seconds': 1.05, 'peak_memory_mb': 20.0},
+        {'scale': '10k', 'case': 'staged_join', 'wall_seconds': 1.5, 'peak_memory_mb': 10.0},
+        {'scale': '1m', 'case': 'serial', 'wall_seconds': 9.0, 'peak_memory_mb': 10.0},
+    ]}
+
+    regressions = compare_results(current, baseline, threshold=0.1)
+
+    assert len(regressions) == 2
+    assert regressions[0].startswith('[10k] serial: peak_memory_mb')
+    assert regressions[1].startswith('[10k] staged_join: wall_seconds')
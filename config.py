@@ -6,13 +6,16 @@ from pydantic import (
     PostgresDsn,
     MySQLDsn,
     field_validator,
+    model_validator,
     ValidationError
 )
 from pydantic_core.core_schema import FieldValidationInfo
 from typing import (
     Any,
+    Literal,
     Optional
 )
+from functools import lru_cache
 from pathlib import Path
 import logging
 import os
@@ -44,6 +47,106 @@ class Settings(BaseSettings):
     postgres_url: Optional[PostgresDsn] = None
     mysql_url: Optional[MySQLDsn] = None
 
+    # Streaming uploads are sent to S3 as multipart uploads.
+    # S3 needs every part except the last one to be at least 5 MiB.
+    s3_multipart_part_size: int = 8 * 1024 * 1024
+    s3_max_pending_parts: int = 4
+
+    # The S3 client is shared by the whole process. Uploads larger than s3_multipart_part_size (and streamed ones)
+    # send s3_transfer_concurrency parts at a time, keep it within s3_max_pool_connections.
+    s3_max_pool_connections: int = 10
+    s3_transfer_concurrency: int = 4
+    # Every report is uploaded with the SHA-256 of its content in the object metadata. When the object already
+    # has the same content, it is not uploaded again. Reports built in memory are stored under that hash, so this
+    # skips the upload of a report generated again with the same content.
+    s3_skip_unchanged_uploads: bool = True
+
+    # Number of active users per chunk of the report. With report_adaptive_chunks set, the serial fetch strategy only
+    # starts from it, and sizes every next chunk to keep the merged chunk within report_chunk_memory_budget bytes,
+    # and its queries within report_chunk_target_seconds, going by the chunks fetched so far.
+    report_chunk_size: int = 1000
+    report_adaptive_chunks: bool = False
+    report_chunk_memory_budget: int = 64 * 1024 * 1024
+    report_chunk_target_seconds: float = 2.0
+
+    # Number of MySQL workers used by the pipelined fetch strategy.
+    # Each worker holds its own connection, so keep it within the engine pool size.
+    report_fetch_concurrency: int = 4
+
+    # Read the report queries through server-side (PostgreSQL) / unbuffered (MySQL) cursors,
+    # fetching db_stream_fetch_size rows per round trip, instead of buffering whole result sets on the client.
+    db_stream_results: bool = False
+    db_stream_fetch_size: int = 1000
+    # Read the active users with PostgreSQL COPY ... TO STDOUT, and the lessons on an unbuffered MySQL cursor, straight
+    # into column arrays, instead of pd.read_sql building a Python row per result row. Takes over db_stream_results.
+    db_bulk_export: bool = False
+
+    # The incremental fetch strategy always rolls up the last rollup_late_arrival_days days of the window again,
+    # to pick up lesson completions that arrive late.
+    rollup_late_arrival_days: int = 2
+
+    # Connection pool of each database engine. Reports generated in a batch share the pools, so keep
+    # report_batch_workers (times report_fetch_concurrency, for the pipelined strategy) within pool size + overflow.
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+
+    # Number of reports generated at the same time in batch mode.
+    report_batch_workers: int = 4
+
+    # Every report records the time, rows, bytes and memory of each of its stages. The summary is logged,
+    # saved with the report, and written as a Prometheus textfile to metrics_textfile_dir if it is set.
+    metrics_textfile_dir: Optional[str] = None
+    metrics_sample_interval: float = 0.01
+
+    # Cast every report column to a compact dtype as soon as it is fetched (categorical names, nullable small
+    # integers, datetime64 dates), instead of object and float64 columns.
+    report_typed_schema: bool = False
+    # Integers are always range checked before they are downcast. `widen` moves to the next integer type that
+    # holds the values, `raise` fails the report.
+    report_integer_overflow: Literal['widen', 'raise'] = 'widen'
+
+    # Number of days (up to yesterday) in the customer_x_daily report. Apart from the serial one, the fetch strategies
+    # (and --async) build it from the customer_x report, which only covers the last 59 whole days: they refuse more days.
+    report_daily_days: int = 30
+
+    # Delta reports are generated against the latest full report of the same type and format from up to this many days
+    # ago, and the delta grows every day until the next full report. Without one that recent, a full report is generated.
+    report_delta_max_base_age_days: int = 7
+
+    # Number of user_id ranges of the sharded fetch strategy, and of the worker processes fetching them, which is also
+    # the number of shards in flight. Default: the number of CPUs. Every worker holds a connection to each database.
+    report_shard_count: Optional[int] = None
+    report_shard_workers: Optional[int] = None
+
+    # Where the resumable fetch strategy checkpoints the chunks of a report until it is saved.
+    report_checkpoint_dir: str = 'report_checkpoints'
+
+    # Read the active users from a local snapshot (a parquet file in report_active_users_cache_dir) for as long as
+    # they are unchanged: the same number of active users, the same highest user_id, and no write to mindtickle_users
+    # since the snapshot. Snapshots older than the TTL are taken again anyway, the oldest go beyond the size cap.
+    report_active_users_cache: bool = False
+    report_active_users_cache_dir: str = 'report_cache/active_users'
+    report_active_users_cache_ttl_seconds: int = 6 * 60 * 60
+    report_active_users_cache_max_bytes: int = 256 * 1024 * 1024
+
+    # Reports generated with the asyncio engine share one event loop. These cap the queries and the S3 uploads
+    # running at the same time across all of its reports, keep async_query_concurrency within pool size + overflow.
+    async_query_concurrency: int = 8
+    async_upload_concurrency: int = 4
+
+    # The report service (`python main.py --serve`) generates report_batch_workers reports at a time, and queues
+    # up to service_max_queued_reports more. Requests beyond that are turned away until the queue drains.
+    service_host: str = '127.0.0.1'
+    service_port: int = 8080
+    service_max_queued_reports: int = 32
+
+    @model_validator(mode='after')
+    def check_active_users_cache(self) -> 'Settings':
+        # The snapshot is read in chunks of one size, the adaptive chunks page the users by keyset instead.
+        if self.report_active_users_cache and self.report_adaptive_chunks:
+            raise ValueError('report_active_users_cache can not be combined with report_adaptive_chunks, turn one of them off.')
+        return self
+
     @field_validator("postgres_url", mode='before')
     @classmethod
     def assemble_pgsql_connection(cls, v: Optional[str], info: FieldValidationInfo) -> Any:
@@ -75,9 +178,24 @@ class Settings(BaseSettings):
         return str(mysql_dsn)
 
 
-try:
-    settings = Settings()
-except Exception as e:
-    logger.exception(f'Validation failed for system config. Details : {e}')
-    exit(1)
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """
+    Validates the system config the first time it is needed, and returns the same Settings object after that.
+    Scripts that never touch the databases or S3 (like `main.py --help`) never pay for it.
+
+    Returns:
+        The validated system config.
+    """
+    try:
+        return Settings()
+    except Exception as e:
+        logger.exception(f'Validation failed for system config. Details : {e}')
+        exit(1)
+
 
+def __getattr__(name: str) -> Any:
+    # `from config import settings` keeps working, the config is only validated on first access.
+    if name == 'settings':
+        return get_settings()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,49 @@
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from config import get_settings
+
+
+# The async engines use the asyncio drivers of the same databases: asyncpg for PostgreSQL, aiomysql for MySQL.
+# Their connections belong to the event loop they were opened on, so unlike the sync engines they are not
+# shared module wide: whoever runs the event loop creates them, and disposes of them before the loop closes.
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'mysql': 'mysql+aiomysql',
+}
+
+
+def get_async_url(url: str) -> URL:
+    """
+    Returns the same database URL, with the asyncio driver of its database.
+
+    Args:
+        url: str: A database URL, like the postgres_url and mysql_url settings.
+
+    Returns:
+        The URL for create_async_engine.
+    """
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f'No asyncio driver configured for {backend} databases.')
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def create_async_postgres_engine() -> AsyncEngine:
+    settings = get_settings()
+    return create_async_engine(
+        get_async_url(str(settings.postgres_url)),
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow
+    )
+
+
+def create_async_mysql_engine() -> AsyncEngine:
+    settings = get_settings()
+    return create_async_engine(
+        get_async_url(str(settings.mysql_url)),
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow
+    )
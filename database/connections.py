@@ -1,16 +1,81 @@
+from functools import wraps
+from typing import Any, Callable, TypeVar
+import threading
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
 
-from config import settings
+from config import get_settings
+
+
+# The engines (and the database drivers behind them) are only created the first time a report needs them,
+# so a report only pays for the databases it actually reads from.
+# Reports generated in a batch share these engines, and their connection pools, across threads.
+
+T = TypeVar('T')
+_creation_lock = threading.RLock()
+
+
+def _create_once(create: Callable[[], T]) -> Callable[[], T]:
+    # Unlike lru_cache, makes sure two threads asking at the same time don't end up with two engines.
+    created = []
+
+    @wraps(create)
+    def get() -> T:
+        if not created:
+            with _creation_lock:
+                if not created:
+                    created.append(create())
+        return created[0]
+
+    return get
+
+
+@_create_once
+def get_postgres_engine() -> Engine:
+    settings = get_settings()
+    # Converted to string because Pydantic returns a different object
+    # Which does not work well with create_engine
+    return create_engine(
+        str(settings.postgres_url),
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow
+    )
+
+
+@_create_once
+def get_mysql_engine() -> Engine:
+    settings = get_settings()
+    return create_engine(
+        str(settings.mysql_url),
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow
+    )
+
+
+@_create_once
+def get_postgres_session_class() -> sessionmaker:
+    return sessionmaker(bind=get_postgres_engine())
+
+
+@_create_once
+def get_mysql_session_class() -> sessionmaker:
+    return sessionmaker(bind=get_mysql_engine())
 
 
-# Converted to string because Pydantic returns a different object
-# Which does not work well with create_engine
-POSTGRES_DB_URL = str(settings.postgres_url)
-MYSQL_DB_URL = str(settings.mysql_url)
+# The module level names these lazy getters replaced, for `from database.connections import PostgresSession`.
+_LAZY_ATTRIBUTES = {
+    'POSTGRES_DB_URL': lambda: str(get_settings().postgres_url),
+    'MYSQL_DB_URL': lambda: str(get_settings().mysql_url),
+    'postgres_engine': get_postgres_engine,
+    'mysql_engine': get_mysql_engine,
+    'PostgresSession': get_postgres_session_class,
+    'MysqlSession': get_mysql_session_class,
+}
 
-postgres_engine = create_engine(POSTGRES_DB_URL)
-PostgresSession = sessionmaker(bind=postgres_engine)
 
-mysql_engine = create_engine(MYSQL_DB_URL)
-MysqlSession = sessionmaker(bind=mysql_engine)
+def __getattr__(name: str) -> Any:
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -4,5 +4,13 @@ CREATE TABLE reports_generated(
     s3_bucket VARCHAR (255) NOT NULL,
     report_date DATE NOT NULL,
     report_type VARCHAR (255) NOT NULL,
-    download_link TEXT NOT NULL
-);
\ No newline at end of file
+    download_link TEXT NOT NULL,
+    report_format VARCHAR (32) NOT NULL DEFAULT 'csv',
+    report_parameters TEXT NOT NULL DEFAULT '{}',
+    metrics TEXT,
+    base_report_id UUID REFERENCES reports_generated (report_id),
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX ix_reports_generated_type_date_created_at ON reports_generated (report_type, report_date, created_at, report_id);
+CREATE INDEX ix_reports_generated_date_created_at ON reports_generated (report_date, created_at, report_id);
@@ -0,0 +1,148 @@
+"""
+Applies the versioned migrations in database/migrations/<database>/ in order, and records every applied version
+in a schema_migrations table of that database, so each migration runs exactly once:
+
+    python -m database.migrate postgres mysql
+    python -m database.migrate postgres --dry-run
+
+Databases that were migrated by hand before the runner existed can record the versions already applied
+without running them again:
+
+    python -m database.migrate postgres --fake-through 4
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set
+import argparse
+import logging
+import re
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, insert, select
+from sqlalchemy.engine import Connection, Engine
+
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).parent / 'migrations'
+
+schema_migrations = Table(
+    'schema_migrations',
+    MetaData(),
+    Column('version', Integer, primary_key=True, autoincrement=False),
+    Column('name', String(255), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+_MIGRATION_FILE_NAME = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    path: Path
+
+    @property
+    def statements(self) -> List[str]:
+        """
+        The statements of the migration file. Comment lines are dropped, and statements are split on `;`,
+        so a migration can't have a `;` inside a statement (no procedures or string literals with one).
+        """
+        lines = [line for line in self.path.read_text().splitlines() if not line.strip().startswith('--')]
+        return [statement.strip() for statement in '\n'.join(lines).split(';') if statement.strip()]
+
+
+def list_migrations(directory: Path) -> List[Migration]:
+    """
+    Returns the migrations of a directory, ordered by version. Files are named `<version>_<name>.sql`.
+
+    Args:
+        directory: Path: Directory of the migrations of one database.
+
+    Returns:
+        The migrations, in the order they have to be applied.
+    """
+    migrations = []
+    for path in directory.glob('*.sql'):
+        match = _MIGRATION_FILE_NAME.match(path.name)
+        if match is None:
+            raise ValueError(f'Migration file names should look like 001_description.sql: {path}')
+        migrations.append(Migration(int(match.group(1)), match.group(2), path))
+
+    migrations.sort(key=lambda migration: migration.version)
+    versions = [migration.version for migration in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f'Two migrations in {directory} have the same version.')
+    return migrations
+
+
+def get_applied_versions(connection: Connection) -> Set[int]:
+    schema_migrations.create(connection, checkfirst=True)
+    return set(connection.scalars(select(schema_migrations.c.version)))
+
+
+def apply_migrations(
+        engine: Engine,
+        directory: Path,
+        fake_through: Optional[int] = None,
+        dry_run: bool = False
+) -> List[Migration]:
+    """
+    Applies the migrations of `directory` that were not applied to the database yet, one transaction each.
+    MySQL commits DDL statements implicitly, so there a failed migration can be left half applied,
+    and has to be fixed by hand before running again.
+
+    Args:
+        engine: Engine: Engine of the database to migrate.
+        directory: Path: Directory of the migrations of that database.
+        fake_through: Optional[int]: Record the pending migrations up to this version as applied, without running them.
+        dry_run: bool: Only return the pending migrations.
+
+    Returns:
+        The migrations that were (or, with dry_run, would be) applied or recorded.
+    """
+    with engine.begin() as connection:
+        applied_versions = get_applied_versions(connection)
+    pending = [migration for migration in list_migrations(directory) if migration.version not in applied_versions]
+    if dry_run:
+        return pending
+
+    for migration in pending:
+        faked = fake_through is not None and migration.version <= fake_through
+        with engine.begin() as connection:
+            if not faked:
+                for statement in migration.statements:
+                    connection.exec_driver_sql(statement)
+            connection.execute(
+                insert(schema_migrations),
+                {'version': migration.version, 'name': migration.name, 'applied_at': datetime.now()}
+            )
+        logger.info(f"{'Recorded' if faked else 'Applied'} migration {migration.path.name} on {engine.url.database}.")
+
+    return pending
+
+
+def _get_engines() -> Dict[str, Callable[[], Engine]]:
+    from database.connections import get_postgres_engine, get_mysql_engine
+    return {'postgres': get_postgres_engine, 'mysql': get_mysql_engine}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply the pending database migrations.')
+    parser.add_argument('databases', nargs='+', choices=['postgres', 'mysql'])
+    parser.add_argument('--dry-run', action='store_true', help='Only list the pending migrations.')
+    parser.add_argument('--fake-through', type=int, help='Record the migrations up to this version as applied, without running them.')
+    args = parser.parse_args()
+    if args.fake_through is not None and len(args.databases) > 1:
+        parser.error('--fake-through applies to a single database.')
+
+    engines = _get_engines()
+    for database in args.databases:
+        migrations = apply_migrations(engines[database](), MIGRATIONS_DIR / database, args.fake_through, args.dry_run)
+        action = 'Pending' if args.dry_run else 'Applied'
+        print(f"[{database}] {action}: {', '.join(migration.path.name for migration in migrations) or 'none'}")
+
+
+if __name__ == '__main__':
+    main()
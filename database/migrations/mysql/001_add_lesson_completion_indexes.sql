@@ -0,0 +1,13 @@
+-- Covering indexes for the lesson_completion queries of the customer_x report, so they are range scans
+-- over the index instead of full table scans, and the GROUP BY / ORDER BY follow the index instead of a filesort.
+-- InnoDB builds secondary indexes online, without blocking writes to the table.
+
+-- user_id IN (...) / staged join, grouped and ordered by user_id, completion_date.
+CREATE INDEX ix_lesson_completion_user_id_completion_date
+    ON lesson_completion (user_id, completion_date, lesson_id)
+    ALGORITHM=INPLACE LOCK=NONE;
+
+-- completion_date IN (...) of the rollup refresh, grouped by completion_date, user_id.
+CREATE INDEX ix_lesson_completion_completion_date_user_id
+    ON lesson_completion (completion_date, user_id, lesson_id)
+    ALGORITHM=INPLACE LOCK=NONE;
@@ -0,0 +1,14 @@
+CREATE TABLE lesson_completion_daily_rollup(
+    user_id INTEGER NOT NULL,
+    completion_date DATE NOT NULL,
+    lessons_completed INTEGER NOT NULL,
+    PRIMARY KEY (user_id, completion_date)
+);
+
+CREATE INDEX ix_lesson_completion_daily_rollup_completion_date
+    ON lesson_completion_daily_rollup (completion_date);
+
+CREATE TABLE lesson_completion_rollup_days(
+    completion_date DATE PRIMARY KEY,
+    rolled_up_at TIMESTAMP NOT NULL
+);
@@ -0,0 +1,2 @@
+ALTER TABLE reports_generated
+    ADD COLUMN report_format VARCHAR (32) NOT NULL DEFAULT 'csv';
@@ -0,0 +1,6 @@
+ALTER TABLE reports_generated
+    ADD COLUMN report_parameters TEXT NOT NULL DEFAULT '{}';
+
+-- Reports generated before this migration were all csv reports.
+UPDATE reports_generated
+    SET report_parameters = '{"report_format": "' || report_format || '"}';
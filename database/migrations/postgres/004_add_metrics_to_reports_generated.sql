@@ -0,0 +1,2 @@
+ALTER TABLE reports_generated
+    ADD COLUMN metrics TEXT;
@@ -0,0 +1,5 @@
+-- The active users, in user_id order, straight from the index (an index only scan, user_name is included),
+-- instead of a sequential scan of mindtickle_users and a sort.
+-- Not a partial index on active_status = 'active': those can't be used by generic plans of prepared statements.
+CREATE INDEX IF NOT EXISTS ix_mindtickle_users_active_status_user_id
+    ON mindtickle_users (active_status, user_id) INCLUDE (user_name);
@@ -0,0 +1,6 @@
+-- The report history lookups (services/report_history.py): the latest reports of a type, and the reports
+-- in a date range, of one type or of all of them, paged by (report_date, report_id).
+CREATE INDEX IF NOT EXISTS ix_reports_generated_report_type_report_date
+    ON reports_generated (report_type, report_date, report_id);
+CREATE INDEX IF NOT EXISTS ix_reports_generated_report_date
+    ON reports_generated (report_date, report_id);
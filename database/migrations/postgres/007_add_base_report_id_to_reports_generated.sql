@@ -0,0 +1,3 @@
+-- Delta reports (report/delta.py) point at the full report they apply to.
+ALTER TABLE reports_generated
+    ADD COLUMN base_report_id UUID REFERENCES reports_generated (report_id);
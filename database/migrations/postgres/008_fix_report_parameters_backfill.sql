@@ -0,0 +1,6 @@
+-- Migration 003 backfills the report parameters with a space after the colon, which never matches
+-- the canonical form of get_report_parameters (services/report_history.py), so the reports it backfilled
+-- were never reused. Rewrites them in the canonical form.
+UPDATE reports_generated
+    SET report_parameters = '{"report_format":"' || report_format || '"}'
+    WHERE report_parameters = '{"report_format": "' || report_format || '"}';
@@ -0,0 +1,15 @@
+-- The reports of the same day (forced refreshes, formats, batch reruns) are ordered by when they were saved,
+-- instead of by their random report_id: the latest report, the report reused and the delta base are the newest.
+-- The reports saved so far get the epoch, they keep coming before the later reports of their day, in report_id
+-- order. The reports saved from now on get the time they are saved, like in create_reports_generated.sql.
+ALTER TABLE reports_generated
+    ADD COLUMN created_at TIMESTAMPTZ NOT NULL DEFAULT '1970-01-01 00:00:00+00';
+ALTER TABLE reports_generated ALTER COLUMN created_at SET DEFAULT now();
+
+-- The history indexes of 006, with created_at before the report_id tie breaker.
+DROP INDEX IF EXISTS ix_reports_generated_report_type_report_date;
+DROP INDEX IF EXISTS ix_reports_generated_report_date;
+CREATE INDEX IF NOT EXISTS ix_reports_generated_type_date_created_at
+    ON reports_generated (report_type, report_date, created_at, report_id);
+CREATE INDEX IF NOT EXISTS ix_reports_generated_date_created_at
+    ON reports_generated (report_date, created_at, report_id);
@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String, Date, UUID, Text
+from sqlalchemy import Column, ForeignKey, Index, Integer, String, Date, DateTime, UUID, Text
 # from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import declarative_base
+from datetime import datetime, timezone
 
 PostgresBase = declarative_base()
 MysqlBase = declarative_base()
@@ -13,6 +14,13 @@ class MindUsers(PostgresBase):
     user_name = Column(String(255), nullable=False)
     active_status = Column(String(10), nullable=False)
 
+    # The indexes of the report tables are created by the migrations in database/migrations,
+    # and checked against the query plans by `python -m report.index_advisor`.
+    __table_args__ = (
+        # Active users in user_id order, without visiting the table (PostgreSQL reads user_name from the index too).
+        Index('ix_mindtickle_users_active_status_user_id', 'active_status', 'user_id', postgresql_include=['user_name']),
+    )
+
 
 class LessonCompletion(MysqlBase):
     __tablename__ = 'lesson_completion'
@@ -21,6 +29,13 @@ class LessonCompletion(MysqlBase):
     lesson_id = Column(Integer, nullable=False)
     completion_date = Column(Date, nullable=False)
 
+    __table_args__ = (
+        # The lessons of a chunk of users (or of the staged users), grouped and ordered by user and day.
+        Index('ix_lesson_completion_user_id_completion_date', 'user_id', 'completion_date', 'lesson_id'),
+        # The lessons of given days, for the rollup of the incremental strategy.
+        Index('ix_lesson_completion_completion_date_user_id', 'completion_date', 'user_id', 'lesson_id'),
+    )
+
 
 class ReportsGenerated(PostgresBase):
     __tablename__ = 'reports_generated'
@@ -30,3 +45,34 @@ class ReportsGenerated(PostgresBase):
     report_date = Column(Date, nullable=False)
     report_type = Column(String(255), nullable=False)
     download_link = Column(Text, nullable=False)
+    report_format = Column(String(32), nullable=False, default='csv', server_default='csv')
+    # Canonical JSON of the options that change the content of the report, used to find reports that can be reused.
+    report_parameters = Column(Text, nullable=False, default='{}', server_default='{}')
+    # JSON summary of the time, rows, bytes and memory of every stage of the report.
+    metrics = Column(Text, nullable=True)
+    # Set on delta reports: the full report the delta applies to. The S3 object only holds the rows that differ.
+    base_report_id = Column(UUID, ForeignKey('reports_generated.report_id'), nullable=True)
+    # When the report was saved. Orders the reports of the same day, the latest one is the one reused or the delta base.
+    created_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        # The latest reports of a type, and the reports of a type in a date range, page by page (report_id breaks ties).
+        Index('ix_reports_generated_type_date_created_at', 'report_type', 'report_date', 'created_at', 'report_id'),
+        # The reports of every type in a date range, page by page.
+        Index('ix_reports_generated_date_created_at', 'report_date', 'created_at', 'report_id'),
+    )
+
+
+class LessonCompletionRollup(PostgresBase):
+    # Lessons completed per user per day, rolled up from lesson_completion by the incremental fetch strategy.
+    __tablename__ = 'lesson_completion_daily_rollup'
+    user_id = Column(Integer, primary_key=True)
+    completion_date = Column(Date, primary_key=True)
+    lessons_completed = Column(Integer, nullable=False)
+
+
+class LessonCompletionRollupDay(PostgresBase):
+    # Days that are present in lesson_completion_daily_rollup, and when they were last rolled up.
+    __tablename__ = 'lesson_completion_rollup_days'
+    completion_date = Column(Date, primary_key=True)
+    rolled_up_at = Column(DateTime, nullable=False)
@@ -0,0 +1,294 @@
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+from datetime import date, datetime
+from typing import Dict, Iterator, List, Tuple
+import logging
+import tempfile
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+# COPY output up to this size is kept in memory while it is parsed, anything larger spills to a temporary file.
+COPY_SPOOL_MAX_SIZE = 64 * 1024 * 1024
+
+# How NULL is written in the COPY output. An empty field can't be used, it would also match the empty strings.
+COPY_NULL = r'\N'
+
+
+def read_sql_chunks(statement: Select, session: Session, chunksize: int, fetch_size: int) -> Iterator[pd.DataFrame]:
+    """
+    Reads the results of a query in chunks, without letting the database driver buffer the whole result set
+    on the client first.
+
+    - psycopg2 (PostgreSQL) uses a server-side (named) cursor, fetching `fetch_size` rows per round trip.
+    - mysql-connector (MySQL) is forced into buffered cursors by SQLAlchemy, so the query runs on an
+      unbuffered cursor of the raw DBAPI connection instead, which reads rows off the socket as they are fetched.
+    - Any other driver falls back to a regular chunked read.
+
+    Args:
+        statement: Select: The query to run
+        session: Session: SQLAlchemy session object, the query runs on its connection
+        chunksize: int: Number of rows per yielded dataframe
+        fetch_size: int: Number of rows fetched from the server per round trip
+
+    Returns:
+        An iterator over the result, as dataframes of at most `chunksize` rows
+
+    """
+    connection = session.connection()
+
+    if connection.dialect.supports_server_side_cursors:
+        # yield_per turns on stream_results, with a fixed size buffer of fetch_size rows.
+        return pd.read_sql(
+            statement.execution_options(yield_per=fetch_size),
+            connection,
+            chunksize=chunksize
+        )
+
+    if connection.dialect.driver == 'mysqlconnector':
+        return _read_unbuffered_mysql_chunks(statement, session, chunksize)
+
+    return pd.read_sql(statement, connection, chunksize=chunksize)
+
+
+def read_sql_frame(statement: Select, session: Session, fetch_size: int) -> pd.DataFrame:
+    """
+    Reads the whole result of a query into a single dataframe, streaming it from the database
+    `fetch_size` rows at a time, so the driver never holds a second copy of the result.
+
+    Args:
+        statement: Select: The query to run
+        session: Session: SQLAlchemy session object, the query runs on its connection
+        fetch_size: int: Number of rows fetched from the server per round trip
+
+    Returns:
+        A dataframe with the result of the query
+
+    """
+    return pd.concat(read_sql_chunks(statement, session, fetch_size, fetch_size), ignore_index=True)
+
+
+def read_sql_bulk_chunks(statement: Select, session: Session, chunksize: int, fetch_size: int) -> Iterator[pd.DataFrame]:
+    """
+    Reads the results of a query in chunks with the native bulk export of the database, skipping the rows as
+    Python tuples (and SQLAlchemy rows) that pd.read_sql builds and then unpacks again into columns.
+
+    - psycopg2 (PostgreSQL) runs the query as `COPY (...) TO STDOUT` in CSV, which the C parser of pandas
+      reads straight into column arrays. The export is spooled (in memory up to COPY_SPOOL_MAX_SIZE) first.
+    - mysql-connector (MySQL) runs the query on an unbuffered cursor of the raw DBAPI connection, and the rows
+      are transposed into columns as they are fetched, `fetch_size` rows at a time.
+    - Any other driver falls back to read_sql_chunks.
+
+    The chunks have the same columns and dtypes as the pd.read_sql ones.
+
+    Args:
+        statement: Select: The query to run
+        session: Session: SQLAlchemy session object, the query runs on its connection
+        chunksize: int: Number of rows per yielded dataframe
+        fetch_size: int: Number of rows fetched from the server per round trip
+
+    Returns:
+        An iterator over the result, as dataframes of at most `chunksize` rows
+
+    """
+    connection = session.connection()
+
+    if connection.dialect.driver == 'psycopg2':
+        return _read_postgres_copy_chunks(statement, session, chunksize)
+
+    if connection.dialect.driver == 'mysqlconnector':
+        return _read_unbuffered_mysql_column_chunks(statement, session, chunksize, fetch_size)
+
+    return read_sql_chunks(statement, session, chunksize, fetch_size)
+
+
+def read_sql_bulk_frame(statement: Select, session: Session, fetch_size: int) -> pd.DataFrame:
+    """
+    Reads the whole result of a query into a single dataframe, with the native bulk export of the database.
+    See read_sql_bulk_chunks.
+
+    Args:
+        statement: Select: The query to run
+        session: Session: SQLAlchemy session object, the query runs on its connection
+        fetch_size: int: Number of rows fetched from the server per round trip
+
+    Returns:
+        A dataframe with the result of the query
+
+    """
+    chunks = list(read_sql_bulk_chunks(statement, session, fetch_size, fetch_size))
+    if len(chunks) == 1:
+        return chunks[0]
+    return pd.concat(chunks, ignore_index=True)
+
+
+def _read_postgres_copy_chunks(statement: Select, session: Session, chunksize: int) -> Iterator[pd.DataFrame]:
+    """
+    Exports the result of the query with `COPY (...) TO STDOUT WITH CSV`, and parses it in chunks.
+    CSV has no types, so the string and date columns of the query are restored from its column types.
+    """
+    connection = session.connection()
+    compiled = statement.compile(dialect=connection.dialect, compile_kwargs={'render_postcompile': True})
+    string_columns, date_columns = _get_typed_columns(statement)
+
+    with connection.connection.dbapi_connection.cursor() as cursor, \
+            tempfile.SpooledTemporaryFile(max_size=COPY_SPOOL_MAX_SIZE) as export:
+        # COPY takes no bind parameters, psycopg2 renders them into the query the way it would send them.
+        query = cursor.mogrify(str(compiled), compiled.params)
+        cursor.copy_expert(
+            b'COPY (' + query + f") TO STDOUT WITH (FORMAT csv, HEADER true, NULL '{COPY_NULL}')".encode(),
+            export
+        )
+        export.seek(0)
+
+        chunks = pd.read_csv(
+            export,
+            chunksize=chunksize,
+            dtype={column: str for column in string_columns},
+            keep_default_na=False,
+            na_values=[COPY_NULL]
+        )
+        for chunk in chunks:
+            yield _restore_column_types(chunk.reset_index(drop=True), string_columns, date_columns)
+
+
+def _get_typed_columns(statement: Select) -> Tuple[List[str], Dict[str, type]]:
+    string_columns, date_columns = [], {}
+    for column in statement.selected_columns:
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            continue
+        if python_type is str:
+            string_columns.append(column.name)
+        elif python_type in (date, datetime):
+            date_columns[column.name] = python_type
+    return string_columns, date_columns
+
+
+def _restore_column_types(chunk: pd.DataFrame, string_columns: List[str], date_columns: Dict[str, type]) -> pd.DataFrame:
+    # Like the drivers: None for the NULL strings, date objects for the dates and datetime64 for the timestamps.
+    for column in string_columns:
+        if chunk[column].hasnans:
+            chunk[column] = chunk[column].astype(object).where(chunk[column].notna(), None)
+    for column, python_type in date_columns.items():
+        values = pd.to_datetime(chunk[column])
+        if python_type is date:
+            values = pd.Series(values.dt.date.to_numpy(dtype=object), index=chunk.index).where(values.notna(), None)
+        chunk[column] = values
+    return chunk
+
+
+def _read_unbuffered_mysql_column_chunks(
+        statement: Select,
+        session: Session,
+        chunksize: int,
+        fetch_size: int
+) -> Iterator[pd.DataFrame]:
+    """
+    Runs the query on an unbuffered cursor of the raw mysql-connector connection, and builds the chunks
+    column by column: every fetched batch of rows is transposed straight into the columns of the chunk.
+
+    Like _read_unbuffered_mysql_chunks, the connection is invalidated if the caller stops early.
+    """
+    connection = session.connection()
+    compiled = statement.compile(dialect=connection.dialect, compile_kwargs={'render_postcompile': True})
+    if compiled.positional:
+        parameters = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        parameters = compiled.params
+
+    cursor = connection.connection.dbapi_connection.cursor(buffered=False)
+    cursor.execute(str(compiled), parameters)
+    columns = [column[0] for column in cursor.description]
+
+    exhausted = False
+    try:
+        has_rows = False
+        while True:
+            column_values = [[] for _ in columns]
+            rows_in_chunk = 0
+            while rows_in_chunk < chunksize:
+                rows = cursor.fetchmany(min(fetch_size, chunksize - rows_in_chunk))
+                if not rows:
+                    break
+                rows_in_chunk += len(rows)
+                for values, fetched_values in zip(column_values, zip(*rows)):
+                    values.extend(fetched_values)
+            if not rows_in_chunk:
+                break
+            has_rows = True
+            yield _to_column_frame(columns, column_values)
+            if rows_in_chunk < chunksize:
+                break
+        exhausted = True
+
+        # Keep the same behaviour as pd.read_sql, an empty result still gives the columns.
+        if not has_rows:
+            yield pd.DataFrame(columns=columns)
+    finally:
+        if exhausted:
+            cursor.close()
+        else:
+            logger.debug('Unbuffered MySQL read stopped early, invalidating the connection.')
+            connection.invalidate()
+
+
+def _to_column_frame(columns: List[str], column_values: List[list]) -> pd.DataFrame:
+    # pandas infers every column from its values, like pd.read_sql does: int64 for the ints, float64 for
+    # the ints with NULLs, object for the dates and strings. pd.read_sql also turns the decimals into floats.
+    chunk = pd.DataFrame(dict(zip(columns, column_values)), columns=columns)
+    for column in chunk.columns[chunk.dtypes == object]:
+        if pd.api.types.infer_dtype(chunk[column], skipna=True) == 'decimal':
+            chunk[column] = chunk[column].astype('float64')
+    return chunk
+
+
+def _read_unbuffered_mysql_chunks(statement: Select, session: Session, chunksize: int) -> Iterator[pd.DataFrame]:
+    """
+    Runs the query on an unbuffered cursor of the raw mysql-connector connection, and yields the rows in chunks.
+
+    mysql-connector refuses to release an unbuffered cursor before the result has been read fully,
+    so if the caller stops early, the connection is invalidated and dropped from the pool instead.
+
+    Args:
+        statement: Select: The query to run
+        session: Session: SQLAlchemy session object, the query runs on its connection
+        chunksize: int: Number of rows per yielded dataframe
+
+    Returns:
+        An iterator over the result, as dataframes of at most `chunksize` rows
+
+    """
+    connection = session.connection()
+    compiled = statement.compile(dialect=connection.dialect, compile_kwargs={'render_postcompile': True})
+    if compiled.positional:
+        parameters = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        parameters = compiled.params
+
+    cursor = connection.connection.dbapi_connection.cursor(buffered=False)
+    cursor.execute(str(compiled), parameters)
+    columns = [column[0] for column in cursor.description]
+
+    exhausted = False
+    try:
+        has_rows = False
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                break
+            has_rows = True
+            yield pd.DataFrame.from_records(rows, columns=columns)
+        exhausted = True
+
+        # Keep the same behaviour as pd.read_sql, an empty result still gives the columns.
+        if not has_rows:
+            yield pd.DataFrame(columns=columns)
+    finally:
+        if exhausted:
+            cursor.close()
+        else:
+            logger.debug('Unbuffered MySQL read stopped early, invalidating the connection.')
+            connection.invalidate()
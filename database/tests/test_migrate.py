@@ -0,0 +1,137 @@
+import unittest
+from datetime import date
+from pathlib import Path
+from uuid import uuid4
+from tempfile import TemporaryDirectory
+
+from sqlalchemy import create_engine, inspect, select
+from sqlalchemy.orm import Session
+
+from database.migrate import MIGRATIONS_DIR, apply_migrations, list_migrations, schema_migrations
+from services.report_history import find_existing_report, get_report_parameters
+
+
+class TestApplyMigrations(unittest.TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.migrations_dir = Path(self.directory.name)
+        (self.migrations_dir / '001_create_things.sql').write_text(
+            '-- The things; with a comment\n'
+            'CREATE TABLE things (thing_id INTEGER PRIMARY KEY, name TEXT NOT NULL);\n'
+            "INSERT INTO things (thing_id, name) VALUES (1, 'first');\n"
+        )
+        (self.migrations_dir / '002_add_things_index.sql').write_text('CREATE INDEX ix_things_name ON things (name);\n')
+        self.engine = create_engine(f'sqlite:///{self.migrations_dir / "test.db"}')
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def get_applied_versions(self):
+        with self.engine.connect() as connection:
+            return list(connection.scalars(select(schema_migrations.c.version).order_by(schema_migrations.c.version)))
+
+    def test_applies_pending_migrations_once(self):
+        applied = apply_migrations(self.engine, self.migrations_dir)
+
+        self.assertEqual([migration.version for migration in applied], [1, 2])
+        self.assertEqual(self.get_applied_versions(), [1, 2])
+        self.assertEqual([index['name'] for index in inspect(self.engine).get_indexes('things')], ['ix_things_name'])
+        self.assertEqual(apply_migrations(self.engine, self.migrations_dir), [])
+
+    def test_fake_through_records_without_running(self):
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql('CREATE TABLE things (thing_id INTEGER PRIMARY KEY, name TEXT NOT NULL)')
+
+        apply_migrations(self.engine, self.migrations_dir, fake_through=1)
+
+        self.assertEqual(self.get_applied_versions(), [1, 2])
+        with self.engine.connect() as connection:
+            self.assertEqual(connection.exec_driver_sql('SELECT COUNT(*) FROM things').scalar(), 0)
+        self.assertEqual(len(inspect(self.engine).get_indexes('things')), 1)
+
+    def test_dry_run_only_lists(self):
+        pending = apply_migrations(self.engine, self.migrations_dir, dry_run=True)
+
+        self.assertEqual([migration.name for migration in pending], ['create_things', 'add_things_index'])
+        self.assertEqual(self.get_applied_versions(), [])
+        self.assertFalse(inspect(self.engine).has_table('things'))
+
+    def test_failed_migration_is_not_recorded(self):
+        (self.migrations_dir / '003_broken.sql').write_text('CREATE INDEX ix_broken ON missing_table (name);\n')
+
+        with self.assertRaises(Exception):
+            apply_migrations(self.engine, self.migrations_dir)
+
+        self.assertEqual(self.get_applied_versions(), [1, 2])
+
+    def test_rejects_badly_named_files(self):
+        (self.migrations_dir / 'add_more_things.sql').write_text('SELECT 1;\n')
+
+        with self.assertRaises(ValueError):
+            list_migrations(self.migrations_dir)
+
+
+class TestShippedMigrations(unittest.TestCase):
+    def test_every_database_has_ordered_migrations(self):
+        for database in ('postgres', 'mysql'):
+            migrations = list_migrations(MIGRATIONS_DIR / database)
+            self.assertEqual([migration.version for migration in migrations], list(range(1, len(migrations) + 1)))
+            for migration in migrations:
+                self.assertTrue(migration.statements, migration.path)
+                self.assertFalse(any(statement.startswith('--') for statement in migration.statements))
+
+
+class TestReportParametersBackfill(unittest.TestCase):
+    """
+    The report parameters backfilled by the migrations have to match the reuse lookup of the generator.
+    """
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.migrations_dir = Path(self.directory.name)
+        self.engine = create_engine(f'sqlite:///{self.migrations_dir / "test.db"}')
+        # reports_generated as it was before migration 002.
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql(
+                'CREATE TABLE reports_generated (report_id CHAR(32) PRIMARY KEY, s3_object_key VARCHAR(255) NOT NULL, '
+                's3_bucket VARCHAR(255) NOT NULL, report_date DATE NOT NULL, report_type VARCHAR(255) NOT NULL, '
+                'download_link TEXT NOT NULL)'
+            )
+            connection.exec_driver_sql(
+                'INSERT INTO reports_generated VALUES (?, ?, ?, ?, ?, ?)',
+                (uuid4().hex, 'customer_x_report/today.csv', 'bucket', date.today().isoformat(), 'customer_x', 'link')
+            )
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def apply_shipped_migrations(self, through_version):
+        for migration in list_migrations(MIGRATIONS_DIR / 'postgres'):
+            if migration.version > through_version:
+                continue
+            if 'reports_generated' in migration.path.read_text():
+                # SQLite can't change the default of a column, the defaults don't matter to the reports here.
+                statements = [statement for statement in migration.statements if 'ALTER COLUMN' not in statement]
+                (self.migrations_dir / migration.path.name).write_text(';\n'.join(statements))
+        apply_migrations(self.engine, self.migrations_dir)
+
+    def find_csv_report(self):
+        with Session(self.engine) as session:
+            return find_existing_report(session, 'customer_x', date.today(), get_report_parameters(report_format='csv'))
+
+    def test_backfilled_reports_are_reused(self):
+        self.apply_shipped_migrations(len(list_migrations(MIGRATIONS_DIR / 'postgres')))
+
+        self.assertIsNotNone(self.find_csv_report())
+
+    def test_reports_backfilled_with_whitespace_are_fixed(self):
+        # Up to 008, which fixes what 003 backfilled.
+        self.apply_shipped_migrations(7)
+        with self.engine.begin() as connection:
+            report_parameters = connection.exec_driver_sql('SELECT report_parameters FROM reports_generated').scalar()
+        self.assertNotEqual(report_parameters, get_report_parameters(report_format='csv'))
+
+        self.apply_shipped_migrations(len(list_migrations(MIGRATIONS_DIR / 'postgres')))
+
+        self.assertIsNotNone(self.find_csv_report())
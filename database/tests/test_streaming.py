@@ -0,0 +1,316 @@
+import csv
+import io
+import subprocess
+import sys
+import textwrap
+import unittest
+from datetime import date
+from decimal import Decimal
+from unittest.mock import MagicMock
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.dialects.mysql.mysqlconnector import MySQLDialect_mysqlconnector
+from sqlalchemy.dialects.postgresql.psycopg2 import PGDialect_psycopg2
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.orm import Session
+
+from database.models import LessonCompletion, MindUsers
+from database.streaming import COPY_NULL, read_sql_bulk_chunks, read_sql_bulk_frame, read_sql_chunks, read_sql_frame
+
+
+class TestUnbufferedMysqlChunks(unittest.TestCase):
+    def setUp(self):
+        self.rows = [(1, 2, date(2023, 9, 16)), (1, 1, date(2023, 9, 18)), (3, 4, date(2023, 9, 16))]
+        self.cursor = MagicMock()
+        self.cursor.description = [('user_id',), ('lessons_completed',), ('completion_date',)]
+        self.cursor.fetchmany.side_effect = lambda size: [self.rows.pop(0) for _ in range(min(size, len(self.rows)))]
+
+        self.connection = MagicMock()
+        self.connection.dialect = MySQLDialect_mysqlconnector()
+        self.connection.connection.dbapi_connection.cursor.return_value = self.cursor
+        self.session = MagicMock(spec=Session)
+        self.session.connection.return_value = self.connection
+
+        self.statement = (
+            Session().query(LessonCompletion.user_id)
+            .filter(LessonCompletion.user_id.in_([1, 3]))
+            .statement
+        )
+
+    def test_reads_on_an_unbuffered_cursor_in_chunks(self):
+        chunks = list(read_sql_chunks(self.statement, self.session, chunksize=2, fetch_size=2))
+
+        self.connection.connection.dbapi_connection.cursor.assert_called_with(buffered=False)
+        sql, parameters = self.cursor.execute.call_args.args
+        self.assertIn('IN (%s, %s)', sql)
+        self.assertEqual(parameters, (1, 3))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 1])
+        self.assertEqual(list(chunks[0].columns), ['user_id', 'lessons_completed', 'completion_date'])
+        self.cursor.close.assert_called_once()
+        self.connection.invalidate.assert_not_called()
+
+    def test_empty_result_keeps_the_columns(self):
+        self.rows.clear()
+
+        frame = read_sql_frame(self.statement, self.session, fetch_size=2)
+
+        self.assertTrue(frame.empty)
+        self.assertEqual(list(frame.columns), ['user_id', 'lessons_completed', 'completion_date'])
+
+    def test_stopping_early_invalidates_the_connection(self):
+        chunks = read_sql_chunks(self.statement, self.session, chunksize=1, fetch_size=1)
+        next(chunks)
+        chunks.close()
+
+        self.connection.invalidate.assert_called_once()
+        self.cursor.close.assert_not_called()
+
+
+class TestUnbufferedMysqlColumnChunks(unittest.TestCase):
+    def setUp(self):
+        self.rows = [
+            (1, 2, date(2023, 9, 16), Decimal('1.5')),
+            (1, None, date(2023, 9, 18), Decimal('2')),
+            (3, 4, None, None),
+            (4, 1, date(2023, 9, 17), Decimal('0.5')),
+            (5, 3, date(2023, 9, 16), Decimal('3')),
+        ]
+        self.columns = ['user_id', 'lessons_completed', 'completion_date', 'score']
+        self.cursor = MagicMock()
+        self.cursor.description = [(column,) for column in self.columns]
+        self.cursor.fetchmany.side_effect = lambda size: [self.rows.pop(0) for _ in range(min(size, len(self.rows)))]
+
+        self.connection = MagicMock()
+        self.connection.dialect = MySQLDialect_mysqlconnector()
+        self.connection.connection.dbapi_connection.cursor.return_value = self.cursor
+        self.session = MagicMock(spec=Session)
+        self.session.connection.return_value = self.connection
+
+        self.statement = Session().query(LessonCompletion.user_id).filter(LessonCompletion.user_id.in_([1, 3])).statement
+
+    def test_same_frame_as_read_sql(self):
+        # pd.read_sql builds its frames from the rows like this.
+        expected = pd.DataFrame.from_records(list(self.rows), columns=self.columns, coerce_float=True)
+
+        chunks = list(read_sql_bulk_chunks(self.statement, self.session, chunksize=3, fetch_size=2))
+
+        self.connection.connection.dbapi_connection.cursor.assert_called_with(buffered=False)
+        self.assertEqual([len(chunk) for chunk in chunks], [3, 2])
+        # Never more than fetch_size rows per round trip, nor past the end of a chunk.
+        self.assertTrue(all(call.args[0] <= 2 for call in self.cursor.fetchmany.call_args_list))
+        pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), expected)
+        self.cursor.close.assert_called_once()
+
+    def test_empty_result_keeps_the_columns(self):
+        self.rows.clear()
+
+        frame = read_sql_bulk_frame(self.statement, self.session, fetch_size=2)
+
+        self.assertTrue(frame.empty)
+        self.assertEqual(list(frame.columns), self.columns)
+
+    def test_stopping_early_invalidates_the_connection(self):
+        chunks = read_sql_bulk_chunks(self.statement, self.session, chunksize=1, fetch_size=1)
+        next(chunks)
+        chunks.close()
+
+        self.connection.invalidate.assert_called_once()
+
+
+class TestPostgresCopyChunks(unittest.TestCase):
+    def setUp(self):
+        self.rows = [(1, 'User1', date(2023, 9, 16)), (2, None, None), (10, '', date(2023, 9, 18)), (12, 'a, "b"', date(2023, 9, 1))]
+        self.columns = ['user_id', 'user_name', 'completion_date']
+        self.cursor = MagicMock()
+        self.cursor.__enter__.return_value = self.cursor
+        self.cursor.mogrify.side_effect = lambda sql, parameters: (sql % {name: repr(value) for name, value in parameters.items()}).encode()
+        self.cursor.copy_expert.side_effect = self.copy_expert
+
+        self.connection = MagicMock()
+        self.connection.dialect = PGDialect_psycopg2()
+        self.connection.connection.dbapi_connection.cursor.return_value = self.cursor
+        self.session = MagicMock(spec=Session)
+        self.session.connection.return_value = self.connection
+
+        self.statement = (
+            Session().query(MindUsers.user_id, MindUsers.user_name, LessonCompletion.completion_date)
+            .filter(MindUsers.active_status == 'active')
+            .statement
+        )
+
+    def copy_expert(self, sql, export):
+        # Writes the rows like PostgreSQL does, with NULL as \N.
+        text_export = io.StringIO()
+        writer = csv.writer(text_export, lineterminator='\n')
+        writer.writerow(self.columns)
+        writer.writerows([COPY_NULL if value is None else value for value in row] for row in self.rows)
+        export.write(text_export.getvalue().encode())
+
+    def test_same_frame_as_read_sql(self):
+        expected = pd.DataFrame.from_records(list(self.rows), columns=self.columns, coerce_float=True)
+
+        chunks = list(read_sql_bulk_chunks(self.statement, self.session, chunksize=3, fetch_size=2))
+
+        sql = self.cursor.copy_expert.call_args.args[0]
+        self.assertTrue(sql.startswith(b'COPY (SELECT'))
+        self.assertIn(b"active_status = 'active'", sql)
+        self.assertIn(b"TO STDOUT WITH (FORMAT csv, HEADER true, NULL '\\N')", sql)
+        self.assertEqual([len(chunk) for chunk in chunks], [3, 1])
+        self.assertEqual(list(chunks[1].index), [0])
+        pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), expected)
+
+    def test_empty_result_keeps_the_columns(self):
+        self.rows.clear()
+
+        frame = read_sql_bulk_frame(self.statement, self.session, fetch_size=2)
+
+        self.assertTrue(frame.empty)
+        self.assertEqual(list(frame.columns), self.columns)
+
+
+BULK_EXPORT_QUERY = text(
+    'SELECT user_id, user_name, signup_date, lessons FROM bulk_export ORDER BY user_id'
+).columns(
+    MindUsers.user_id,
+    MindUsers.user_name,
+    LessonCompletion.completion_date.label('signup_date'),
+    LessonCompletion.lesson_id.label('lessons')
+)
+
+
+@pytest.mark.parametrize('db_url_name', ['POSTGRES_DB_URL', 'MYSQL_DB_URL'])
+def test_bulk_export_is_the_same_as_read_sql(db_url_name):
+    from database import connections
+
+    try:
+        engine = create_engine(getattr(connections, db_url_name))
+        engine.connect().close()
+    except (DBAPIError, ValueError):
+        pytest.skip(f'The database of {db_url_name} is not reachable.')
+
+    try:
+        with engine.begin() as connection:
+            connection.execute(text('DROP TABLE IF EXISTS bulk_export'))
+            connection.execute(text(
+                'CREATE TABLE bulk_export (user_id INTEGER PRIMARY KEY, user_name VARCHAR(64), signup_date DATE, lessons INTEGER)'
+            ))
+            connection.execute(
+                text('INSERT INTO bulk_export VALUES (:user_id, :user_name, :signup_date, :lessons)'),
+                [
+                    {
+                        'user_id': user_id,
+                        'user_name': None if user_id % 11 == 0 else f'User, "{user_id}"' if user_id % 7 == 0 else f'User{user_id}',
+                        'signup_date': None if user_id % 13 == 0 else date(2023, 1, 1 + user_id % 28),
+                        'lessons': None if user_id % 17 == 0 else user_id % 5,
+                    }
+                    for user_id in range(1, 2001)
+                ]
+            )
+
+        with Session(engine) as session:
+            expected = pd.read_sql(BULK_EXPORT_QUERY, session.connection())
+            frame = read_sql_bulk_frame(BULK_EXPORT_QUERY, session, fetch_size=300)
+    finally:
+        with engine.begin() as connection:
+            connection.execute(text('DROP TABLE IF EXISTS bulk_export'))
+
+    pd.testing.assert_frame_equal(frame, expected)
+
+
+# Streams a users-like table in a fresh interpreter, and prints how much the RSS grew while streaming.
+# The RSS is sampled after every chunk, a driver buffering the whole result shows up on the first one.
+PEAK_RSS_SCRIPT = textwrap.dedent('''
+    import resource
+    import sys
+    from sqlalchemy import create_engine, select, table, column
+    from sqlalchemy.orm import Session
+    from database.streaming import read_sql_chunks
+
+
+    def current_rss_kb():
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() // 1024
+
+
+    engine = create_engine(sys.argv[1])
+    statement = select(column('user_id'), column('user_name')).select_from(table(sys.argv[2])).order_by(column('user_id'))
+    with Session(engine) as session:
+        session.connection()
+        baseline = peak = current_rss_kb()
+        rows = 0
+        for chunk in read_sql_chunks(statement, session, chunksize=1000, fetch_size=1000):
+            rows += len(chunk)
+            peak = max(peak, current_rss_kb())
+    print(rows, peak - baseline)
+''')
+
+SMALL_TABLE_ROWS = 50_000
+LARGE_TABLE_ROWS = 500_000
+
+
+def peak_rss_growth_kb(db_url: str, table_name: str, expected_rows: int) -> int:
+    result = subprocess.run(
+        [sys.executable, '-c', PEAK_RSS_SCRIPT, db_url, table_name],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    rows, growth = map(int, result.stdout.split())
+    assert rows == expected_rows
+    return growth
+
+
+def assert_peak_rss_is_bounded(db_url: str, create_table) -> None:
+    engine = create_engine(db_url)
+    try:
+        for table_name, rows in (('streaming_small', SMALL_TABLE_ROWS), ('streaming_large', LARGE_TABLE_ROWS)):
+            with engine.begin() as connection:
+                connection.execute(text(f'DROP TABLE IF EXISTS {table_name}'))
+                create_table(connection, table_name, rows)
+
+        small_growth = peak_rss_growth_kb(db_url, 'streaming_small', SMALL_TABLE_ROWS)
+        large_growth = peak_rss_growth_kb(db_url, 'streaming_large', LARGE_TABLE_ROWS)
+    finally:
+        with engine.begin() as connection:
+            connection.execute(text('DROP TABLE IF EXISTS streaming_small'))
+            connection.execute(text('DROP TABLE IF EXISTS streaming_large'))
+
+    # The table grows 10x, a buffered read would grow the peak RSS by roughly the same factor.
+    # Allow some slack for allocator noise.
+    assert large_growth < small_growth * 2 + 8 * 1024
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='RSS is sampled from /proc.')
+def test_peak_rss_is_bounded_sqlite(tmp_path):
+    def create_table(connection, table_name, rows):
+        connection.execute(text(f'CREATE TABLE {table_name} (user_id INTEGER PRIMARY KEY, user_name TEXT)'))
+        connection.execute(
+            text(f'INSERT INTO {table_name} (user_id, user_name) VALUES (:user_id, :user_name)'),
+            [{'user_id': user_id, 'user_name': f'User{user_id}'} for user_id in range(1, rows + 1)]
+        )
+
+    assert_peak_rss_is_bounded(f'sqlite:///{tmp_path / "users.db"}', create_table)
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='RSS is sampled from /proc.')
+def test_peak_rss_is_bounded_postgres():
+    from database.connections import POSTGRES_DB_URL
+
+    try:
+        create_engine(POSTGRES_DB_URL).connect().close()
+    except OperationalError:
+        pytest.skip('PostgreSQL is not reachable.')
+
+    def create_table(connection, table_name, rows):
+        connection.execute(text(
+            f"CREATE TABLE {table_name} AS "
+            f"SELECT g AS user_id, 'User' || g AS user_name FROM generate_series(1, {rows}) AS g"
+        ))
+
+    assert_peak_rss_is_bounded(POSTGRES_DB_URL, create_table)
+
+
+if __name__ == '__main__':
+    unittest.main()
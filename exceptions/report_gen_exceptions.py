@@ -7,6 +7,10 @@ class UploadFailure(Exception):
     pass
 
 
+class DownloadFailure(Exception):
+    pass
+
+
 class DataFetchError(Exception):
     pass
 
@@ -14,3 +18,10 @@ class DataFetchError(Exception):
 class DataSaveFailure(Exception):
     pass
 
+
+class DataTypeOverflow(Exception):
+    pass
+
+
+class ReportQueueFull(Exception):
+    pass
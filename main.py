@@ -1,43 +1,218 @@
+import argparse
+import json
 import logging.config
-import report
-from report.report_types import ValidReports
 import sys
+import report
+from report.report_types import ValidReports, FetchStrategy, ReportFormat
+from typing import Dict, List, Optional
 
 
 logging.config.fileConfig(fname='log.conf', disable_existing_loggers=False)
 logger = logging.getLogger(__name__)
 
 
-def main(request_report: str) -> str:
+def main(
+        request_report: str,
+        stream: bool = False,
+        fetch_strategy: str = FetchStrategy.SERIAL.value,
+        report_format: str = ReportFormat.CSV.value,
+        force_refresh: bool = False,
+        use_async: bool = False,
+        delta: bool = False
+) -> str:
     """
     The main function is the entry point for this Report Generation Script.
 
     Args:
         request_report: str: The type of report that is to be generated.
+        stream: bool: Stream the report to S3 while it is being generated.
+        fetch_strategy: str: How the report data is pulled from the databases.
+        report_format: str: Format of the uploaded report.
+        force_refresh: bool: Generate the report again, even if it was already generated today.
+        use_async: bool: Generate the report with the asyncio engine. The fetch strategy is not used then.
+        delta: bool: Upload only the rows changed since the last full report.
 
     Returns:
         A Pre-Signed Direct download link for the report.
 
     """
-    download_link = report.generate_report(report_type=request_report)
+    if use_async:
+        download_link = report.run_report_async(
+            request_report,
+            stream=stream,
+            report_format=report_format,
+            force_refresh=force_refresh,
+            delta=delta
+        )
+        logger.debug('Report created and uploaded to S3.')
+        return download_link
+
+    download_link = report.generate_report(
+        report_type=request_report,
+        stream=stream,
+        fetch_strategy=fetch_strategy,
+        report_format=report_format,
+        force_refresh=force_refresh,
+        delta=delta
+    )
     logger.debug('Report created and uploaded to S3.')
     return download_link
 
 
+def main_batch(
+        report_types: Optional[List[str]] = None,
+        manifest_path: Optional[str] = None,
+        max_workers: Optional[int] = None,
+        use_async: bool = False,
+        **defaults
+) -> List[Dict]:
+    """
+    The batch entry point, generating several reports in one process.
+
+    Args:
+        report_types: Optional[List[str]]: The types of the reports that are to be generated.
+        manifest_path: Optional[str]: A json manifest with the reports to generate, instead of report_types.
+        max_workers: Optional[int]: Number of reports generated at the same time.
+        use_async: bool: Generate the reports with the asyncio engine, on one event loop.
+        **defaults: The options used for every report, unless the manifest sets them.
+
+    Returns:
+        A summary of every report, with its status, duration and download link.
+
+    """
+    # Only imported here, so a single report doesn't pay for the batch machinery.
+    from report.batch import ReportRequest, generate_reports_batch, load_manifest, summarise_results
+    from report.async_generator import run_reports_batch_async
+
+    if manifest_path:
+        report_requests = load_manifest(manifest_path, **defaults)
+    else:
+        report_requests = [ReportRequest(report_type, **defaults) for report_type in report_types]
+
+    if use_async:
+        results = run_reports_batch_async(report_requests, max_concurrent_reports=max_workers)
+    else:
+        results = generate_reports_batch(report_requests, max_workers=max_workers)
+    logger.debug('Batch of reports created and uploaded to S3.')
+    return summarise_results(results)
+
+
+def parse_args() -> argparse.Namespace:
+    """
+    Parses the cli arguments for the Report Generation Script.
+
+    Returns:
+        The parsed arguments.
+
+    """
+    parser = argparse.ArgumentParser(description='Generate a report and upload it to S3.')
+    # If there is no report type passed, simply run the default report for which the script exists.
+    parser.add_argument('report_type', nargs='?', default=ValidReports.CUSTOMER_X.value)
+    parser.add_argument(
+        '--list',
+        action='store_true',
+        help='List the valid report types and exit.'
+    )
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='Upload the report to S3 chunk by chunk while it is being generated.'
+    )
+    parser.add_argument(
+        '--fetch-strategy',
+        choices=[strategy.value for strategy in FetchStrategy],
+        default=FetchStrategy.SERIAL.value,
+        help='How the report data is pulled from the databases.'
+    )
+    parser.add_argument(
+        '--format',
+        dest='report_format',
+        choices=[report_format.value for report_format in ReportFormat],
+        default=ReportFormat.CSV.value,
+        help='Format of the uploaded report.'
+    )
+    parser.add_argument(
+        '--force-refresh',
+        action='store_true',
+        help='Generate the report again, even if the same report was already generated today.'
+    )
+    parser.add_argument(
+        '--delta',
+        action='store_true',
+        help='Upload only the rows added, removed or changed since the last full report (customer_x, CSV formats).'
+    )
+    parser.add_argument(
+        '--async',
+        dest='use_async',
+        action='store_true',
+        help='Generate the reports with the asyncio engine (asyncpg and aiomysql). Can not be combined with --fetch-strategy.'
+    )
+    batch = parser.add_mutually_exclusive_group()
+    batch.add_argument(
+        '--batch',
+        nargs='+',
+        metavar='REPORT_TYPE',
+        help='Generate several reports in one process, sharing the database pools and the S3 client.'
+    )
+    batch.add_argument(
+        '--manifest',
+        metavar='PATH',
+        help='Generate the reports listed in a json manifest in one process, like --batch.'
+    )
+    parser.add_argument(
+        '--serve',
+        action='store_true',
+        help='Run the report service: an HTTP server generating the reports POSTed to /reports, with warm pools.'
+    )
+    parser.add_argument(
+        '--host',
+        help='Address the report service listens on. Default: service_host.'
+    )
+    parser.add_argument(
+        '--port',
+        type=int,
+        help='Port the report service listens on. Default: service_port.'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        help='Number of reports generated at the same time in batch and service mode. Default: report_batch_workers.'
+    )
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    total_args = len(sys.argv)
-    # Checking if the there is only 1 cli argument passed
-    # And if the passed argument is present in valid report types.
+    args = parse_args()
+    # Checking if the passed argument is present in valid report types.
     # Else return the list of valid choices for report generation.
 
     valid_reports = set(report.value for report in ValidReports)
 
-    # If there are no arguments passed, simply run the default report for which the script exists.
-    if total_args == 1:
-        print(main('customer_x'))
+    report_options = {
+        'stream': args.stream,
+        'fetch_strategy': args.fetch_strategy,
+        'report_format': args.report_format,
+        'force_refresh': args.force_refresh,
+        'delta': args.delta
+    }
 
-    elif (total_args != 2) or (sys.argv[1] not in valid_reports):
+    if args.list:
+        print('\n'.join(report.value for report in ValidReports))
+    elif args.serve:
+        # Only imported here, like the batch machinery.
+        from report.service import serve
+        serve(args.host, args.port, args.workers)
+    elif args.use_async and args.fetch_strategy != FetchStrategy.SERIAL.value:
+        print('The asyncio engine always pulls the report data concurrently, --fetch-strategy can not be used with --async.')
+        sys.exit(2)
+    elif args.batch and not set(args.batch) <= valid_reports:
+        print(f'Please enter a valid argument. Available report types -> {valid_reports}')
+    elif args.batch or args.manifest:
+        summary = main_batch(args.batch, args.manifest, args.workers, args.use_async, **report_options)
+        print(json.dumps(summary, indent=2))
+        if any(report_summary['status'] != 'ok' for report_summary in summary):
+            sys.exit(1)
+    elif args.report_type not in valid_reports:
         print(f'Please enter a valid argument. Available report types -> {valid_reports}')
     else:
-        print(main(sys.argv[1]))
-
+        print(main(args.report_type, use_async=args.use_async, **report_options))
@@ -0,0 +1,210 @@
+"""
+A local snapshot of the active users, so report runs don't read every active user from mindtickle_users again while
+none of them changed. Every run takes a cheap fingerprint of the users instead (the number of active users and their
+highest user_id, straight from the active users index, and PostgreSQL's count of the writes to the table), and reads
+the snapshot of that fingerprint when there is one, as a zstd compressed parquet file of two columns.
+"""
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterable, Iterator, Optional
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import time
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.query import Query
+
+from database.models import MindUsers
+from config import settings
+
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_COLUMNS = ['user_id', 'user_name']
+
+# Inserted, updated and deleted rows of the table since the statistics were last reset, committed or not.
+# The counts are published by every backend at most a few seconds after its transaction ends, and a reset of the
+# statistics only changes them, which refreshes the snapshot.
+_USERS_MODIFICATION_COUNT = text(
+    'SELECT n_tup_ins + n_tup_upd + n_tup_del FROM pg_stat_user_tables WHERE relid = CAST(:table_name AS regclass)'
+)
+
+
+@dataclass(frozen=True)
+class ActiveUsersFingerprint:
+    """
+    What a snapshot of the active users is valid for: the database, the number of active users and their highest
+    user_id, and the modification watermark of mindtickle_users. A new user, a deactivated one or an activated one
+    changes the first two, a renamed one the watermark.
+    """
+    database: str
+    row_count: int
+    max_user_id: Optional[int]
+    watermark: Optional[int]
+
+    @property
+    def key(self) -> str:
+        return hashlib.sha1(json.dumps(asdict(self), sort_keys=True).encode()).hexdigest()[:16]
+
+
+def get_users_modification_watermark(session: Session) -> Optional[int]:
+    """
+    Returns the number of writes to mindtickle_users PostgreSQL has counted, None on other databases
+    (or without table statistics), where the number and the highest user_id of the active users are all there is.
+    """
+    if session.bind.dialect.name != 'postgresql':
+        return None
+    watermark = session.execute(_USERS_MODIFICATION_COUNT, {'table_name': MindUsers.__tablename__}).scalar()
+    return None if watermark is None else int(watermark)
+
+
+def get_active_users_fingerprint(session: Session, fingerprint_query: Query) -> ActiveUsersFingerprint:
+    """
+    Takes the fingerprint of the active users. Take it before reading them: a snapshot read after a change
+    is then saved under the fingerprint before it, and taken again on the next run, never the other way round.
+
+    Args:
+        session: Session: Session object for PostgreSQL DB
+        fingerprint_query: Query: The query of the number of active users and their highest user_id
+
+    Returns:
+        The fingerprint
+    """
+    row_count, max_user_id = fingerprint_query.one()
+    return ActiveUsersFingerprint(
+        database=session.bind.url.render_as_string(hide_password=True),
+        row_count=int(row_count),
+        max_user_id=None if max_user_id is None else int(max_user_id),
+        watermark=get_users_modification_watermark(session)
+    )
+
+
+@dataclass
+class ActiveUsersCache:
+    """
+    The snapshots of the active users, one parquet file per fingerprint in `cache_dir`. A snapshot is read for
+    at most `ttl_seconds` after it was taken, and the oldest snapshots are deleted once they take more than
+    `max_bytes` together. Runs share the snapshots through a lock, so concurrent runs take a missing snapshot once.
+    """
+    cache_dir: Path
+    ttl_seconds: float
+    max_bytes: int
+
+    def __post_init__(self):
+        self.cache_dir = Path(self.cache_dir)
+
+    @classmethod
+    def from_settings(cls) -> 'ActiveUsersCache':
+        return cls(
+            cache_dir=Path(settings.report_active_users_cache_dir),
+            ttl_seconds=settings.report_active_users_cache_ttl_seconds,
+            max_bytes=settings.report_active_users_cache_max_bytes
+        )
+
+    def read_chunks(
+            self,
+            fingerprint: ActiveUsersFingerprint,
+            chunksize: int,
+            fetch_chunks: Callable[[], Iterable[pd.DataFrame]]
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Reads the active users from the snapshot of the fingerprint, taking the snapshot first when there is
+        no fresh one. The snapshot is taken right away, only the reading of its chunks is left to the iterator.
+
+        Args:
+            fingerprint: ActiveUsersFingerprint: The fingerprint of the active users, taken before fetch_chunks
+            chunksize: int: Number of active users per chunk
+            fetch_chunks: Callable[[], Iterable[pd.DataFrame]]: Reads the active users from the database,
+                in user_id order
+
+        Returns:
+            An iterator over the chunks of active users, in user_id order
+        """
+        _import_pyarrow()
+        with self._lock():
+            snapshot_path = self._snapshot_path(fingerprint)
+            if self._is_fresh(snapshot_path):
+                logger.info(f'Reading the {fingerprint.row_count} active users from the snapshot {snapshot_path}.')
+            else:
+                logger.info(f'Taking a snapshot of the {fingerprint.row_count} active users in {snapshot_path}.')
+                self._write_snapshot(snapshot_path, fetch_chunks())
+                self.evict(keep=snapshot_path)
+            # Opened while holding the lock: a snapshot evicted by another run stays readable until it is closed.
+            snapshot_file = open(snapshot_path, 'rb')
+        return _iter_snapshot_chunks(snapshot_file, chunksize)
+
+    def evict(self, keep: Optional[Path] = None):
+        """
+        Deletes the snapshots older than the TTL, and the oldest ones beyond the size cap. Call it while holding the lock.
+
+        Args:
+            keep: Optional[Path]: A snapshot to keep in any case, counted first towards the size cap.
+        """
+        now = time.time()
+        snapshots = sorted(
+            ((path, path.stat()) for path in self.cache_dir.glob('active_users_*.parquet')),
+            key=lambda snapshot: (snapshot[0] != keep, -snapshot[1].st_mtime)
+        )
+        total_bytes = 0
+        for path, stat in snapshots:
+            expired = now - stat.st_mtime > self.ttl_seconds
+            if path != keep and (expired or total_bytes + stat.st_size > self.max_bytes):
+                logger.debug(f'Deleting the active users snapshot {path}.')
+                path.unlink(missing_ok=True)
+                continue
+            total_bytes += stat.st_size
+
+    def _snapshot_path(self, fingerprint: ActiveUsersFingerprint) -> Path:
+        return self.cache_dir / f'active_users_{fingerprint.key}.parquet'
+
+    def _is_fresh(self, snapshot_path: Path) -> bool:
+        return snapshot_path.exists() and time.time() - snapshot_path.stat().st_mtime <= self.ttl_seconds
+
+    def _write_snapshot(self, snapshot_path: Path, df_active_users_chunks: Iterable[pd.DataFrame]):
+        # Written next to its final name and then renamed, so a run failing half way never leaves a partial snapshot.
+        pa, pq = _import_pyarrow()
+        snapshot_schema = pa.schema([('user_id', pa.int64()), ('user_name', pa.string())])
+        temporary_file = snapshot_path.with_suffix('.parquet.tmp')
+        try:
+            with pq.ParquetWriter(temporary_file, snapshot_schema, compression='zstd') as writer:
+                for df_active_users_part in df_active_users_chunks:
+                    writer.write_table(pa.Table.from_pandas(
+                        df_active_users_part[SNAPSHOT_COLUMNS],
+                        schema=snapshot_schema,
+                        preserve_index=False
+                    ))
+            os.replace(temporary_file, snapshot_path)
+        finally:
+            temporary_file.unlink(missing_ok=True)
+
+    @contextmanager
+    def _lock(self) -> Iterator[None]:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.cache_dir / 'active_users.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _iter_snapshot_chunks(snapshot_file: BinaryIO, chunksize: int) -> Iterator[pd.DataFrame]:
+    _, pq = _import_pyarrow()
+    with snapshot_file:
+        for batch in pq.ParquetFile(snapshot_file).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError('The pyarrow package is needed for the active users cache.')
+    return pa, pq
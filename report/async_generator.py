@@ -0,0 +1,419 @@
+from .batch import ReportRequest, ReportResult
+from .customer_x_async import iter_customer_x_report_chunks_async
+from .customer_x_daily import (
+    check_merged_chunks_window,
+    get_customer_x_daily_arrow_schema,
+    get_daily_window,
+    iter_daily_frames
+)
+from .customer_x_report import get_customer_x_arrow_schema
+from .delta import encode_delta_report, get_content_object_key, read_delta_base, read_delta_report_chunks
+from .output_formats import get_content_headers, iter_encoded_parts, iter_in_key_order
+from .report_details import (
+    add_report_metrics,
+    check_delta,
+    get_existing_report_link,
+    get_reuse_parameters,
+    new_report_details
+)
+from .report_types import ValidReports, ReportFormat
+from database.async_connections import create_async_postgres_engine, create_async_mysql_engine
+from database.models import ReportsGenerated
+from services.aws_s3 import get_s3_client, save, save_stream
+from services.report_history import find_delta_base, find_existing_report
+from services.save_report_details import save_to_db
+from services.instrumentation import iter_stage, record_report, stage
+from config import settings
+from exceptions.report_gen_exceptions import DataFetchError
+from dataclasses import dataclass, field
+from datetime import date
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+import asyncio
+import boto3
+import logging
+import queue
+import time
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+_END_OF_CHUNKS = object()
+
+
+@dataclass
+class AsyncReportResources:
+    """
+    What the reports running on one event loop share: the async engines (and their pools), the S3 client,
+    and the limits on the queries and uploads running at the same time across all of the reports.
+    Create it inside the event loop, and dispose of it before the loop closes.
+    """
+    postgres_engine: AsyncEngine
+    mysql_engine: AsyncEngine
+    s3_client: boto3.client
+    query_semaphore: asyncio.Semaphore
+    upload_semaphore: asyncio.Semaphore
+    postgres_session_factory: async_sessionmaker = field(init=False)
+    mysql_session_factory: async_sessionmaker = field(init=False)
+
+    def __post_init__(self):
+        self.postgres_session_factory = async_sessionmaker(self.postgres_engine, expire_on_commit=False)
+        self.mysql_session_factory = async_sessionmaker(self.mysql_engine, expire_on_commit=False)
+
+    @classmethod
+    def create(
+            cls,
+            s3_client: Optional[boto3.client] = None,
+            query_concurrency: Optional[int] = None,
+            upload_concurrency: Optional[int] = None
+    ) -> 'AsyncReportResources':
+        """
+        Creates the async engines from the settings.
+
+        Args:
+            s3_client: Optional[boto3.client]: An existing S3 client to reuse. The shared one is used if not passed.
+            query_concurrency: Optional[int]: Queries running at the same time. Default = async_query_concurrency.
+            upload_concurrency: Optional[int]: Uploads running at the same time. Default = async_upload_concurrency.
+
+        Returns:
+            The resources, to be used with `async with`, which disposes of the engines.
+        """
+        return cls(
+            create_async_postgres_engine(),
+            create_async_mysql_engine(),
+            s3_client or get_s3_client(),
+            asyncio.Semaphore(query_concurrency or settings.async_query_concurrency),
+            asyncio.Semaphore(upload_concurrency or settings.async_upload_concurrency)
+        )
+
+    async def dispose(self):
+        await self.postgres_engine.dispose()
+        await self.mysql_engine.dispose()
+
+    async def __aenter__(self) -> 'AsyncReportResources':
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.dispose()
+
+
+async def generate_report_async(
+        report_type: str,
+        stream: bool = False,
+        report_format: str = ReportFormat.CSV.value,
+        force_refresh: bool = False,
+        resources: Optional[AsyncReportResources] = None,
+        delta: bool = False
+) -> str:
+    """
+    Async version of generate_report. The queries run on the async engines, while the pandas work, the encoding
+    and the S3 calls run in worker threads, so a single event loop can keep the queries and uploads of many reports
+    in flight. The report data is always fetched with the async equivalent of the pipelined fetch strategy.
+
+    Args:
+        report_type: str: Determine which report to generate
+        stream: bool: Stream the report to S3 chunk by chunk, instead of building it in memory first.
+        report_format: str: Format of the uploaded report. One of the ReportFormat values.
+        force_refresh: bool: Generate the report again, even if it was already generated today.
+        resources: Optional[AsyncReportResources]: Engines, S3 client and limits shared with other reports.
+            Created for this report only, and disposed of after it, if not passed.
+        delta: bool: Upload only the rows changed since the last full report. Delta reports are always built in memory.
+
+    Returns:
+        A Download Link for the Report.
+
+    """
+    if resources is None:
+        async with AsyncReportResources.create() as resources:
+            return await generate_report_async(report_type, stream, report_format, force_refresh, resources, delta)
+
+    with record_report(report_type, settings.metrics_sample_interval, settings.metrics_textfile_dir) as report_metrics:
+        delta = check_delta(report_type, report_format, delta)
+        report_parameters = get_reuse_parameters(report_type, report_format, delta)
+        if not force_refresh:
+            with stage('reuse_lookup'):
+                download_link = await _get_existing_report_link_async(report_type, report_parameters, resources)
+            if download_link is not None:
+                report_metrics.outcome = 'reused'
+                return download_link
+
+        metadata = new_report_details(report_type, report_format, report_parameters)
+        s3_bucket_name, s3_object_key = metadata['s3_bucket'], metadata['s3_object_key']
+
+        if delta:
+            # The base is downloaded first, so a missing base doesn't cost anything more than a full report.
+            with stage('download_base') as download_stage:
+                base_details, base_report = await _load_delta_base_async(report_type, report_format, resources)
+                if base_report is not None:
+                    download_stage.rows = len(base_report)
+
+        report_chunks, arrow_schema = _get_report_chunks_async(report_type, report_format, resources)
+        try:
+            # Pull the first chunk before starting the upload, so an empty report never reaches S3.
+            first_chunk = await anext(report_chunks, None)
+            if first_chunk is None or first_chunk.empty:
+                logger.exception('Failed to Pull the data.')
+                raise DataFetchError('Failed to Pull data to build the report!')
+
+            def encode(chunks: Iterator[pd.DataFrame]) -> Iterator[bytes]:
+                return iter_stage('encode', iter_encoded_parts(iter_in_key_order(chunks, 'user_id'), report_format, arrow_schema))
+
+            headers = get_content_headers(report_format)
+            if delta:
+                report = await _consume_chunks_in_thread(
+                    first_chunk,
+                    report_chunks,
+                    lambda chunks: read_delta_report_chunks(iter_in_key_order(chunks, 'user_id'))
+                )
+                report_data = await asyncio.to_thread(encode_delta_report, report, base_details, base_report, metadata)
+                download_link = await _upload_report_async(report_data, metadata, headers, resources)
+            elif stream:
+                # A streamed report holds its upload slot for as long as it is fetched.
+                async with resources.upload_semaphore:
+                    with stage('upload'):
+                        download_link = await _consume_chunks_in_thread(
+                            first_chunk,
+                            report_chunks,
+                            lambda chunks: save_stream(encode(chunks), s3_bucket_name, s3_object_key, metadata, headers, resources.s3_client)
+                        )
+            else:
+                with stage('build') as build_stage:
+                    report_data = await _consume_chunks_in_thread(first_chunk, report_chunks, lambda chunks: b''.join(encode(chunks)))
+                    build_stage.bytes = len(report_data)
+                metadata['s3_object_key'] = await asyncio.to_thread(
+                    get_content_object_key, report_type, metadata['report_date'], report_data, report_format
+                )
+                download_link = await _upload_report_async(report_data, metadata, headers, resources)
+        finally:
+            await report_chunks.aclose()
+
+        add_report_metrics(metadata, report_metrics)
+        with stage('save_to_db'):
+            async with resources.postgres_session_factory() as postgres_session:
+                await postgres_session.run_sync(save_to_db, metadata, download_link)
+
+    return download_link
+
+
+async def generate_reports_batch_async(
+        report_requests: List[ReportRequest],
+        max_concurrent_reports: Optional[int] = None,
+        resources: Optional[AsyncReportResources] = None
+) -> List[ReportResult]:
+    """
+    Async version of generate_reports_batch: all the reports run on one event loop, sharing the async engines,
+    the S3 client and the query and upload limits. The fetch strategy of the requests is not used.
+
+    Args:
+        report_requests: List[ReportRequest]: The reports to generate.
+        max_concurrent_reports: Optional[int]: Number of reports in flight at the same time. Default = report_batch_workers.
+        resources: Optional[AsyncReportResources]: Shared engines, client and limits. Created for the batch if not passed.
+
+    Returns:
+        A result for every requested report, in the same order as the requests.
+    """
+    if not report_requests:
+        return []
+    if resources is None:
+        async with AsyncReportResources.create() as resources:
+            return await generate_reports_batch_async(report_requests, max_concurrent_reports, resources)
+
+    unique_requests = list(dict.fromkeys(report_requests))
+    report_semaphore = asyncio.Semaphore(max(1, max_concurrent_reports or settings.report_batch_workers))
+
+    async def run_report(report_request: ReportRequest) -> ReportResult:
+        async with report_semaphore:
+            started = time.perf_counter()
+            try:
+                download_link = await generate_report_async(
+                    report_type=report_request.report_type,
+                    stream=report_request.stream,
+                    report_format=report_request.report_format,
+                    force_refresh=report_request.force_refresh,
+                    resources=resources,
+                    delta=report_request.delta
+                )
+            except Exception as e:
+                logger.exception(f'Failed to generate the {report_request.report_type} report. Details: {str(e)}')
+                return ReportResult(report_request, error=f'{type(e).__name__}: {e}', duration_seconds=time.perf_counter() - started)
+            return ReportResult(report_request, download_link=download_link, duration_seconds=time.perf_counter() - started)
+
+    logger.info(f'Generating {len(unique_requests)} reports on the event loop.')
+    results = dict(zip(unique_requests, await asyncio.gather(*(run_report(request) for request in unique_requests))))
+    return [results[report_request] for report_request in report_requests]
+
+
+def run_report_async(report_type: str, **options) -> str:
+    """
+    Generates a report with generate_report_async, from synchronous code. Takes the same options as generate_report_async.
+    """
+    return asyncio.run(generate_report_async(report_type, **options))
+
+
+def run_reports_batch_async(report_requests: List[ReportRequest], **options) -> List[ReportResult]:
+    """
+    Generates a batch of reports with generate_reports_batch_async, from synchronous code.
+    """
+    return asyncio.run(generate_reports_batch_async(report_requests, **options))
+
+
+async def _get_existing_report_link_async(
+        report_type: str,
+        report_parameters: str,
+        resources: AsyncReportResources
+) -> Optional[str]:
+    """
+    Async version of generator._get_existing_report_link.
+    """
+    async with resources.postgres_session_factory() as postgres_session:
+        existing_report = await postgres_session.run_sync(find_existing_report, report_type, date.today(), report_parameters)
+    return await asyncio.to_thread(get_existing_report_link, existing_report, resources.s3_client)
+
+
+async def _load_delta_base_async(
+        report_type: str,
+        report_format: str,
+        resources: AsyncReportResources
+) -> Tuple[Optional[ReportsGenerated], Optional[pd.DataFrame]]:
+    """
+    Async version of generator._load_delta_base.
+    """
+    async with resources.postgres_session_factory() as postgres_session:
+        base_details = await postgres_session.run_sync(
+            find_delta_base,
+            report_type,
+            report_format,
+            date.today(),
+            settings.report_delta_max_base_age_days
+        )
+    return base_details, await asyncio.to_thread(read_delta_base, base_details, resources.s3_client)
+
+
+def _get_report_chunks_async(
+        report_type: str,
+        report_format: str,
+        resources: AsyncReportResources
+) -> Tuple[AsyncIterator[pd.DataFrame], Optional['pyarrow.Schema']]:
+    """
+    Async version of generator._get_report_chunks.
+
+    Returns:
+        An async iterator over the report chunks, and the arrow schema of the parquet reports.
+    """
+    report_chunks = _empty_chunks()
+    arrow_schema = None
+    if report_type == ValidReports.CUSTOMER_X.value:
+        report_chunks = iter_customer_x_report_chunks_async(
+            resources.postgres_session_factory,
+            resources.mysql_session_factory,
+            resources.query_semaphore,
+            concurrency=settings.report_fetch_concurrency,
+            chunksize=settings.report_chunk_size
+        )
+        if report_format == ReportFormat.PARQUET.value:
+            arrow_schema = get_customer_x_arrow_schema()
+    elif report_type == ValidReports.CUSTOMER_X_DAILY.value:
+        check_merged_chunks_window(settings.report_daily_days)
+        report_chunks = _iter_daily_frames_async(iter_customer_x_report_chunks_async(
+            resources.postgres_session_factory,
+            resources.mysql_session_factory,
+            resources.query_semaphore,
+            concurrency=settings.report_fetch_concurrency,
+            chunksize=settings.report_chunk_size
+        ))
+        if report_format == ReportFormat.PARQUET.value:
+            arrow_schema = get_customer_x_daily_arrow_schema()
+    return report_chunks, arrow_schema
+
+
+async def _upload_report_async(
+        report_data: bytes,
+        metadata: Dict,
+        headers: Dict,
+        resources: AsyncReportResources
+) -> str:
+    async with resources.upload_semaphore:
+        with stage('upload') as upload_stage:
+            upload_stage.bytes = len(report_data)
+            return await asyncio.to_thread(
+                save, report_data, metadata['s3_bucket'], metadata['s3_object_key'], metadata, headers, resources.s3_client
+            )
+
+
+async def _consume_chunks_in_thread(
+        first_chunk: pd.DataFrame,
+        report_chunks: AsyncIterator[pd.DataFrame],
+        consume: Callable[[Iterator[pd.DataFrame]], T]
+) -> T:
+    """
+    Runs `consume` (the encoding, and the upload) in a worker thread, handing it the chunks as they are fetched
+    on the event loop. At most two chunks wait for the thread, so memory stays bounded by a few chunks.
+
+    Args:
+        first_chunk: pd.DataFrame: The first chunk, already pulled from report_chunks.
+        report_chunks: AsyncIterator[pd.DataFrame]: The rest of the chunks.
+        consume: Callable[[Iterator[pd.DataFrame]], T]: Reads all the chunks, in a worker thread.
+
+    Returns:
+        What `consume` returned.
+    """
+    chunk_queue = queue.Queue(maxsize=2)
+    consumer = asyncio.ensure_future(asyncio.to_thread(consume, _iter_queue(chunk_queue)))
+
+    async def hand_over(item):
+        while True:
+            try:
+                chunk_queue.put_nowait(item)
+                return
+            except queue.Full:
+                if consumer.done():
+                    # The consumer stopped reading: return its error, there's nobody to hand the chunk to.
+                    await consumer
+                    raise RuntimeError('The report chunks were not read until the end.')
+                await asyncio.sleep(0.005)
+
+    try:
+        await hand_over(first_chunk)
+        async for report_chunk in report_chunks:
+            await hand_over(report_chunk)
+        await hand_over(_END_OF_CHUNKS)
+    except BaseException as e:
+        # Unblocks the consumer, so its thread ends with the same error.
+        try:
+            chunk_queue.put_nowait(e)
+        except queue.Full:
+            pass
+        if not consumer.done():
+            consumer.cancel()
+        raise
+
+    return await consumer
+
+
+def _iter_queue(chunk_queue: queue.Queue) -> Iterator[pd.DataFrame]:
+    while True:
+        item = chunk_queue.get()
+        if item is _END_OF_CHUNKS:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+async def _iter_daily_frames_async(report_chunks: AsyncIterator[pd.DataFrame]) -> AsyncIterator[pd.DataFrame]:
+    first_day, window = get_daily_window(settings.report_daily_days)
+    try:
+        async for report_chunk in report_chunks:
+            # The pivot of every chunk is pandas work, done in a worker thread to keep the event loop free.
+            for daily_frame in await asyncio.to_thread(list, iter_daily_frames([report_chunk], first_day, window)):
+                yield daily_frame
+    finally:
+        await report_chunks.aclose()
+
+
+async def _empty_chunks() -> AsyncIterator[pd.DataFrame]:
+    return
+    yield
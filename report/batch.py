@@ -0,0 +1,228 @@
+from .checkpoints import clear_report_checkpoints
+from .generator import generate_report
+from .report_types import ValidReports, FetchStrategy, ReportFormat
+from database.connections import get_postgres_session_class
+from services.aws_s3 import get_s3_client
+from services.save_report_details import save_many_to_db
+from services.instrumentation import stage
+from config import settings
+from exceptions.report_gen_exceptions import DataSaveFailure
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, fields
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+import boto3
+import json
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ReportRequest:
+    """
+    One report to generate in a batch, with the same options as generate_report.
+    """
+    report_type: str
+    stream: bool = False
+    fetch_strategy: str = FetchStrategy.SERIAL.value
+    report_format: str = ReportFormat.CSV.value
+    force_refresh: bool = False
+    delta: bool = False
+
+    def __post_init__(self):
+        # The options come from json too (manifests, the report service), where anything can be passed.
+        for option in fields(self):
+            if not isinstance(getattr(self, option.name), option.type):
+                raise ValueError(f'{option.name} should be a {option.type.__name__}: {getattr(self, option.name)!r}')
+        if self.report_type not in set(report.value for report in ValidReports):
+            raise ValueError(f'Unknown report type: {self.report_type}')
+        if self.fetch_strategy not in set(strategy.value for strategy in FetchStrategy):
+            raise ValueError(f'Unknown fetch strategy: {self.fetch_strategy}')
+        if self.report_format not in set(report_format.value for report_format in ReportFormat):
+            raise ValueError(f'Unknown report format: {self.report_format}')
+
+
+@dataclass
+class ReportResult:
+    """
+    The outcome of one report of a batch. Exactly one of download_link and error is set.
+    """
+    request: ReportRequest
+    download_link: Optional[str] = None
+    error: Optional[str] = None
+    duration_seconds: float = 0.0
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+def load_manifest(manifest_path: Union[str, Path], **defaults) -> List[ReportRequest]:
+    """
+    Reads the reports to generate from a json manifest. The manifest is a list, where every entry is either
+    a report type, or an object with the report_type and any of the other ReportRequest options.
+
+    Example:
+        ["customer_x", {"report_type": "customer_x", "report_format": "parquet", "stream": true}]
+
+    Args:
+        manifest_path: Union[str, Path]: Path of the json manifest.
+        **defaults: Options used for the entries that don't set them, like report_format.
+
+    Returns:
+        The reports to generate, in the order of the manifest.
+    """
+    entries = json.loads(Path(manifest_path).read_text())
+    if not isinstance(entries, list):
+        raise ValueError('The manifest should be a list of reports.')
+
+    option_names = set(field.name for field in fields(ReportRequest))
+    report_requests = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {'report_type': entry}
+        if not isinstance(entry, dict) or 'report_type' not in entry:
+            raise ValueError(f'Every manifest entry needs a report_type: {entry}')
+        unknown_options = set(entry) - option_names
+        if unknown_options:
+            raise ValueError(f'Unknown options in the manifest: {sorted(unknown_options)}')
+        report_requests.append(ReportRequest(**{**defaults, **entry}))
+
+    return report_requests
+
+
+def generate_reports_batch(
+        report_requests: List[ReportRequest],
+        max_workers: Optional[int] = None,
+        s3_client: Optional[boto3.client] = None
+) -> List[ReportResult]:
+    """
+    Generates a batch of reports in one process. The reports run concurrently on a bounded number of threads,
+    sharing the database engines (and their connection pools) and a single S3 client, instead of every report
+    paying for its own interpreter, engines and client setup.
+
+    A report that fails does not stop the others, its error is returned in its result.
+    The same request appearing more than once in the batch is only generated once.
+    The details of all the generated reports are saved at the end, in one transaction.
+
+    Args:
+        report_requests: List[ReportRequest]: The reports to generate.
+        max_workers: Optional[int]: Number of reports generated at the same time. Default = report_batch_workers.
+        s3_client: Optional[boto3.client]: The S3 client shared by all the reports. The shared one is used if not passed.
+
+    Returns:
+        A result for every requested report, in the same order as the requests.
+    """
+    if not report_requests:
+        return []
+
+    unique_requests = list(dict.fromkeys(report_requests))
+    if s3_client is None:
+        s3_client = get_s3_client()
+    max_workers = max(1, min(max_workers or settings.report_batch_workers, len(unique_requests)))
+
+    logger.info(f'Generating {len(unique_requests)} reports, {max_workers} at a time.')
+    pending_report_details = []
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='report-batch') as executor:
+        results = dict(zip(
+            unique_requests,
+            executor.map(
+                lambda report_request: run_report(report_request, s3_client, pending_report_details),
+                unique_requests
+            )
+        ))
+    save_batch_report_details(list(results.values()), pending_report_details)
+
+    failed = sum(not result.succeeded for result in results.values())
+    logger.info(f'Batch finished: {len(results) - failed} reports generated, {failed} failed.')
+    return [results[report_request] for report_request in report_requests]
+
+
+def save_batch_report_details(results: List[ReportResult], pending_report_details: List[Dict]):
+    """
+    Saves the details of the reports generated by a batch in one transaction. If that fails, the reports
+    whose details were not saved are marked as failed, even though they were uploaded, and the checkpoints of
+    the resumable ones are kept. Otherwise they are cleared, a rerun won't need to resume them anymore.
+
+    Args:
+        results: List[ReportResult]: The results of the batch.
+        pending_report_details: List[Dict]: The details of the generated reports, as collected by generate_report.
+    """
+    if not pending_report_details:
+        return
+    try:
+        with stage('save_to_db'):
+            save_many_to_db(get_postgres_session_class()(), pending_report_details)
+    except DataSaveFailure as e:
+        unsaved_links = set(report_details['download_link'] for report_details in pending_report_details)
+        for result in results:
+            if result.succeeded and result.download_link in unsaved_links:
+                result.error = f'{type(e).__name__}: {e}'
+        return
+
+    for result in results:
+        if result.succeeded and result.request.fetch_strategy == FetchStrategy.RESUMABLE.value:
+            clear_report_checkpoints(settings.report_checkpoint_dir, result.request.report_type)
+
+
+def run_report(
+        report_request: ReportRequest,
+        s3_client: boto3.client,
+        pending_report_details: Optional[List[Dict]] = None
+) -> ReportResult:
+    """
+    Generates a single report, and times it. A failure is returned in the result instead of being raised.
+
+    Args:
+        report_request: ReportRequest: The report to generate.
+        s3_client: boto3.client: The S3 client shared by the reports.
+        pending_report_details: Optional[List[Dict]]: Collects the details of the report, to be saved with the
+            rest of the batch. The details are saved right away if not passed.
+
+    Returns:
+        The result of the report.
+    """
+    started = time.perf_counter()
+    try:
+        download_link = generate_report(
+            report_type=report_request.report_type,
+            stream=report_request.stream,
+            fetch_strategy=report_request.fetch_strategy,
+            report_format=report_request.report_format,
+            force_refresh=report_request.force_refresh,
+            s3_client=s3_client,
+            pending_report_details=pending_report_details,
+            delta=report_request.delta
+        )
+    except Exception as e:
+        logger.exception(f'Failed to generate the {report_request.report_type} report. Details: {str(e)}')
+        return ReportResult(report_request, error=f'{type(e).__name__}: {e}', duration_seconds=time.perf_counter() - started)
+
+    return ReportResult(report_request, download_link=download_link, duration_seconds=time.perf_counter() - started)
+
+
+def summarise_results(results: List[ReportResult]) -> List[Dict]:
+    """
+    Turns the results of a batch into plain dicts, for printing or logging.
+
+    Args:
+        results: List[ReportResult]: The results of generate_reports_batch.
+
+    Returns:
+        A dict per report, with its options, status, duration and download link or error.
+    """
+    return [
+        {
+            'report_type': result.request.report_type,
+            'report_format': result.request.report_format,
+            'fetch_strategy': result.request.fetch_strategy,
+            'status': 'ok' if result.succeeded else 'failed',
+            'duration_seconds': round(result.duration_seconds, 3),
+            'download_link': result.download_link,
+            'error': result.error,
+        }
+        for result in results
+    ]
@@ -0,0 +1,161 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import date
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Union
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+
+
+@contextmanager
+def report_checkpoint_lock(checkpoint_dir: Union[str, Path], report_type: str) -> Iterator[None]:
+    """
+    Holds the lock of the checkpoints of a report type, so two runs of the same report (like two formats of it
+    in a batch) never write to, read from or delete the same checkpoint at the same time. The second run waits,
+    and then resumes from what the first one left behind.
+
+    Args:
+        checkpoint_dir: Union[str, Path]: Directory holding the checkpoints of every report.
+        report_type: str: Type of the report.
+    """
+    checkpoint_dir = Path(checkpoint_dir)
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+    with open(checkpoint_dir / f'{report_type}.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@dataclass
+class ReportCheckpoint:
+    """
+    The chunks of a report run that were already fetched, saved locally as parquet files, along with the last
+    key (user_id) of every chunk, so a run that failed half way can resume after the last good chunk.
+
+    The manifest is rewritten after every chunk, and both are written next to their final name and then renamed,
+    so a run killed at any point leaves a consistent checkpoint behind.
+    """
+    directory: Path
+    chunks: List[Dict] = field(default_factory=list)
+    complete: bool = False
+
+    @classmethod
+    def for_report(
+            cls,
+            checkpoint_dir: Union[str, Path],
+            report_type: str,
+            report_date: date,
+            parameters: Dict
+    ) -> 'ReportCheckpoint':
+        """
+        Opens the checkpoint of a report run, empty if there is none yet. The checkpoints of the same report
+        for other days are deleted, they can never be resumed. Call it while holding the report_checkpoint_lock.
+
+        Args:
+            checkpoint_dir: Union[str, Path]: Directory holding the checkpoints of every report.
+            report_type: str: Type of the report.
+            report_date: date: Date of the report, a run only resumes a checkpoint of the same day.
+            parameters: Dict: Options that change the content of the chunks, a run only resumes a checkpoint
+                with the same options.
+
+        Returns:
+            The checkpoint.
+        """
+        report_dir = Path(checkpoint_dir) / report_type
+        if report_dir.is_dir():
+            for date_dir in report_dir.iterdir():
+                if date_dir.name != report_date.isoformat():
+                    logger.debug(f'Deleting the stale checkpoint {date_dir}.')
+                    shutil.rmtree(date_dir, ignore_errors=True)
+
+        parameters_key = hashlib.sha1(json.dumps(parameters, sort_keys=True).encode()).hexdigest()[:12]
+        checkpoint = cls(report_dir / report_date.isoformat() / parameters_key)
+        checkpoint.load()
+        return checkpoint
+
+    @property
+    def last_key(self) -> Optional[int]:
+        return self.chunks[-1]['last_key'] if self.chunks else None
+
+    def load(self):
+        manifest_path = self.directory / MANIFEST_NAME
+        if not manifest_path.exists():
+            return
+        manifest = json.loads(manifest_path.read_text())
+        missing_files = [chunk['file'] for chunk in manifest['chunks'] if not (self.directory / chunk['file']).exists()]
+        if missing_files:
+            logger.warning(f'Checkpoint {self.directory} is missing {missing_files}, starting over.')
+            self.clear()
+            return
+        self.chunks = manifest['chunks']
+        self.complete = manifest['complete']
+
+    def iter_chunks(self) -> Iterator[pd.DataFrame]:
+        """
+        Reads the checkpointed chunks back, one at a time, in the order they were saved.
+        """
+        for chunk in self.chunks:
+            yield pd.read_parquet(self.directory / chunk['file'])
+
+    def save_chunk(self, df: pd.DataFrame, last_key: int):
+        """
+        Saves a chunk, and records its last key as the point to resume from.
+
+        Args:
+            df: pd.DataFrame: The report chunk.
+            last_key: int: The last user_id of the chunk, the next chunk starts after it.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        file_name = f'chunk_{len(self.chunks):06d}.parquet'
+        temporary_file = self.directory / f'{file_name}.tmp'
+        df.to_parquet(temporary_file, index=False)
+        os.replace(temporary_file, self.directory / file_name)
+        self.chunks.append({'file': file_name, 'rows': len(df), 'last_key': int(last_key)})
+        self._write_manifest()
+
+    def mark_complete(self):
+        """
+        Records that every chunk of the report was saved, so a rerun reads them all back without querying.
+        """
+        self.complete = True
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._write_manifest()
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.chunks = []
+        self.complete = False
+
+    def _write_manifest(self):
+        manifest_path = self.directory / MANIFEST_NAME
+        temporary_file = manifest_path.with_suffix('.json.tmp')
+        temporary_file.write_text(json.dumps({'chunks': self.chunks, 'complete': self.complete}))
+        os.replace(temporary_file, manifest_path)
+
+
+def clear_report_checkpoints(checkpoint_dir: Union[str, Path], report_type: str):
+    """
+    Deletes every checkpoint of a report type, once the report was generated and saved.
+
+    Args:
+        checkpoint_dir: Union[str, Path]: Directory holding the checkpoints of every report.
+        report_type: str: Type of the report.
+    """
+    report_dir = Path(checkpoint_dir) / report_type
+    if not report_dir.is_dir():
+        return
+    with report_checkpoint_lock(checkpoint_dir, report_type):
+        shutil.rmtree(report_dir, ignore_errors=True)
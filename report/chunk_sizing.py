@@ -0,0 +1,105 @@
+from dataclasses import dataclass, field
+from typing import List, Optional
+import logging
+
+from config import settings
+
+
+logger = logging.getLogger(__name__)
+
+# Bounds of the adaptive chunk size, in active users.
+MIN_CHUNK_SIZE = 100
+MAX_CHUNK_SIZE = 200_000
+
+# The next chunk is at most this many times larger (or smaller) than the last one, so a single odd chunk
+# (a few power users, a slow query) doesn't swing the size all the way.
+MAX_RESIZE_FACTOR = 2.0
+
+
+@dataclass
+class ChunkObservation:
+    """
+    How a chunk of the report turned out: the users asked for and fetched, the merged rows and their memory,
+    and how long the queries and the merge took.
+    """
+    chunk_size: int
+    users: int
+    rows: int
+    bytes: int
+    duration_seconds: float
+
+
+@dataclass
+class AdaptiveChunkSizer:
+    """
+    Picks the number of active users of every chunk from the chunks fetched so far, so a chunk stays within
+    `memory_budget` bytes once merged, and its queries within `target_seconds`. The memory and the time per user
+    are averaged over the chunks (exponentially, by `smoothing`), and the size moves towards the largest one
+    that fits both, by at most MAX_RESIZE_FACTOR per chunk.
+
+    Users with few lessons make for cheap users, and large chunks (fewer MySQL round trips),
+    a few users with long histories make for small ones.
+    """
+    initial_size: int
+    memory_budget: int
+    target_seconds: float
+    min_size: int = MIN_CHUNK_SIZE
+    max_size: int = MAX_CHUNK_SIZE
+    smoothing: float = 0.5
+    observations: List[ChunkObservation] = field(default_factory=list)
+
+    def __post_init__(self):
+        self.size = self._clamp(self.initial_size)
+        self._bytes_per_user: Optional[float] = None
+        self._seconds_per_user: Optional[float] = None
+
+    @classmethod
+    def from_settings(cls) -> 'AdaptiveChunkSizer':
+        return cls(
+            initial_size=settings.report_chunk_size,
+            memory_budget=settings.report_chunk_memory_budget,
+            target_seconds=settings.report_chunk_target_seconds
+        )
+
+    def observe(self, users: int, rows: int, bytes: int, duration_seconds: float) -> int:
+        """
+        Records a chunk fetched with the current size, and picks the size of the next one.
+
+        Args:
+            users: int: Number of active users in the chunk.
+            rows: int: Number of rows of the merged chunk.
+            bytes: int: Memory of the merged chunk.
+            duration_seconds: float: Time spent on the queries and the merge of the chunk.
+
+        Returns:
+            The size of the next chunk.
+        """
+        self.observations.append(ChunkObservation(self.size, users, rows, bytes, duration_seconds))
+        if users == 0:
+            return self.size
+
+        self._bytes_per_user = self._average(self._bytes_per_user, bytes / users)
+        self._seconds_per_user = self._average(self._seconds_per_user, duration_seconds / users)
+
+        fitting_size = self.max_size
+        if self._bytes_per_user > 0:
+            fitting_size = min(fitting_size, self.memory_budget / self._bytes_per_user)
+        if self._seconds_per_user > 0:
+            fitting_size = min(fitting_size, self.target_seconds / self._seconds_per_user)
+
+        next_size = self._clamp(min(max(fitting_size, self.size / MAX_RESIZE_FACTOR), self.size * MAX_RESIZE_FACTOR))
+        logger.debug(
+            f'Chunk of {users} users: {rows} rows, {bytes} bytes in {duration_seconds:.3f}s. Next chunk: {next_size} users.'
+        )
+        if next_size != self.size:
+            logger.info(f'Chunk size changed from {self.size} to {next_size} active users.')
+        self.size = next_size
+        return next_size
+
+    def _average(self, average: Optional[float], value: float) -> float:
+        if average is None:
+            return value
+        return self.smoothing * value + (1 - self.smoothing) * average
+
+    def _clamp(self, size: float) -> int:
+        return int(min(max(size, self.min_size), self.max_size))
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional
+
+import pandas as pd
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+from config import settings
+from exceptions.report_gen_exceptions import DataFetchError
+from services.instrumentation import stage
+from .customer_x_report import (
+    apply_customer_x_typed_schema,
+    get_active_users_page_query,
+    get_lessons_completed_query,
+    merge_active_users_with_lessons
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+async def read_frame_async(session: AsyncSession, statement: Select, query_semaphore: asyncio.Semaphore) -> pd.DataFrame:
+    """
+    Runs a query on an async session, and returns its result as a dataframe.
+
+    Args:
+        session: AsyncSession: Async session of the database the query runs on
+        statement: Select: The query
+        query_semaphore: asyncio.Semaphore: Limits the number of queries running at the same time
+
+    Returns:
+        A dataframe with the result, with its columns even when it is empty
+
+    """
+    async with query_semaphore:
+        result = await session.execute(statement)
+        rows, columns = result.all(), list(result.keys())
+    # Building the dataframe is pandas work, it runs in a worker thread to keep the event loop free.
+    return await asyncio.to_thread(pd.DataFrame.from_records, rows, columns=columns)
+
+
+async def merge_lessons_completed_async(
+        mysql_session_factory: async_sessionmaker,
+        df_active_users_part: pd.DataFrame,
+        start_date: datetime,
+        query_semaphore: asyncio.Semaphore
+) -> pd.DataFrame:
+    """
+    Async version of merge_lessons_completed. Every chunk gets a session of its own, since a connection
+    can only run one query at a time. The merge runs in a worker thread, off the event loop.
+
+    Args:
+        mysql_session_factory: async_sessionmaker: Creates async sessions for the MySQL DB
+        df_active_users_part: pd.DataFrame: A chunk of active users
+        start_date: datetime: Start date to filter results from lessons completed table
+        query_semaphore: asyncio.Semaphore: Limits the number of queries running at the same time
+
+    Returns:
+        The merged report chunk
+
+    """
+    # The asyncio drivers only take plain python ints, not numpy ones.
+    user_ids = [int(user_id) for user_id in df_active_users_part['user_id']]
+    lessons_completed_statement = get_lessons_completed_query(Session(), user_ids, start_date).statement
+    try:
+        async with mysql_session_factory() as mysql_session:
+            with stage('fetch_lessons') as fetch_stage:
+                df_lessons_completed_chunk = await read_frame_async(mysql_session, lessons_completed_statement, query_semaphore)
+                fetch_stage.rows = len(df_lessons_completed_chunk)
+    except (OperationalError, ProgrammingError) as e:
+        logger.error(f'Failed to pull data from Lessons Completed DB. Details: ', exc_info=True)
+        raise DataFetchError('Failed to pull data from Lessons Completed DB.')
+
+    return await asyncio.to_thread(merge_active_users_with_lessons, df_active_users_part, df_lessons_completed_chunk)
+
+
+async def iter_customer_x_report_chunks_async(
+        postgres_session_factory: async_sessionmaker,
+        mysql_session_factory: async_sessionmaker,
+        query_semaphore: asyncio.Semaphore,
+        concurrency: int = 4,
+        chunksize: int = 1000
+) -> AsyncIterator[pd.DataFrame]:
+    """
+    Async version of iter_customer_x_report_chunks_pipelined. The active users are paged by keyset, and the lessons
+    of up to `concurrency` chunks of users are pulled at the same time, as tasks on the event loop instead of threads.
+    The chunks are still yielded in user_id order.
+
+    The queries of every report running on the loop share `query_semaphore`, so the databases never see
+    more queries at once than it allows, however many reports are in flight.
+
+    Args:
+        postgres_session_factory: async_sessionmaker: Creates async sessions for the PostgreSQL DB
+        mysql_session_factory: async_sessionmaker: Creates async sessions for the MySQL DB
+        query_semaphore: asyncio.Semaphore: Limits the number of queries running at the same time
+        concurrency: int: Number of chunks of this report whose lessons are pulled at the same time
+        chunksize: int: Number of active users to pull per chunk
+
+    Returns:
+        An async iterator over the merged report chunks
+
+    """
+    if concurrency < 1:
+        raise ValueError('Concurrency should be at least 1.')
+
+    start_date = datetime.now() - timedelta(days=60)
+    in_flight: deque = deque()
+    try:
+        async with postgres_session_factory() as postgres_session:
+            after_user_id: Optional[int] = None
+            page = 0
+            while True:
+                active_users_statement = get_active_users_page_query(Session(), after_user_id, chunksize).statement
+                try:
+                    with stage('fetch_users', chunk=page) as fetch_stage:
+                        df_active_users_part = await read_frame_async(postgres_session, active_users_statement, query_semaphore)
+                        fetch_stage.rows = len(df_active_users_part)
+                except OperationalError as e:
+                    logger.error(f'Failed to connect to the MindTickle Users DB. Details :', exc_info=True)
+                    raise DataFetchError('Failed to pull data from MindTickle Users DB.')
+
+                if df_active_users_part.empty:
+                    break
+                after_user_id = int(df_active_users_part['user_id'].iloc[-1])
+                if settings.report_typed_schema:
+                    df_active_users_part = await asyncio.to_thread(apply_customer_x_typed_schema, df_active_users_part)
+
+                in_flight.append(asyncio.create_task(
+                    merge_lessons_completed_async(mysql_session_factory, df_active_users_part, start_date, query_semaphore)
+                ))
+                # Always wait for the oldest chunk, so the chunks come out in order.
+                if len(in_flight) >= concurrency:
+                    yield await in_flight.popleft()
+
+                if len(df_active_users_part) < chunksize:
+                    break
+                page += 1
+
+        while in_flight:
+            yield await in_flight.popleft()
+    finally:
+        for task in in_flight:
+            task.cancel()
+        await asyncio.gather(*in_flight, return_exceptions=True)
@@ -0,0 +1,244 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+from datetime import date, datetime, timedelta
+from services.instrumentation import stage
+from config import settings
+from .customer_x_report import get_customer_x_report_chunks, read_active_user_chunks, read_lessons_completed
+from .customer_x_rollup import get_window_days
+from .output_formats import iter_in_key_order
+from .report_types import FetchStrategy, ValidReports
+import logging
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+def get_daily_window(days: int, today: Optional[date] = None) -> Tuple[date, List[date]]:
+    """
+    Returns the days of the customer_x_daily report: the last `days` days, up to yesterday.
+    Today is left out, like in the customer_x report, its lessons are not all in yet.
+
+    Args:
+        days: int: Number of days in the report
+        today: Optional[date]: Day the report is generated on. Default = today
+
+    Returns:
+        The first day of the window, and every day of it in order
+
+    """
+    last_day = (today or date.today()) - timedelta(days=1)
+    first_day = last_day - timedelta(days=days - 1)
+    return first_day, [first_day + timedelta(days=offset) for offset in range(days)]
+
+
+def build_daily_lessons_matrix(
+        user_ids: np.ndarray,
+        lesson_user_ids: np.ndarray,
+        completion_dates: np.ndarray,
+        lessons_completed: np.ndarray,
+        first_day: date,
+        days: int
+) -> np.ndarray:
+    """
+    Scatters the lessons completed per user per day into a dense user × day matrix, with a single bincount
+    over the flat (user row, day offset) positions. Days without lessons are zero, and the lessons of users or
+    days outside the matrix are dropped.
+
+    Args:
+        user_ids: np.ndarray: The users of the matrix rows, sorted and unique
+        lesson_user_ids: np.ndarray: The user of every aggregated row
+        completion_dates: np.ndarray: The day of every aggregated row, as datetime64
+        lessons_completed: np.ndarray: The lessons completed of every aggregated row
+        first_day: date: The day of the first matrix column
+        days: int: Number of matrix columns, one per day
+
+    Returns:
+        An int32 matrix with a row per user and a column per day
+
+    """
+    rows = np.searchsorted(user_ids, lesson_user_ids)
+    offsets = (completion_dates.astype('datetime64[D]') - np.datetime64(first_day, 'D')).astype(np.int64)
+    in_matrix = (offsets >= 0) & (offsets < days) & (rows < len(user_ids))
+    in_matrix[in_matrix] &= user_ids[rows[in_matrix]] == lesson_user_ids[in_matrix]
+
+    counts = np.bincount(
+        rows[in_matrix] * days + offsets[in_matrix],
+        weights=lessons_completed[in_matrix],
+        minlength=len(user_ids) * days
+    )
+    return counts.astype(np.int32).reshape(len(user_ids), days)
+
+
+def to_daily_frame(
+        df_active_users_part: pd.DataFrame,
+        df_lessons_completed_chunk: pd.DataFrame,
+        first_day: date,
+        days: List[date]
+) -> pd.DataFrame:
+    """
+    Builds a chunk of the customer_x_daily report: a row per active user, with their lessons completed
+    on every day of the window in a column of its own.
+
+    Args:
+        df_active_users_part: pd.DataFrame: A chunk of active users, ordered by user_id
+        df_lessons_completed_chunk: pd.DataFrame: Lessons completed per user per day, for the same users
+        first_day: date: First day of the window
+        days: List[date]: Every day of the window
+
+    Returns:
+        The report chunk, in wide format
+
+    """
+    with stage('build_matrix', rows=len(df_active_users_part)):
+        df_lessons_completed_chunk = df_lessons_completed_chunk.dropna(subset=['completion_date'])
+        matrix = build_daily_lessons_matrix(
+            df_active_users_part['user_id'].to_numpy(dtype=np.int64),
+            df_lessons_completed_chunk['user_id'].to_numpy(dtype=np.int64),
+            pd.to_datetime(df_lessons_completed_chunk['completion_date']).to_numpy(),
+            df_lessons_completed_chunk['lessons_completed'].to_numpy(dtype=np.int64),
+            first_day,
+            len(days)
+        )
+        df_users = df_active_users_part[['user_id', 'user_name']].reset_index(drop=True)
+        df_days = pd.DataFrame(matrix, columns=[day.isoformat() for day in days])
+        return pd.concat([df_users, df_days], axis=1)
+
+
+def check_merged_chunks_window(days: int):
+    """
+    Raises a ValueError when the customer_x_daily report can't be built from the merged customer_x chunks:
+    the days before their window (the days of the customer_x report) would be all zeros.
+
+    Args:
+        days: int: Number of days in the report
+    """
+    first_day, _ = get_daily_window(days)
+    # The same bounds as the customer_x report, whose first day is only in the window when it starts at midnight.
+    merged_chunks_days = get_window_days(datetime.now() - timedelta(days=60), datetime.now() - timedelta(days=1))
+    if first_day < merged_chunks_days[0]:
+        raise ValueError(
+            f'A customer_x_daily report of {days} days can only be fetched with the serial strategy, '
+            f'the others build it from the customer_x report, which covers the last {len(merged_chunks_days)} days.'
+        )
+
+
+def iter_daily_frames(report_chunks: Iterable[pd.DataFrame], first_day: date, days: List[date]) -> Iterator[pd.DataFrame]:
+    """
+    Turns the chunks of the customer_x report (one row per user per day, users without lessons on a row of their
+    own) into chunks of the customer_x_daily report, for the fetch strategies that only produce merged chunks.
+    The rows of a user can be split across two chunks (the incremental strategy slices the ordered report),
+    so the rows of the last user of every chunk are held back and built with the next chunk.
+
+    Args:
+        report_chunks: Iterable[pd.DataFrame]: Chunks of the customer_x report, in user_id order
+        first_day: date: First day of the window
+        days: List[date]: Every day of the window
+
+    Returns:
+        An iterator over the chunks of the customer_x_daily report
+
+    """
+    held_back = None
+    for report_chunk in report_chunks:
+        if held_back is not None:
+            report_chunk = pd.concat([held_back, report_chunk], ignore_index=True)
+        if report_chunk.empty:
+            continue
+        is_last_user = (report_chunk['user_id'] == report_chunk['user_id'].iloc[-1]).to_numpy()
+        held_back = report_chunk[is_last_user]
+        if not is_last_user.all():
+            yield _to_daily_frame_from_report_chunk(report_chunk[~is_last_user], first_day, days)
+    if held_back is not None:
+        yield _to_daily_frame_from_report_chunk(held_back, first_day, days)
+
+
+def _to_daily_frame_from_report_chunk(report_chunk: pd.DataFrame, first_day: date, days: List[date]) -> pd.DataFrame:
+    df_active_users_part = report_chunk[['user_id', 'user_name']].drop_duplicates('user_id')
+    return to_daily_frame(df_active_users_part, report_chunk, first_day, days)
+
+
+def iter_customer_x_daily_report_chunks(
+        postgres_session: Session,
+        mysql_session: Session,
+        days: int = 30,
+        chunksize: int = 1000
+) -> Iterator[pd.DataFrame]:
+    """
+    Pulls the active users in chunks, and for each chunk the lessons completed per day within the window,
+    and scatters them straight into the user × day matrix, without merging the users and lessons first.
+
+    Args:
+        postgres_session: Session: Session object for PostgreSQL DB
+        mysql_session: Session: Session object for MySQL DB
+        days: int: Number of days in the report
+        chunksize: int: Number of active users to pull per chunk
+
+    Returns:
+        An iterator over the chunks of the customer_x_daily report
+
+    """
+    first_day, window = get_daily_window(days)
+    for df_active_users_part in read_active_user_chunks(postgres_session, chunksize):
+        df_lessons_completed_chunk = read_lessons_completed(mysql_session, df_active_users_part['user_id'], first_day)
+        yield to_daily_frame(df_active_users_part, df_lessons_completed_chunk, first_day, window)
+
+
+def get_customer_x_daily_report_chunks(
+        postgres_session: Session,
+        mysql_session: Session,
+        fetch_strategy: str = FetchStrategy.SERIAL.value
+) -> Iterator[pd.DataFrame]:
+    """
+    Returns the chunks of the customer_x_daily report, over the last report_daily_days days.
+    The serial strategy builds the matrix from the lessons as they are fetched, the others from their merged chunks.
+
+    Args:
+        postgres_session: Session: Session object for PostgreSQL DB
+        mysql_session: Session: Session object for MySQL DB
+        fetch_strategy: str: One of the FetchStrategy values
+
+    Returns:
+        An iterator over the report chunks, in report order
+
+    """
+    if fetch_strategy == FetchStrategy.SERIAL.value:
+        report_chunks = iter_customer_x_daily_report_chunks(
+            postgres_session,
+            mysql_session,
+            settings.report_daily_days,
+            settings.report_chunk_size
+        )
+        return iter_in_key_order(report_chunks, 'user_id')
+
+    check_merged_chunks_window(settings.report_daily_days)
+    first_day, window = get_daily_window(settings.report_daily_days)
+    # The merged chunks are checkpointed (by the resumable strategy) as customer_x_daily chunks,
+    # so they are deleted once this report is saved, and never resumed by a customer_x report.
+    report_chunks = get_customer_x_report_chunks(
+        postgres_session,
+        mysql_session,
+        fetch_strategy,
+        ValidReports.CUSTOMER_X_DAILY.value
+    )
+    return iter_daily_frames(report_chunks, first_day, window)
+
+
+def get_customer_x_daily_arrow_schema(days: Optional[int] = None) -> 'pyarrow.Schema':
+    """
+    Returns the column types of the customer_x_daily report, for the columnar (Parquet) output.
+
+    Args:
+        days: Optional[int]: Number of days in the report. Default = report_daily_days
+
+    Returns:
+        The Arrow schema of the report
+
+    """
+    import pyarrow as pa
+
+    _, window = get_daily_window(days or settings.report_daily_days)
+    return pa.schema(
+        [('user_id', pa.int64()), ('user_name', pa.string())]
+        + [(day.isoformat(), pa.int32()) for day in window]
+    )
@@ -1,16 +1,44 @@
+import contextvars
 import pandas as pd
-from sqlalchemy.orm import Session
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.orm.query import Query
-from sqlalchemy import func
+from sqlalchemy import func, Table, Column, Integer, MetaData
 from sqlalchemy.exc import OperationalError, ProgrammingError
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from database.models import MindUsers, LessonCompletion
+from database.streaming import read_sql_bulk_chunks, read_sql_bulk_frame, read_sql_chunks, read_sql_frame
+from exceptions.report_gen_exceptions import DataFetchError
+from services.instrumentation import iter_stage, stage
+from config import settings
+from .report_types import FetchStrategy, ValidReports
+from .active_users_cache import ActiveUsersCache, get_active_users_fingerprint
+from .checkpoints import ReportCheckpoint, report_checkpoint_lock
+from .chunk_sizing import AdaptiveChunkSizer
+from .customer_x_rollup import iter_customer_x_report_chunks_incremental
+from .output_formats import iter_in_key_order
+from .typed_schema import CATEGORY, DATE, apply_typed_schema, concat_typed_chunks, downcast_integers
 import logging
-from typing import List
+from typing import Callable, Iterator, List, Optional
+from uuid import uuid4
 
 
 logger = logging.getLogger(__name__)
 
+# Dtypes of the report columns with `report_typed_schema` set. The lessons completed are nullable,
+# since users without lessons have none, and a user can't possibly complete more than 127 lessons a day
+# (if they do, the column is widened instead of overflowing).
+CUSTOMER_X_TYPED_SCHEMA = {
+    'user_id': 'int32',
+    'user_name': CATEGORY,
+    'lessons_completed': 'Int8',
+    'completion_date': DATE,
+}
+
 
 def get_active_users_query(session: Session) -> Query:
     """
@@ -26,11 +54,77 @@ def get_active_users_query(session: Session) -> Query:
     active_users_query = (
         session.query(MindUsers.user_id, MindUsers.user_name)
         .filter(MindUsers.active_status == 'active')
+        .order_by(MindUsers.user_id)
     )
 
     return active_users_query
 
 
+def get_active_users_fingerprint_query(session: Session) -> Query:
+    """
+    Returns the Query to fetch the number of active users and their highest user_id, which tell
+    (along with the writes to the table) whether the snapshot of the active users is still valid.
+
+    Args:
+        session: Session: SQLAlchemy session object
+
+    Returns:
+        A query object
+
+    """
+    return get_active_users_query(session).with_entities(
+        func.count(MindUsers.user_id),
+        func.max(MindUsers.user_id)
+    ).order_by(None)
+
+
+def get_active_users_page_query(
+        session: Session,
+        after_user_id: Optional[int],
+        limit: int,
+        before_user_id: Optional[int] = None
+) -> Query:
+    """
+    Returns the Query to fetch the next page of active users, by keyset: the first `limit` active users
+    with a user_id above `after_user_id`. Unlike an OFFSET, every page is an index range scan,
+    no matter how far into the users table it is.
+
+    Args:
+        session: Session: SQLAlchemy session object
+        after_user_id: Optional[int]: Last user_id of the previous page, None for the first page
+        limit: int: Number of active users per page
+        before_user_id: Optional[int]: Only fetch the active users below this user_id, None for no upper bound
+
+    Returns:
+        A query object
+
+    """
+    active_users_query = get_active_users_query(session)
+    if after_user_id is not None:
+        active_users_query = active_users_query.filter(MindUsers.user_id > after_user_id)
+    if before_user_id is not None:
+        active_users_query = active_users_query.filter(MindUsers.user_id < before_user_id)
+
+    return active_users_query.limit(limit)
+
+
+def get_active_user_id_range_query(session: Session) -> Query:
+    """
+    Returns the Query to fetch the lowest and the highest user_id of the active users.
+
+    Args:
+        session: Session: SQLAlchemy session object
+
+    Returns:
+        A query object
+
+    """
+    return (
+        session.query(func.min(MindUsers.user_id), func.max(MindUsers.user_id))
+        .filter(MindUsers.active_status == 'active')
+    )
+
+
 def get_lessons_completed_query(session: Session, active_users: List, start_date: datetime) -> Query:
     """
     The get_lessons_completed_query function returns a query that will return the number of lessons completed by each user
@@ -63,6 +157,58 @@ def get_lessons_completed_query(session: Session, active_users: List, start_date
     return lessons_completed_query
 
 
+def get_staged_lessons_completed_query(session: Session, staged_users: Table, start_date: datetime) -> Query:
+    """
+    Same as get_lessons_completed_query, but the users are taken from a staging table on the MySQL side
+    with a join, instead of being sent as a list of literals with every query.
+
+    Args:
+        session: Session: SQLAlchemy session object
+        staged_users: Table: Staging table holding the user ids of the active users
+        start_date: datetime: Start date to filter results from lessons completed table
+
+    Returns:
+        A query object
+
+    """
+    lessons_completed_query = (
+            session.query(
+                LessonCompletion.user_id,
+                func.count(LessonCompletion.lesson_id).label('lessons_completed'),
+                LessonCompletion.completion_date
+            )
+            .join(staged_users, staged_users.c.user_id == LessonCompletion.user_id)
+            .filter(
+                LessonCompletion.completion_date >= start_date,
+                LessonCompletion.completion_date < datetime.now() - timedelta(days=1)  # Exclude today
+            )
+            .group_by(LessonCompletion.user_id, LessonCompletion.completion_date)
+            .order_by(LessonCompletion.user_id, LessonCompletion.completion_date)
+        )
+
+    return lessons_completed_query
+
+
+def get_customer_x_arrow_schema() -> 'pyarrow.Schema':
+    """
+    Returns the column types of the customer_x report, for the columnar (Parquet) output.
+
+    Returns:
+        The Arrow schema of the report
+
+    """
+    import pyarrow as pa
+
+    return pa.schema([
+        ('user_id', pa.int64()),
+        ('user_name', pa.string()),
+        # Not int8 like the typed chunks: a chunk with more than 127 lessons a day is widened (report_integer_overflow),
+        # and the schema is fixed for the whole file. Parquet stores int8 and int16 as int32 anyway.
+        ('lessons_completed', pa.int32()),
+        ('completion_date', pa.date32()),
+    ])
+
+
 # This is the older function, that pulls all the data from active users in 1 go.
 def generate_customer_x_report_v1(postgres_session: Session, mysql_session: Session) -> pd.DataFrame:
     """
@@ -108,63 +254,623 @@ def generate_customer_x_report_v1(postgres_session: Session, mysql_session: Sess
     return final_df
 
 
-def generate_customer_x_report(postgres_session: Session, mysql_session: Session) -> pd.DataFrame:
+def read_active_user_chunks(postgres_session: Session, chunksize: int = 1000) -> Iterator[pd.DataFrame]:
     """
-    This is a modified version of the generate_customer_x_report to pull and process the data in chunks
-    then concatenating the dataframes, rather than pulling and processing the data all at once.
+    Pulls the active users from Mindtickle Users in chunks, ordered by user_id.
+    With `db_stream_results` set, the users are read through a server-side cursor, so only a few chunks
+    are ever held on the client, no matter how large the users table is. With `db_bulk_export` set, they are
+    exported with COPY and parsed straight into columns instead. With `report_active_users_cache` set, they are
+    read from a local snapshot while they are unchanged, see report/active_users_cache.py.
 
     Args:
         postgres_session: Session: Session object for PostgreSQL DB
-        mysql_session: Session: Session object for MySQL DB
+        chunksize: int: Number of active users to pull per chunk
 
     Returns:
-        The final dataframe with the desired data
+        An iterator over the chunks of active users
 
     """
-    active_users_statement = get_active_users_query(postgres_session).statement
     try:
-        df_active_users_chunks = pd.read_sql(
-            active_users_statement,
-            postgres_session.bind,
-            chunksize=1000
-        )
+        if settings.report_active_users_cache:
+            df_active_users_chunks = ActiveUsersCache.from_settings().read_chunks(
+                get_active_users_fingerprint(postgres_session, get_active_users_fingerprint_query(postgres_session)),
+                chunksize,
+                lambda: _fetch_active_user_chunks(postgres_session, chunksize)
+            )
+        else:
+            df_active_users_chunks = _fetch_active_user_chunks(postgres_session, chunksize)
     except OperationalError as e:
         logger.error(f'Failed to connect to the MindTickle Users DB. Details :', exc_info=True)
-        raise Exception
+        raise DataFetchError('Failed to pull data from MindTickle Users DB.')
 
     logging.debug('Pulled data from MindTickle Users successfully.')
 
+    df_active_users_chunks = iter_stage('fetch_users', df_active_users_chunks)
+    if settings.report_typed_schema:
+        return (apply_customer_x_typed_schema(df_active_users_part) for df_active_users_part in df_active_users_chunks)
+    return df_active_users_chunks
+
+
+def _fetch_active_user_chunks(postgres_session: Session, chunksize: int) -> Iterator[pd.DataFrame]:
+    active_users_statement = get_active_users_query(postgres_session).statement
+    if settings.db_bulk_export:
+        return read_sql_bulk_chunks(active_users_statement, postgres_session, chunksize, settings.db_stream_fetch_size)
+    if settings.db_stream_results:
+        return read_sql_chunks(active_users_statement, postgres_session, chunksize, settings.db_stream_fetch_size)
+    return pd.read_sql(active_users_statement, postgres_session.bind, chunksize=chunksize)
+
+
+def read_active_user_pages(
+        postgres_session: Session,
+        chunksize: int = 1000,
+        after_user_id: Optional[int] = None,
+        before_user_id: Optional[int] = None,
+        chunk_sizer: Optional[AdaptiveChunkSizer] = None
+) -> Iterator[pd.DataFrame]:
+    """
+    Pulls the active users page by page, with one keyset query per page, ordered by user_id.
+    No cursor stays open between the pages, so the scan can be picked up again after any user_id.
+    Every page is read like the other queries, through `db_stream_results` or `db_bulk_export` when they are set.
+
+    Args:
+        postgres_session: Session: Session object for PostgreSQL DB
+        chunksize: int: Number of active users to pull per page
+        after_user_id: Optional[int]: Only pull the active users after this user_id
+        before_user_id: Optional[int]: Only pull the active users before this user_id
+        chunk_sizer: Optional[AdaptiveChunkSizer]: Picks the size of every page instead of chunksize,
+            when the next page is asked for.
+
+    Returns:
+        An iterator over the pages of active users
+
+    """
+    page = 0
+    while True:
+        if chunk_sizer is not None:
+            chunksize = chunk_sizer.size
+        active_users_statement = get_active_users_page_query(postgres_session, after_user_id, chunksize, before_user_id).statement
+        try:
+            with stage('fetch_users', chunk=page) as fetch_stage:
+                if settings.db_bulk_export:
+                    df_active_users_part = read_sql_bulk_frame(active_users_statement, postgres_session, settings.db_stream_fetch_size)
+                elif settings.db_stream_results:
+                    df_active_users_part = read_sql_frame(active_users_statement, postgres_session, settings.db_stream_fetch_size)
+                else:
+                    df_active_users_part = pd.read_sql(active_users_statement, postgres_session.connection())
+                fetch_stage.rows = len(df_active_users_part)
+        except OperationalError as e:
+            logger.error(f'Failed to connect to the MindTickle Users DB. Details :', exc_info=True)
+            raise DataFetchError('Failed to pull data from MindTickle Users DB.')
+
+        if df_active_users_part.empty:
+            return
+        after_user_id = int(df_active_users_part['user_id'].iloc[-1])
+        if settings.report_typed_schema:
+            df_active_users_part = apply_customer_x_typed_schema(df_active_users_part)
+        yield df_active_users_part
+
+        if len(df_active_users_part) < chunksize:
+            return
+        page += 1
+
+
+def merge_lessons_completed(mysql_session: Session, df_active_users_part: pd.DataFrame, start_date: datetime) -> pd.DataFrame:
+    """
+    Pulls the lessons a chunk of active users have completed since start_date, and merges them on user_id.
+
+    Args:
+        mysql_session: Session: Session object for MySQL DB
+        df_active_users_part: pd.DataFrame: A chunk of active users
+        start_date: datetime: Start date to filter results from lessons completed table
+
+    Returns:
+        The merged report chunk
+
+    """
+    df_lessons_completed_chunk = read_lessons_completed(mysql_session, df_active_users_part['user_id'], start_date)
+    return merge_active_users_with_lessons(df_active_users_part, df_lessons_completed_chunk)
+
+
+def read_lessons_completed(mysql_session: Session, user_ids: pd.Series, start_date: datetime) -> pd.DataFrame:
+    """
+    Pulls the lessons completed per day by a chunk of active users since start_date.
+
+    Args:
+        mysql_session: Session: Session object for MySQL DB
+        user_ids: pd.Series: The user ids of a chunk of active users
+        start_date: datetime: Start date to filter results from lessons completed table
+
+    Returns:
+        The user_id, lessons_completed and completion_date of every user and day with lessons completed
+
+    """
+    lessons_completed_query = get_lessons_completed_query(mysql_session, user_ids, start_date)
+    try:
+        with stage('fetch_lessons') as fetch_stage:
+            if settings.db_bulk_export:
+                df_lessons_completed_chunk = read_sql_bulk_frame(
+                    lessons_completed_query.statement,
+                    mysql_session,
+                    settings.db_stream_fetch_size
+                )
+            elif settings.db_stream_results:
+                df_lessons_completed_chunk = read_sql_frame(
+                    lessons_completed_query.statement,
+                    mysql_session,
+                    settings.db_stream_fetch_size
+                )
+            else:
+                df_lessons_completed_chunk = pd.read_sql(
+                    lessons_completed_query.statement,
+                    mysql_session.connection()
+                )
+            fetch_stage.rows = len(df_lessons_completed_chunk)
+    except ProgrammingError as e:
+        logger.error(f'Failed to pull data from Lessons Completed DB. Details: ', exc_info=True)
+        raise DataFetchError('Failed to pull data from Lessons Completed DB.')
+
+    return df_lessons_completed_chunk
+
+
+def merge_active_users_with_lessons(df_active_users_part: pd.DataFrame, df_lessons_completed_chunk: pd.DataFrame) -> pd.DataFrame:
+    """
+    Left merges a chunk of active users with the lessons completed by those users.
+
+    Args:
+        df_active_users_part: pd.DataFrame: A chunk of active users
+        df_lessons_completed_chunk: pd.DataFrame: Lessons completed per user per day, for the same users
+
+    Returns:
+        The merged report chunk
+
+    """
+    # Converting column type to int8 instead of int64 default to save some memory
+    # The lessons completed column should never be too high
+    # Because just how many lessons can a guy complete in a day?
+    # If they ever do, the column is widened (or the report fails), instead of silently wrapping around.
+    with stage('merge') as merge_stage:
+        if settings.report_typed_schema:
+            df_lessons_completed_chunk = apply_customer_x_typed_schema(df_lessons_completed_chunk)
+        else:
+            df_lessons_completed_chunk['lessons_completed'] = downcast_integers(
+                df_lessons_completed_chunk['lessons_completed'],
+                'int8',
+                settings.report_integer_overflow
+            )
+        df_report_chunk = pd.merge(df_active_users_part, df_lessons_completed_chunk, on='user_id', how='left')
+        merge_stage.rows = len(df_report_chunk)
+
+    return df_report_chunk
+
+
+def apply_customer_x_typed_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Casts the customer_x columns present in a dataframe to the compact dtypes of CUSTOMER_X_TYPED_SCHEMA,
+    and records how much memory that saved.
+
+    Args:
+        df: pd.DataFrame: A chunk of active users, lessons completed or of the report
+
+    Returns:
+        The cast dataframe
+
+    """
+    with stage('apply_schema', rows=len(df)) as schema_stage:
+        df, memory_saved = apply_typed_schema(df, CUSTOMER_X_TYPED_SCHEMA, settings.report_integer_overflow)
+        schema_stage.memory_saved_bytes = memory_saved
+    logger.debug(f'Typed schema saved {memory_saved} bytes on a chunk of {len(df)} rows.')
+    return df
+
+
+def iter_customer_x_report_chunks(
+        postgres_session: Session,
+        mysql_session: Session,
+        chunksize: int = 1000,
+        chunk_sizer: Optional[AdaptiveChunkSizer] = None
+) -> Iterator[pd.DataFrame]:
+    """
+    Pulls the active users in chunks, and for each chunk pulls the lessons that chunk of users have completed.
+    Every merged chunk is yielded as soon as it is ready, so callers can process (or upload) the report
+    without holding all of it in memory. Users are read ordered by user_id, so the chunks come out in report order.
+
+    Args:
+        postgres_session: Session: Session object for PostgreSQL DB
+        mysql_session: Session: Session object for MySQL DB
+        chunksize: int: Number of active users to pull per chunk
+        chunk_sizer: Optional[AdaptiveChunkSizer]: Sizes every chunk from the ones fetched before, instead of chunksize.
+            The users are then paged by keyset, one query per chunk.
+
+    Returns:
+        An iterator over the merged report chunks
+
+    """
     start_date = datetime.now() - timedelta(days=60)
+    if chunk_sizer is not None:
+        yield from _iter_adaptive_report_chunks(postgres_session, mysql_session, chunk_sizer, start_date)
+        return
 
-    df_list = []
+    df_active_users_chunks = read_active_user_chunks(postgres_session, chunksize)
 
     # We are fetching users in chunks above,
     # For each chunk, we are fetching the lessons that chunk of users have completed.
     # We then merge the dataframes on user_id
-    # We save each merged dataframe in a list, and concat them finally.
     for df_active_users_part in df_active_users_chunks:
-        lessons_completed_query = get_lessons_completed_query(
-            mysql_session,
-            df_active_users_part['user_id'],
-            start_date
+        yield merge_lessons_completed(mysql_session, df_active_users_part, start_date)
+
+
+def _iter_adaptive_report_chunks(
+        postgres_session: Session,
+        mysql_session: Session,
+        chunk_sizer: AdaptiveChunkSizer,
+        start_date: datetime
+) -> Iterator[pd.DataFrame]:
+    df_active_users_pages = read_active_user_pages(postgres_session, chunk_sizer=chunk_sizer)
+    while True:
+        # The next page is only queried here, after the last chunk was observed, so it gets the new size.
+        started = time.perf_counter()
+        df_active_users_part = next(df_active_users_pages, None)
+        if df_active_users_part is None:
+            return
+        df_report_chunk = merge_lessons_completed(mysql_session, df_active_users_part, start_date)
+        chunk_sizer.observe(
+            len(df_active_users_part),
+            len(df_report_chunk),
+            int(df_report_chunk.memory_usage(deep=True).sum()),
+            time.perf_counter() - started
         )
+        yield df_report_chunk
+
+
+def iter_customer_x_report_chunks_pipelined(
+        postgres_session: Session,
+        mysql_session_factory: Callable[[], Session],
+        concurrency: int = 4,
+        chunksize: int = 1000
+) -> Iterator[pd.DataFrame]:
+    """
+    Pipelined version of iter_customer_x_report_chunks. A producer thread keeps reading chunks of active users
+    from PostgreSQL, while a pool of `concurrency` workers, each with its own MySQL session, pulls and merges the
+    lessons completed for those chunks. The chunks are still yielded in the order they were read, so the report
+    comes out exactly the same as the serial version, but the two databases are queried at the same time.
+
+    At most `concurrency` user chunks are waiting for a worker, and at most `concurrency` merged chunks
+    are in flight, so memory stays bounded by a few chunks.
+
+    Args:
+        postgres_session: Session: Session object for PostgreSQL DB
+        mysql_session_factory: Callable[[], Session]: Creates a new session for the MySQL DB, one per worker
+        concurrency: int: Number of workers pulling from MySQL at the same time
+        chunksize: int: Number of active users to pull per chunk
+
+    Returns:
+        An iterator over the merged report chunks
+
+    """
+    if concurrency < 1:
+        raise ValueError('Concurrency should be at least 1.')
+
+    start_date = datetime.now() - timedelta(days=60)
+    user_chunks = queue.Queue(maxsize=concurrency)
+    stop_reading = threading.Event()
+    end_of_users = object()
+
+    def hand_over(item) -> bool:
+        # Gives up once the collector has stopped, so the producer never blocks forever on a full queue.
+        while not stop_reading.is_set():
+            try:
+                user_chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read_user_chunks():
+        # Anything raised by the producer is handed over to the collector, which re-raises it.
         try:
-            df_lessons_completed_chunk = pd.read_sql(
-                lessons_completed_query.statement,
-                mysql_session.bind
-            )
+            for df_active_users_part in read_active_user_chunks(postgres_session, chunksize):
+                if not hand_over(df_active_users_part):
+                    return
+            hand_over(end_of_users)
+        except BaseException as e:
+            hand_over(e)
+
+    worker_state = threading.local()
+    worker_sessions = []
+    worker_sessions_lock = threading.Lock()
+
+    def open_worker_session():
+        worker_state.mysql_session = mysql_session_factory()
+        with worker_sessions_lock:
+            worker_sessions.append(worker_state.mysql_session)
+
+    def merge_user_chunk(df_active_users_part: pd.DataFrame) -> pd.DataFrame:
+        return merge_lessons_completed(worker_state.mysql_session, df_active_users_part, start_date)
+
+    # The producer and the workers run in a copy of this context, so their stages are recorded with the report.
+    producer = threading.Thread(target=contextvars.copy_context().run, args=(read_user_chunks,), daemon=True)
+    executor = ThreadPoolExecutor(
+        max_workers=concurrency,
+        thread_name_prefix='customer_x_lessons',
+        initializer=open_worker_session
+    )
+    in_flight = deque()
+    producer.start()
+    try:
+        while True:
+            user_chunk = user_chunks.get()
+            if user_chunk is end_of_users:
+                break
+            if isinstance(user_chunk, BaseException):
+                raise user_chunk
+            in_flight.append(executor.submit(contextvars.copy_context().run, merge_user_chunk, user_chunk))
+
+            # The ordered collector: always wait for the oldest chunk, so the chunks come out in order.
+            if len(in_flight) >= concurrency:
+                yield in_flight.popleft().result()
+
+        while in_flight:
+            yield in_flight.popleft().result()
+    finally:
+        stop_reading.set()
+        for future in in_flight:
+            future.cancel()
+        executor.shutdown(wait=True)
+        producer.join()
+        for worker_session in worker_sessions:
+            worker_session.close()
+
+
+def iter_customer_x_report_chunks_staged(
+        postgres_session: Session,
+        mysql_session: Session,
+        chunksize: int = 1000,
+        fetch_size: int = 1000
+) -> Iterator[pd.DataFrame]:
+    """
+    Staged join version of iter_customer_x_report_chunks. Instead of sending a `user_id IN (...)` query per chunk,
+    the active user ids are bulk-loaded into a MySQL temporary table once, and MySQL runs a single indexed join
+    and group by over all of them. That result is streamed back, ordered by user_id, and merged with a second
+    ordered pass over the active users, chunk by chunk.
+
+    The temporary table lives on the connection of `mysql_session`, and is dropped once the report is read.
+    The active users are read twice, so users activated in between the two passes will show up without lessons.
+
+    Args:
+        postgres_session: Session: Session object for PostgreSQL DB
+        mysql_session: Session: Session object for MySQL DB
+        chunksize: int: Number of active users to pull per chunk
+        fetch_size: int: Number of lesson rows streamed back from MySQL per round trip
 
-            # Converting column type to int8 instead of int64 default to save some memory
-            # The lessons completed column should never be too high
-            # Because just how many lessons can a guy complete in a day?
-            df_lessons_completed_chunk['lessons_completed'] = df_lessons_completed_chunk['lessons_completed'].astype('int8')
-            part_df = pd.merge(df_active_users_part, df_lessons_completed_chunk, on='user_id', how='left')
+    Returns:
+        An iterator over the merged report chunks
 
-            df_list.append(part_df)
+    """
+    start_date = datetime.now() - timedelta(days=60)
+    mysql_connection = mysql_session.connection()
+
+    # Temporary tables are per connection, but pooled connections are reused, so the name is made unique.
+    staged_users = Table(
+        f'report_active_users_{uuid4().hex[:12]}',
+        MetaData(),
+        Column('user_id', Integer, primary_key=True, autoincrement=False),
+        prefixes=['TEMPORARY']
+    )
+    staged_users.create(mysql_connection)
+    df_lessons_completed_chunks = None
+    try:
+        with stage('stage_users') as stage_users_stage:
+            stage_users_stage.rows = 0
+            for df_active_users_part in read_active_user_chunks(postgres_session, chunksize):
+                mysql_connection.execute(
+                    staged_users.insert(),
+                    [{'user_id': int(user_id)} for user_id in df_active_users_part['user_id']]
+                )
+                stage_users_stage.rows += len(df_active_users_part)
+        logger.debug('Staged the active users in MySQL.')
+
+        lessons_completed_query = get_staged_lessons_completed_query(mysql_session, staged_users, start_date)
+        try:
+            df_lessons_completed_chunks = read_sql_chunks(
+                lessons_completed_query.statement,
+                mysql_session,
+                fetch_size,
+                fetch_size
+            )
         except ProgrammingError as e:
             logger.error(f'Failed to pull data from Lessons Completed DB. Details: ', exc_info=True)
-            raise Exception
+            raise DataFetchError('Failed to pull data from Lessons Completed DB.')
+
+        # Both sides come ordered by user_id, so every user chunk takes the lesson rows up to its last user_id,
+        # and keeps the rest pending for the next chunk.
+        pending_lessons = []
+        lessons_exhausted = False
+        for df_active_users_part in read_active_user_chunks(postgres_session, chunksize):
+            last_user_id = df_active_users_part['user_id'].iloc[-1]
+            while not lessons_exhausted and (not pending_lessons or pending_lessons[-1]['user_id'].iloc[-1] <= last_user_id):
+                df_lessons_completed_part = next(df_lessons_completed_chunks, None)
+                if df_lessons_completed_part is None:
+                    lessons_exhausted = True
+                elif not df_lessons_completed_part.empty:
+                    pending_lessons.append(df_lessons_completed_part)
+
+            if pending_lessons:
+                df_lessons_completed = pd.concat(pending_lessons, ignore_index=True)
+                in_chunk = df_lessons_completed['user_id'] <= last_user_id
+                pending_lessons = [df_lessons_completed[~in_chunk]] if not in_chunk.all() else []
+                df_lessons_completed = df_lessons_completed[in_chunk].reset_index(drop=True)
+            else:
+                df_lessons_completed = pd.DataFrame(columns=['user_id', 'lessons_completed', 'completion_date'])
+
+            yield merge_active_users_with_lessons(df_active_users_part, df_lessons_completed)
+
+        # Read whatever is left, so the result set is consumed before the staging table is dropped.
+        for _ in df_lessons_completed_chunks:
+            pass
+    finally:
+        # Stopping an unbuffered MySQL read early invalidates the connection, which drops the temporary table as well.
+        if df_lessons_completed_chunks is not None:
+            df_lessons_completed_chunks.close()
+        if not mysql_connection.invalidated:
+            staged_users.drop(mysql_connection)
+
+
+def iter_customer_x_report_chunks_resumable(
+        postgres_session: Session,
+        mysql_session: Session,
+        checkpoint_dir: str,
+        chunksize: int = 1000,
+        report_type: str = ValidReports.CUSTOMER_X.value
+) -> Iterator[pd.DataFrame]:
+    """
+    Resumable version of iter_customer_x_report_chunks. The active users are paged by keyset, and every merged
+    chunk is checkpointed to `checkpoint_dir` with its last user_id before it is yielded. If the run fails,
+    a rerun of the report on the same day reads the checkpointed chunks back, and carries on after the last good
+    chunk, instead of fetching everything again. The checkpoints are deleted once the report is saved.
+
+    Args:
+        postgres_session: Session: Session object for PostgreSQL DB
+        mysql_session: Session: Session object for MySQL DB
+        checkpoint_dir: str: Directory the chunks are checkpointed to
+        chunksize: int: Number of active users to pull per chunk
+        report_type: str: The report the chunks are fetched for, its checkpoints are kept (and deleted) on their own
+
+    Returns:
+        An iterator over the merged report chunks
+
+    """
+    start_date = datetime.now() - timedelta(days=60)
+    # Chunks are only resumed by a run that would have produced exactly the same chunks.
+    parameters = {'chunksize': chunksize, 'report_typed_schema': settings.report_typed_schema}
+
+    with report_checkpoint_lock(checkpoint_dir, report_type):
+        checkpoint = ReportCheckpoint.for_report(checkpoint_dir, report_type, date.today(), parameters)
+        if checkpoint.chunks:
+            logger.info(f'Resuming the {report_type} report after user {checkpoint.last_key}, '
+                        f'{len(checkpoint.chunks)} chunks were already fetched.')
+            yield from iter_stage('read_checkpoint', checkpoint.iter_chunks())
+        if checkpoint.complete:
+            return
+
+        for df_active_users_part in read_active_user_pages(postgres_session, chunksize, checkpoint.last_key):
+            df_report_chunk = merge_lessons_completed(mysql_session, df_active_users_part, start_date)
+            with stage('checkpoint', chunk=len(checkpoint.chunks), rows=len(df_report_chunk)):
+                checkpoint.save_chunk(df_report_chunk, df_active_users_part['user_id'].iloc[-1])
+            yield df_report_chunk
+        checkpoint.mark_complete()
+
+
+def get_customer_x_report_chunks(
+        postgres_session: Session,
+        mysql_session: Session,
+        fetch_strategy: str = FetchStrategy.SERIAL.value,
+        report_type: str = ValidReports.CUSTOMER_X.value
+) -> Iterator[pd.DataFrame]:
+    """
+    Returns the merged customer_x report chunks, fetched with the requested fetch strategy.
+    Every strategy produces the chunks in user_id order, which is checked as they go by.
+
+    Args:
+        postgres_session: Session: Session object for PostgreSQL DB
+        mysql_session: Session: Session object for MySQL DB
+        fetch_strategy: str: One of the FetchStrategy values
+        report_type: str: The report built from the chunks, which owns the checkpoints of the resumable strategy
+
+    Returns:
+        An iterator over the merged report chunks, in report order
+
+    """
+    return iter_in_key_order(
+        _get_customer_x_report_chunks(postgres_session, mysql_session, fetch_strategy, report_type),
+        'user_id'
+    )
+
+
+def _get_customer_x_report_chunks(
+        postgres_session: Session,
+        mysql_session: Session,
+        fetch_strategy: str,
+        report_type: str
+) -> Iterator[pd.DataFrame]:
+    if fetch_strategy == FetchStrategy.SERIAL.value:
+        chunk_sizer = AdaptiveChunkSizer.from_settings() if settings.report_adaptive_chunks else None
+        return iter_customer_x_report_chunks(postgres_session, mysql_session, settings.report_chunk_size, chunk_sizer)
+
+    if fetch_strategy == FetchStrategy.STAGED_JOIN.value:
+        return iter_customer_x_report_chunks_staged(
+            postgres_session,
+            mysql_session,
+            chunksize=settings.report_chunk_size,
+            fetch_size=settings.db_stream_fetch_size
+        )
+
+    if fetch_strategy == FetchStrategy.INCREMENTAL.value:
+        return iter_customer_x_report_chunks_incremental(
+            postgres_session,
+            mysql_session,
+            chunksize=settings.report_chunk_size,
+            late_arrival_days=settings.rollup_late_arrival_days,
+            fetch_size=settings.db_stream_fetch_size
+        )
+
+    if fetch_strategy == FetchStrategy.RESUMABLE.value:
+        return iter_customer_x_report_chunks_resumable(
+            postgres_session,
+            mysql_session,
+            settings.report_checkpoint_dir,
+            chunksize=settings.report_chunk_size,
+            report_type=report_type
+        )
+
+    if fetch_strategy == FetchStrategy.SHARDED.value:
+        # Imported here, the sharded strategy is built on the functions of this module.
+        from .customer_x_sharded import iter_customer_x_report_chunks_sharded
+        return iter_customer_x_report_chunks_sharded(
+            postgres_session,
+            mysql_session,
+            chunksize=settings.report_chunk_size,
+            report_type=report_type
+        )
+
+    if fetch_strategy == FetchStrategy.PIPELINED.value:
+        return iter_customer_x_report_chunks_pipelined(
+            postgres_session,
+            sessionmaker(bind=mysql_session.get_bind()),
+            chunksize=settings.report_chunk_size,
+            concurrency=settings.report_fetch_concurrency
+        )
+
+    raise ValueError(f'Unknown fetch strategy: {fetch_strategy}')
+
+
+def generate_customer_x_report(
+        postgres_session: Session,
+        mysql_session: Session,
+        fetch_strategy: str = FetchStrategy.SERIAL.value
+) -> pd.DataFrame:
+    """
+    This is a modified version of the generate_customer_x_report to pull and process the data in chunks
+    then concatenating the dataframes, rather than pulling and processing the data all at once.
+
+    Args:
+        postgres_session: Session: Session object for PostgreSQL DB
+        mysql_session: Session: Session object for MySQL DB
+        fetch_strategy: str: One of the FetchStrategy values, how the chunks are fetched
+
+    Returns:
+        The final dataframe with the desired data
+
+    """
+    # We save each merged chunk in a list, and concat them finally.
+    # The chunks already come in user_id order, so the concatenated report needs no sorting.
+    df_list = list(get_customer_x_report_chunks(postgres_session, mysql_session, fetch_strategy))
+    if not df_list:
+        return pd.DataFrame()
 
-    final_df = pd.concat(df_list, ignore_index=True).sort_values('user_id', kind='mergesort')
+    with stage('concat') as concat_stage:
+        if settings.report_typed_schema:
+            final_df = concat_typed_chunks(df_list)
+        else:
+            final_df = pd.concat(df_list, ignore_index=True)
+        concat_stage.rows = len(final_df)
 
     return final_df
@@ -0,0 +1,264 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.query import Query
+from sqlalchemy import and_, delete, func, insert, select, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from datetime import date, datetime, time, timedelta
+from database.models import MindUsers, LessonCompletion, LessonCompletionRollup, LessonCompletionRollupDay
+from database.streaming import read_sql_chunks
+from exceptions.report_gen_exceptions import DataFetchError
+from services.instrumentation import iter_stage, stage
+from .typed_schema import downcast_integers
+from config import settings
+import logging
+from typing import Iterator, List
+
+
+logger = logging.getLogger(__name__)
+
+# Any constant works, it only has to be the same for every run refreshing the rollup.
+ROLLUP_ADVISORY_LOCK_KEY = 7_041_203
+
+
+def get_window_days(start_date: datetime, end_date: datetime) -> List[date]:
+    """
+    Returns the days that fall in a report window, with the same semantics as comparing the DATE column
+    completion_date against the datetime bounds in SQL, i.e. a day is in when its midnight is in [start, end).
+
+    Args:
+        start_date: datetime: Start of the report window, inclusive
+        end_date: datetime: End of the report window, exclusive
+
+    Returns:
+        The days in the window, in ascending order
+
+    """
+    first_day = start_date.date() if start_date.time() == time.min else start_date.date() + timedelta(days=1)
+    last_day = end_date.date() - timedelta(days=1) if end_date.time() == time.min else end_date.date()
+    return [first_day + timedelta(days=offset) for offset in range((last_day - first_day).days + 1)]
+
+
+def get_lessons_completed_per_day_query(session: Session, days: List[date]) -> Query:
+    """
+    Returns the query counting the lessons completed by every user on each of the given days.
+
+    Args:
+        session: Session: SQLAlchemy session object
+        days: List[date]: The days to count the lessons for
+
+    Returns:
+        A query object
+
+    """
+    lessons_completed_query = (
+            session.query(
+                LessonCompletion.user_id,
+                func.count(LessonCompletion.lesson_id).label('lessons_completed'),
+                LessonCompletion.completion_date
+            )
+            .filter(LessonCompletion.completion_date.in_(days))
+            # In the order of the (completion_date, user_id) index, so the grouping needs no temporary table.
+            .group_by(LessonCompletion.completion_date, LessonCompletion.user_id)
+        )
+
+    return lessons_completed_query
+
+
+def get_rolled_up_report_query(session: Session, first_day: date, last_day: date) -> Query:
+    """
+    Returns the query building the customer_x report from the rollup: all the active users,
+    with the lessons they completed per day between first_day and last_day, ordered by user and day.
+
+    Args:
+        session: Session: SQLAlchemy session object
+        first_day: date: First day of the report window
+        last_day: date: Last day of the report window
+
+    Returns:
+        A query object
+
+    """
+    report_query = (
+        session.query(
+            MindUsers.user_id,
+            MindUsers.user_name,
+            LessonCompletionRollup.lessons_completed,
+            LessonCompletionRollup.completion_date
+        )
+        .outerjoin(
+            LessonCompletionRollup,
+            and_(
+                LessonCompletionRollup.user_id == MindUsers.user_id,
+                LessonCompletionRollup.completion_date >= first_day,
+                LessonCompletionRollup.completion_date <= last_day
+            )
+        )
+        .filter(MindUsers.active_status == 'active')
+        .order_by(MindUsers.user_id, LessonCompletionRollup.completion_date)
+    )
+
+    return report_query
+
+
+def refresh_lesson_completion_rollup(
+        postgres_session: Session,
+        mysql_session: Session,
+        window_days: List[date],
+        late_arrival_days: int = 2,
+        fetch_size: int = 1000
+) -> List[date]:
+    """
+    Brings the daily rollup up to date for the report window. Only the days of the window that were never rolled up,
+    plus the last `late_arrival_days` days of the window (to pick up late arriving completions), are counted again
+    from lesson_completion. Days that slid out of the window are pruned from the rollup.
+
+    Everything is written in one transaction, so a failed refresh leaves the rollup as it was.
+
+    Args:
+        postgres_session: Session: Session object for PostgreSQL DB, where the rollup lives
+        mysql_session: Session: Session object for MySQL DB
+        window_days: List[date]: The days in the report window, in ascending order
+        late_arrival_days: int: Number of most recent days that are always rolled up again
+        fetch_size: int: Number of rows streamed back from MySQL per round trip
+
+    Returns:
+        The days that were rolled up
+
+    """
+    if not window_days:
+        return []
+
+    try:
+        if postgres_session.get_bind().dialect.name == 'postgresql':
+            # Concurrent runs would otherwise insert the same days twice.
+            postgres_session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': ROLLUP_ADVISORY_LOCK_KEY})
+
+        rolled_up_days = set(
+            postgres_session.scalars(
+                select(LessonCompletionRollupDay.completion_date)
+                .where(LessonCompletionRollupDay.completion_date.in_(window_days))
+            )
+        )
+        recent_days = window_days[-late_arrival_days:] if late_arrival_days > 0 else []
+        days_to_roll_up = sorted(set(day for day in window_days if day not in rolled_up_days) | set(recent_days))
+        if not days_to_roll_up:
+            # Ends the transaction, which releases the lock.
+            postgres_session.commit()
+            return []
+
+        postgres_session.execute(
+            delete(LessonCompletionRollup).where(
+                (LessonCompletionRollup.completion_date < window_days[0])
+                | LessonCompletionRollup.completion_date.in_(days_to_roll_up)
+            )
+        )
+        postgres_session.execute(
+            delete(LessonCompletionRollupDay).where(
+                (LessonCompletionRollupDay.completion_date < window_days[0])
+                | LessonCompletionRollupDay.completion_date.in_(days_to_roll_up)
+            )
+        )
+
+        lessons_completed_query = get_lessons_completed_per_day_query(mysql_session, days_to_roll_up)
+        try:
+            df_lessons_completed_chunks = read_sql_chunks(
+                lessons_completed_query.statement,
+                mysql_session,
+                fetch_size,
+                fetch_size
+            )
+            for df_lessons_completed_chunk in df_lessons_completed_chunks:
+                if df_lessons_completed_chunk.empty:
+                    continue
+                postgres_session.execute(
+                    insert(LessonCompletionRollup),
+                    [
+                        {'user_id': int(user_id), 'completion_date': completion_date, 'lessons_completed': int(lessons)}
+                        for user_id, completion_date, lessons in zip(
+                            df_lessons_completed_chunk['user_id'],
+                            df_lessons_completed_chunk['completion_date'],
+                            df_lessons_completed_chunk['lessons_completed']
+                        )
+                    ]
+                )
+        except ProgrammingError as e:
+            logger.error(f'Failed to pull data from Lessons Completed DB. Details: ', exc_info=True)
+            raise DataFetchError('Failed to pull data from Lessons Completed DB.')
+
+        rolled_up_at = datetime.now()
+        postgres_session.execute(
+            insert(LessonCompletionRollupDay),
+            [{'completion_date': day, 'rolled_up_at': rolled_up_at} for day in days_to_roll_up]
+        )
+        postgres_session.commit()
+    except BaseException:
+        postgres_session.rollback()
+        raise
+
+    logger.debug(f'Rolled up lesson completions for {len(days_to_roll_up)} days: {days_to_roll_up[0]} to {days_to_roll_up[-1]}.')
+    return days_to_roll_up
+
+
+def iter_customer_x_report_chunks_incremental(
+        postgres_session: Session,
+        mysql_session: Session,
+        chunksize: int = 1000,
+        late_arrival_days: int = 2,
+        fetch_size: int = 1000
+) -> Iterator[pd.DataFrame]:
+    """
+    Incremental version of iter_customer_x_report_chunks. The lessons completed per user per day are kept in a
+    rollup table next to the users, and only the days not rolled up yet (plus a late arrival re-check window)
+    are counted from the raw lesson_completion rows. The report is then assembled by PostgreSQL from the
+    rollup in a single ordered join, so a daily run only pays for about one day of new raw data.
+
+    The chunks are slices of the ordered report, so the rows of one user can be split across two chunks.
+
+    Args:
+        postgres_session: Session: Session object for PostgreSQL DB
+        mysql_session: Session: Session object for MySQL DB
+        chunksize: int: Number of report rows per chunk
+        late_arrival_days: int: Number of most recent days that are always rolled up again
+        fetch_size: int: Number of rows streamed back from the databases per round trip
+
+    Returns:
+        An iterator over the report chunks
+
+    """
+    start_date = datetime.now() - timedelta(days=60)
+    end_date = datetime.now() - timedelta(days=1)  # Exclude today
+    window_days = get_window_days(start_date, end_date)
+
+    with stage('rollup_refresh'):
+        refresh_lesson_completion_rollup(postgres_session, mysql_session, window_days, late_arrival_days, fetch_size)
+
+    report_statement = get_rolled_up_report_query(postgres_session, window_days[0], window_days[-1]).statement
+    try:
+        if settings.db_stream_results:
+            df_report_chunks = read_sql_chunks(report_statement, postgres_session, chunksize, fetch_size)
+        else:
+            df_report_chunks = pd.read_sql(report_statement, postgres_session.connection(), chunksize=chunksize)
+    except OperationalError as e:
+        logger.error(f'Failed to connect to the MindTickle Users DB. Details :', exc_info=True)
+        raise DataFetchError('Failed to pull data from MindTickle Users DB.')
+
+    for df_report_chunk in iter_stage('fetch_report', df_report_chunks):
+        # Users without lessons come out with NULLs from the outer join, the chunked version has NaN there.
+        df_report_chunk['completion_date'] = df_report_chunk['completion_date'].where(
+            df_report_chunk['completion_date'].notna(),
+            np.nan
+        )
+        if settings.report_typed_schema:
+            # Imported here, customer_x_report imports this module.
+            from .customer_x_report import apply_customer_x_typed_schema
+            yield apply_customer_x_typed_schema(df_report_chunk)
+            continue
+        # Same as the chunked version, counts are stored as int8, unless the chunk has users without lessons.
+        if not df_report_chunk['lessons_completed'].isna().any():
+            df_report_chunk['lessons_completed'] = downcast_integers(
+                df_report_chunk['lessons_completed'],
+                'int8',
+                settings.report_integer_overflow
+            )
+        yield df_report_chunk
@@ -0,0 +1,192 @@
+import math
+import multiprocessing
+import os
+import pickle
+import tempfile
+import pandas as pd
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, sessionmaker
+from exceptions.report_gen_exceptions import DataFetchError
+from services.instrumentation import StageRecord, get_current_metrics, record_stages, stage
+from config import settings
+from .customer_x_report import get_active_user_id_range_query, merge_lessons_completed, read_active_user_pages
+from .report_types import ValidReports
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+# The settings that change the content of the chunks, handed to the worker processes as they are in the parent.
+SHARD_WORKER_SETTINGS = (
+    'report_typed_schema',
+    'report_integer_overflow',
+    'db_stream_results',
+    'db_stream_fetch_size',
+    'db_bulk_export'
+)
+
+# Sessions of the worker process, created once per process by _init_shard_worker.
+_worker_session_classes: Dict[str, sessionmaker] = {}
+
+
+def get_shard_ranges(first_user_id: int, last_user_id: int, shard_count: int) -> List[Tuple[int, int]]:
+    """
+    Splits the user_id key space into `shard_count` ranges of the same width.
+
+    Args:
+        first_user_id: int: Lowest active user_id
+        last_user_id: int: Highest active user_id
+        shard_count: int: Number of ranges
+
+    Returns:
+        The (first user_id, end user_id) of every range, the end excluded, in user_id order
+
+    """
+    end_user_id = last_user_id + 1
+    width = max(1, math.ceil((end_user_id - first_user_id) / max(1, shard_count)))
+    return [
+        (start, min(start + width, end_user_id))
+        for start in range(first_user_id, end_user_id, width)
+    ]
+
+
+def iter_customer_x_report_chunks_sharded(
+        postgres_session: Session,
+        mysql_session: Session,
+        shard_count: Optional[int] = None,
+        chunksize: int = 1000,
+        max_workers: Optional[int] = None,
+        report_type: str = ValidReports.CUSTOMER_X.value
+) -> Iterator[pd.DataFrame]:
+    """
+    Multi process version of iter_customer_x_report_chunks. The active user_id key space is split into
+    `shard_count` ranges, and the users and lessons of every range are fetched, decoded and merged by a worker
+    process, with its own engines, so the pandas side of the report runs on every core instead of one.
+    The shards are yielded in user_id order, chunk by chunk, so the report comes out the same as the serial one.
+
+    Every worker writes the chunks of its shard to a temporary file as they are merged, and this process reads them
+    back one at a time, so only a chunk is held in memory here. At most `max_workers` shards are in flight: the next
+    one is only submitted when the oldest is read, which bounds the temporary files too.
+
+    Args:
+        postgres_session: Session: Session object for PostgreSQL DB, its URL is used by the workers
+        mysql_session: Session: Session object for MySQL DB, its URL is used by the workers
+        shard_count: Optional[int]: Number of ranges. Default = report_shard_count, or the number of CPUs
+        chunksize: int: Number of active users to pull per chunk, within every shard
+        max_workers: Optional[int]: Number of worker processes, and of shards in flight. Default = report_shard_workers,
+            or the number of CPUs
+        report_type: str: Type of the report the chunks are for, the stages of the workers are recorded for it
+
+    Returns:
+        An iterator over the merged report chunks
+
+    """
+    shard_count = shard_count or settings.report_shard_count or os.cpu_count() or 1
+    try:
+        with stage('fetch_user_id_range'):
+            first_user_id, last_user_id = get_active_user_id_range_query(postgres_session).one()
+    except OperationalError as e:
+        logger.error(f'Failed to connect to the MindTickle Users DB. Details :', exc_info=True)
+        raise DataFetchError('Failed to pull data from MindTickle Users DB.')
+    if first_user_id is None:
+        return
+
+    shard_ranges = get_shard_ranges(first_user_id, last_user_id, shard_count)
+    max_workers = min(len(shard_ranges), max_workers or settings.report_shard_workers or os.cpu_count() or 1)
+    logger.info(
+        f'Fetching the {report_type} report in {len(shard_ranges)} shards of user ids {first_user_id} to {last_user_id}, '
+        f'{max_workers} at a time.'
+    )
+
+    # Spawned, not forked: the workers don't inherit the connections (and the threads) of this process.
+    executor = ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_shard_worker,
+        initargs=(
+            _get_url(postgres_session),
+            _get_url(mysql_session),
+            {name: getattr(settings, name) for name in SHARD_WORKER_SETTINGS}
+        )
+    )
+    shard_dir = tempfile.TemporaryDirectory(prefix=f'{report_type}_shards_')
+    pending_shards = deque(enumerate(shard_ranges))
+    shard_futures = deque()
+
+    def submit_next_shard():
+        shard, (first_shard_user_id, end_shard_user_id) = pending_shards.popleft()
+        shard_path = Path(shard_dir.name) / f'shard_{shard}.pickle'
+        shard_futures.append((shard, shard_path, executor.submit(
+            _fetch_customer_x_shard, first_shard_user_id, end_shard_user_id, chunksize, report_type, str(shard_path)
+        )))
+
+    try:
+        while pending_shards and len(shard_futures) < max_workers:
+            submit_next_shard()
+        while shard_futures:
+            shard, shard_path, shard_future = shard_futures.popleft()
+            with stage('fetch_shard', chunk=shard) as shard_stage:
+                shard_stage.rows, shard_stages = shard_future.result()
+            # The worker of this shard is free, it can start on the next one while this one is read.
+            if pending_shards:
+                submit_next_shard()
+            # The queries and merges of the shard, as timed by its worker.
+            report_metrics = get_current_metrics()
+            if report_metrics is not None:
+                report_metrics.add_stages(shard_stages)
+            yield from _iter_shard_file(shard_path)
+            shard_path.unlink()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        shard_dir.cleanup()
+
+
+def _get_url(session: Session) -> str:
+    return session.get_bind().url.render_as_string(hide_password=False)
+
+
+def _init_shard_worker(postgres_url: str, mysql_url: str, worker_settings: Dict):
+    for name, value in worker_settings.items():
+        setattr(settings, name, value)
+    _worker_session_classes['postgres'] = sessionmaker(bind=create_engine(postgres_url))
+    _worker_session_classes['mysql'] = sessionmaker(bind=create_engine(mysql_url))
+
+
+def _fetch_customer_x_shard(
+        first_user_id: int,
+        end_user_id: int,
+        chunksize: int,
+        report_type: str,
+        shard_path: str
+) -> Tuple[int, List[StageRecord]]:
+    """
+    Fetches and merges the report chunks of the active users in [first_user_id, end_user_id), in a worker process.
+    The chunks are pickled one after the other to `shard_path`, as they are merged, so their dtypes come back as they are.
+    Returns the number of rows, and the stages recorded while fetching them.
+    """
+    start_date = datetime.now() - timedelta(days=60)
+    shard_rows = 0
+    with record_stages(report_type) as shard_metrics, \
+            _worker_session_classes['postgres']() as postgres_session, \
+            _worker_session_classes['mysql']() as mysql_session, \
+            open(shard_path, 'wb') as shard_file:
+        for df_active_users_part in read_active_user_pages(postgres_session, chunksize, first_user_id - 1, end_user_id):
+            shard_chunk = merge_lessons_completed(mysql_session, df_active_users_part, start_date)
+            pickle.dump(shard_chunk, shard_file, protocol=pickle.HIGHEST_PROTOCOL)
+            shard_rows += len(shard_chunk)
+    return shard_rows, shard_metrics.stages
+
+
+def _iter_shard_file(shard_path: Path) -> Iterator[pd.DataFrame]:
+    with open(shard_path, 'rb') as shard_file:
+        while True:
+            try:
+                yield pickle.load(shard_file)
+            except EOFError:
+                return
@@ -0,0 +1,279 @@
+"""
+Delta reports: instead of the whole report, only the rows added, removed or changed since a full report of the
+same type and format (its base) are uploaded, with a `change` column telling which. Consecutive customer_x reports
+share almost all their rows, the 60 day window only slides by a day, so the delta is a small fraction of the report.
+The base of every delta is recorded in reports_generated.base_report_id, and a full snapshot is rebuilt on demand:
+
+    python -m report.delta <report_id> <output path>
+"""
+from typing import Dict, Iterator, Optional, Sequence
+from uuid import UUID
+import argparse
+import logging
+
+import boto3
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from database.models import ReportsGenerated
+from exceptions.report_gen_exceptions import DownloadFailure
+from services.aws_s3 import download, get_content_hash
+from services.instrumentation import iter_stage, stage
+from .output_formats import CSV_COMPRESSIONS, encode_report, iter_encoded_parts, read_csv_report
+from .report_types import DeltaChange, ReportFormat, ValidReports
+
+
+logger = logging.getLogger(__name__)
+
+# The columns identifying a row of every report that can be generated as a delta, the integer id
+# the report is ordered by first. The customer_x_daily columns are the days, they all shift every day.
+DELTA_REPORT_KEYS = {
+    ValidReports.CUSTOMER_X.value: ('user_id', 'completion_date'),
+}
+
+DELTA_CHANGE_COLUMN = 'change'
+
+
+def supports_delta(report_type: str, report_format: str) -> bool:
+    """
+    Only the reports with a row key, in the CSV formats, can be generated as deltas.
+    The CSV reports are compared as text, so the rebuilt snapshots are byte for byte the full reports.
+    """
+    return report_type in DELTA_REPORT_KEYS and report_format in CSV_COMPRESSIONS
+
+
+def get_report_object_key(report_type: str, report_date: str, object_name: str, report_format: str) -> str:
+    # object_name is the report_id of a streamed report, or the content hash of a report built in memory.
+    return f'{report_type}_report/{report_date}/{object_name}.{report_format}'
+
+
+def get_content_object_key(report_type: str, report_date: str, report_data: bytes, report_format: str) -> str:
+    """
+    A report built in memory is stored under the hash of its content. Generated again the same day with the
+    same content, it finds its object already there (see s3_skip_unchanged_uploads), and with other content it
+    gets an object of its own: a full report never replaces the base of a delta.
+    """
+    return get_report_object_key(report_type, report_date, get_content_hash(report_data), report_format)
+
+
+def get_delta_object_key(report_type: str, report_date: str, report_id: str, report_format: str) -> str:
+    return f'{report_type}_report/{report_date}/{report_id}.delta.{report_format}'
+
+
+def compute_report_delta(base_report: pd.DataFrame, report: pd.DataFrame, key_columns: Sequence[str]) -> pd.DataFrame:
+    """
+    Compares a report with its base, row by row on the key columns, all at once over the whole reports.
+
+    Args:
+        base_report: pd.DataFrame: The base report, as read by read_csv_report
+        report: pd.DataFrame: The new report, with the same columns
+        key_columns: Sequence[str]: The columns identifying a row
+
+    Returns:
+        The rows of the report added or changed since the base, and the rows of the base removed from it, in
+        report order, with a `change` column. The removed rows keep their values from the base.
+
+    """
+    if list(base_report.columns) != list(report.columns):
+        raise ValueError('The report and its base have different columns.')
+    key_columns = list(key_columns)
+    value_columns = [column for column in report.columns if column not in key_columns]
+
+    merged = pd.merge(
+        base_report,
+        report,
+        on=key_columns,
+        how='outer',
+        suffixes=('_base', ''),
+        indicator=True,
+        validate='one_to_one'
+    )
+    base_values = merged[[f'{column}_base' for column in value_columns]].to_numpy()
+    values = merged[value_columns].to_numpy()
+    added = (merged['_merge'] == 'right_only').to_numpy()
+    removed = (merged['_merge'] == 'left_only').to_numpy()
+    changed = (merged['_merge'] == 'both').to_numpy() & (base_values != values).any(axis=1)
+    in_delta = added | removed | changed
+
+    values[removed] = base_values[removed]
+    delta_report = merged.loc[in_delta, key_columns].reset_index(drop=True)
+    delta_report[value_columns] = values[in_delta]
+    delta_report = delta_report[list(report.columns)]
+    delta_report[DELTA_CHANGE_COLUMN] = np.select(
+        [added[in_delta], removed[in_delta]],
+        [DeltaChange.ADDED.value, DeltaChange.REMOVED.value],
+        DeltaChange.CHANGED.value
+    )
+    return _in_report_order(delta_report, key_columns)
+
+
+def apply_report_delta(base_report: pd.DataFrame, delta_report: pd.DataFrame, key_columns: Sequence[str]) -> pd.DataFrame:
+    """
+    Rebuilds a full report from its base and its delta, the reverse of compute_report_delta.
+
+    Args:
+        base_report: pd.DataFrame: The base report, as read by read_csv_report
+        delta_report: pd.DataFrame: The delta report, as read by read_csv_report
+        key_columns: Sequence[str]: The columns identifying a row
+
+    Returns:
+        The full report, in report order
+
+    """
+    key_columns = list(key_columns)
+    replaced = pd.MultiIndex.from_frame(base_report[key_columns]).isin(
+        pd.MultiIndex.from_frame(delta_report[key_columns])
+    )
+    upserted = delta_report.loc[delta_report[DELTA_CHANGE_COLUMN] != DeltaChange.REMOVED.value, list(base_report.columns)]
+    return _in_report_order(pd.concat([base_report[~replaced], upserted], ignore_index=True), key_columns)
+
+
+def read_delta_base(base_details: Optional[ReportsGenerated], s3_client: Optional[boto3.client] = None) -> Optional[pd.DataFrame]:
+    """
+    Downloads the base of a delta report.
+
+    Args:
+        base_details: Optional[ReportsGenerated]: The base report found by find_delta_base, if any.
+        s3_client: Optional[boto3.client]: An existing S3 client to reuse.
+
+    Returns:
+        The base report, as read by read_csv_report, or None if there is none to use.
+
+    """
+    if base_details is None:
+        logger.info('No recent enough full report to generate a delta against, uploading the report in full.')
+        return None
+    try:
+        base_data = download(base_details.s3_bucket, base_details.s3_object_key, s3_client)
+    except DownloadFailure:
+        logger.warning(f'Base report {base_details.report_id} is missing from S3, uploading the report in full.')
+        return None
+    return read_csv_report(base_data, base_details.report_format)
+
+
+def read_delta_report_chunks(report_chunks: Iterator[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Builds the whole report to compare with its base, from its chunks. It is read back from its CSV text,
+    like the base, so the dtypes of the fetched chunks don't matter.
+
+    Args:
+        report_chunks: Iterator[pd.DataFrame]: The chunks of the report
+
+    Returns:
+        The whole report, as read by read_csv_report
+
+    """
+    report_parts = iter_stage('encode', iter_encoded_parts(report_chunks, ReportFormat.CSV.value))
+    with stage('build') as build_stage:
+        report = read_csv_report(b''.join(report_parts), ReportFormat.CSV.value)
+        build_stage.rows = len(report)
+    return report
+
+
+def encode_delta_report(
+        report: pd.DataFrame,
+        base_details: Optional[ReportsGenerated],
+        base_report: Optional[pd.DataFrame],
+        report_details: Dict
+) -> bytes:
+    """
+    Encodes the rows of a report that differ from its base. Without a base to compare with (or when the columns
+    changed since), the full report is encoded instead, and becomes the next base. The base report, and the
+    object key of what is encoded, are set in the report details.
+
+    Args:
+        report: pd.DataFrame: The whole report, as read by read_csv_report
+        base_details: Optional[ReportsGenerated]: The base report found by find_delta_base, if any
+        base_report: Optional[pd.DataFrame]: The base report, as read by read_delta_base
+        report_details: Dict: The details of the report, with its type, format, date and report_id
+
+    Returns:
+        The encoded delta report, or full report
+
+    """
+    report_type, report_format = report_details['report_type'], report_details['report_format']
+    if base_report is not None and list(base_report.columns) != list(report.columns):
+        logger.warning(f'The columns of the {report_type} report changed since report {base_details.report_id}, uploading it in full.')
+        base_report = None
+
+    if base_report is None:
+        report_data = encode_report(report, report_format)
+        report_details['s3_object_key'] = get_content_object_key(
+            report_type,
+            report_details['report_date'],
+            report_data,
+            report_format
+        )
+        return report_data
+
+    with stage('delta') as delta_stage:
+        delta_report = compute_report_delta(base_report, report, DELTA_REPORT_KEYS[report_type])
+        delta_stage.rows = len(delta_report)
+    logger.info(f'The delta from report {base_details.report_id} has {len(delta_report)} of {len(report)} rows.')
+    report_details['base_report_id'] = str(base_details.report_id)
+    report_details['s3_object_key'] = get_delta_object_key(
+        report_type,
+        report_details['report_date'],
+        report_details['report_id'],
+        report_format
+    )
+    return encode_report(delta_report, report_format)
+
+
+def reconstruct_report(session: Session, report_id: str, s3_client: Optional[boto3.client] = None) -> bytes:
+    """
+    Returns the full report of any generated report: a full report as it was uploaded, and a delta report
+    applied to its base.
+
+    Args:
+        session: Session: A SqlAlchemy session object for the PostgreSQL DB.
+        report_id: str: The report_id of the report.
+        s3_client: Optional[boto3.client]: An existing S3 client to reuse.
+
+    Returns:
+        The full report, encoded in the format of the report.
+
+    """
+    report_details = session.get(ReportsGenerated, UUID(str(report_id)))
+    if report_details is None:
+        raise ValueError(f'Unknown report: {report_id}')
+    report_data = download(report_details.s3_bucket, report_details.s3_object_key, s3_client)
+    if report_details.base_report_id is None:
+        return report_data
+
+    base_details = session.get(ReportsGenerated, report_details.base_report_id)
+    base_data = download(base_details.s3_bucket, base_details.s3_object_key, s3_client)
+    logger.info(f'Rebuilding report {report_id} from its base report {base_details.report_id}.')
+    report = apply_report_delta(
+        read_csv_report(base_data, base_details.report_format),
+        read_csv_report(report_data, report_details.report_format),
+        DELTA_REPORT_KEYS[report_details.report_type]
+    )
+    return encode_report(report, report_details.report_format)
+
+
+def _in_report_order(report: pd.DataFrame, key_columns: Sequence[str]) -> pd.DataFrame:
+    # The ids are text, ordered as integers, so user 10 comes after user 9 like in the full reports.
+    return report.sort_values(
+        list(key_columns),
+        key=lambda column: column.astype('int64') if column.name == key_columns[0] else column,
+        kind='stable'
+    ).reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write the full report of a generated report, rebuilding delta reports.')
+    parser.add_argument('report_id')
+    parser.add_argument('output_path')
+    args = parser.parse_args()
+
+    from database.connections import get_postgres_session_class
+    with get_postgres_session_class()() as postgres_session:
+        report_data = reconstruct_report(postgres_session, args.report_id)
+    with open(args.output_path, 'wb') as output_file:
+        output_file.write(report_data)
+
+
+if __name__ == '__main__':
+    main()
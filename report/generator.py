@@ -0,0 +1,398 @@
+from database.connections import get_postgres_session_class, get_mysql_session_class
+from database.models import ReportsGenerated
+from .checkpoints import clear_report_checkpoints
+from .customer_x_daily import get_customer_x_daily_report_chunks, get_customer_x_daily_arrow_schema
+from .customer_x_report import get_customer_x_report_chunks, get_customer_x_arrow_schema
+from .delta import encode_delta_report, get_content_object_key, read_delta_base, read_delta_report_chunks
+from .output_formats import get_content_headers, iter_encoded_parts
+from .report_details import (
+    add_report_metrics,
+    check_delta,
+    get_existing_report_link,
+    get_reuse_parameters,
+    new_report_details
+)
+from .report_types import ValidReports, FetchStrategy, ReportFormat
+from services.aws_s3 import save, save_stream
+from services.report_history import find_delta_base, find_existing_report
+from services.save_report_details import save_to_db
+from services.instrumentation import iter_stage, record_report, stage
+from config import settings
+from exceptions.report_gen_exceptions import DataFetchError
+from sqlalchemy.orm import Session
+from datetime import date
+from itertools import chain
+from typing import Dict, Iterator, List, Optional, Tuple
+import boto3
+import logging
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+
+def generate_report(
+        report_type: str,
+        stream: bool = False,
+        fetch_strategy: str = FetchStrategy.SERIAL.value,
+        report_format: str = ReportFormat.CSV.value,
+        force_refresh: bool = False,
+        s3_client: Optional[boto3.client] = None,
+        pending_report_details: Optional[List[Dict]] = None,
+        delta: bool = False
+) -> str:
+
+    """
+    The generate_report function is responsible for generating a variety of reports.
+    Current functionality includes the following report types:
+    - customer_x
+
+    With `stream` set, every chunk of the report is serialised and uploaded to S3 as soon as it is fetched,
+    so the whole report never has to be held in memory and the upload overlaps with the fetching.
+
+    If the same report, with the same format, was already generated today, it is not generated again.
+    A fresh download link for the existing report is returned instead, unless `force_refresh` is set.
+
+    With `delta` set, only the rows that differ from the latest full report of the same type and format are uploaded,
+    see report.delta. Without a recent enough full report to compare with, a full report is generated instead.
+
+    The duration, rows, bytes and memory of every stage are recorded, logged, and saved with the report details.
+
+    Args:
+        report_type: str: Determine which report to generate
+        stream: bool: Stream the report to S3 chunk by chunk, instead of building it in memory first.
+        fetch_strategy: str: How the report data is pulled from the databases. One of the FetchStrategy values.
+        report_format: str: Format of the uploaded report. One of the ReportFormat values.
+        force_refresh: bool: Generate the report again, even if it was already generated today.
+        s3_client: Optional[boto3.client]: An existing S3 client to reuse, e.g. when generating several reports.
+        pending_report_details: Optional[List[Dict]]: When passed, the details of the report are appended to it
+            instead of being saved, so a batch can save the details of all its reports in one transaction.
+            The checkpoints of a resumable report are then left for the batch to clear, once they are saved.
+        delta: bool: Upload only the rows changed since the last full report. Delta reports are always built in memory.
+
+    Returns:
+        A Download Link for the Report.
+
+    """
+    with record_report(report_type, settings.metrics_sample_interval, settings.metrics_textfile_dir) as report_metrics:
+        delta = check_delta(report_type, report_format, delta)
+        report_parameters = get_reuse_parameters(report_type, report_format, delta)
+        if not force_refresh:
+            with stage('reuse_lookup'):
+                download_link = _get_existing_report_link(report_type, report_parameters, s3_client)
+            if download_link is not None:
+                report_metrics.outcome = 'reused'
+                return download_link
+
+        metadata = new_report_details(report_type, report_format, report_parameters)
+        s3_bucket_name, s3_object_key = metadata['s3_bucket'], metadata['s3_object_key']
+
+        if delta:
+            download_link = _build_and_upload_delta_report(
+                report_type,
+                fetch_strategy,
+                report_format,
+                s3_bucket_name,
+                metadata,
+                s3_client
+            )
+        elif stream:
+            download_link = _stream_report(
+                report_type,
+                fetch_strategy,
+                report_format,
+                s3_bucket_name,
+                s3_object_key,
+                metadata,
+                s3_client
+            )
+        else:
+            download_link = _build_and_upload_report(
+                report_type,
+                fetch_strategy,
+                report_format,
+                s3_bucket_name,
+                metadata,
+                s3_client
+            )
+
+        add_report_metrics(metadata, report_metrics)
+        if pending_report_details is not None:
+            pending_report_details.append({**metadata, 'download_link': download_link})
+        else:
+            with stage('save_to_db'):
+                PostgresSession = get_postgres_session_class()
+                postgres_session = PostgresSession()
+                saved = save_to_db(postgres_session, metadata, download_link)
+
+            if fetch_strategy == FetchStrategy.RESUMABLE.value:
+                # The report is saved, a rerun won't need to resume it anymore.
+                clear_report_checkpoints(settings.report_checkpoint_dir, report_type)
+
+    return download_link
+
+
+def _get_existing_report_link(
+        report_type: str,
+        report_parameters: str,
+        s3_client: Optional[boto3.client] = None
+) -> Optional[str]:
+    """
+    Looks for the same report generated earlier today, and re-signs a download link for it.
+
+    Args:
+        report_type: str: Determine which report to look for
+        report_parameters: str: The options of the report, as built by get_reuse_parameters.
+        s3_client: Optional[boto3.client]: An existing S3 client to reuse.
+
+    Returns:
+        A fresh Download Link for the existing Report, or None if it has to be generated.
+
+    """
+    PostgresSession = get_postgres_session_class()
+    with PostgresSession() as postgres_session:
+        existing_report = find_existing_report(postgres_session, report_type, date.today(), report_parameters)
+    return get_existing_report_link(existing_report, s3_client)
+
+
+def _get_report_chunks(
+        report_type: str,
+        fetch_strategy: str,
+        report_format: str,
+        postgres_session: Session,
+        mysql_session: Session
+) -> Tuple[Iterator[pd.DataFrame], Optional['pyarrow.Schema']]:
+    """
+    Returns the chunks of a report, in report order, and its Arrow schema for the Parquet format.
+
+    Args:
+        report_type: str: Determine which report to generate
+        fetch_strategy: str: How the report data is pulled from the databases.
+        report_format: str: Format of the uploaded report.
+        postgres_session: Session: Session object for PostgreSQL DB
+        mysql_session: Session: Session object for MySQL DB
+
+    Returns:
+        An iterator over the report chunks, and the Arrow schema (None for the other formats).
+
+    """
+    report_chunks = iter([])
+    arrow_schema = None
+
+    # This function will simply call different get_x_report_chunks methods based on the argument that was passed.
+    # Rest of the report generation will be the same.
+    if report_type == ValidReports.CUSTOMER_X.value:
+        report_chunks = get_customer_x_report_chunks(postgres_session, mysql_session, fetch_strategy)
+        if report_format == ReportFormat.PARQUET.value:
+            arrow_schema = get_customer_x_arrow_schema()
+    elif report_type == ValidReports.CUSTOMER_X_DAILY.value:
+        report_chunks = get_customer_x_daily_report_chunks(postgres_session, mysql_session, fetch_strategy)
+        if report_format == ReportFormat.PARQUET.value:
+            arrow_schema = get_customer_x_daily_arrow_schema()
+
+    return report_chunks, arrow_schema
+
+
+def _build_and_upload_report(
+        report_type: str,
+        fetch_strategy: str,
+        report_format: str,
+        s3_bucket_name: str,
+        metadata: Dict,
+        s3_client: Optional[boto3.client] = None
+) -> str:
+    """
+    Builds the whole encoded report, and uploads it to S3 in one go, under the hash of its content.
+    The chunks come out of the fetch strategies in report order, so every chunk is encoded as soon as it is fetched:
+    only the encoded report and a few chunks are ever held in memory, never the whole report as a dataframe.
+
+    Args:
+        report_type: str: Determine which report to generate
+        fetch_strategy: str: How the report data is pulled from the databases.
+        report_format: str: Format of the uploaded report.
+        s3_bucket_name: str: S3 Bucket name where the report will be uploaded.
+        metadata: Dict: Metadata for the s3 object, and the report details. The object key is set in it.
+        s3_client: Optional[boto3.client]: An existing S3 client to reuse.
+
+    Returns:
+        A Download Link for the Report.
+
+    """
+    PostgresSession, MysqlSession = get_postgres_session_class(), get_mysql_session_class()
+    with PostgresSession() as postgres_session, MysqlSession() as mysql_session:
+        report_chunks, arrow_schema = _get_report_chunks(
+            report_type,
+            fetch_strategy,
+            report_format,
+            postgres_session,
+            mysql_session
+        )
+
+        first_chunk = next(report_chunks, None)
+        if first_chunk is None or first_chunk.empty:
+            logger.exception('Failed to Pull the data.')
+            raise DataFetchError('Failed to Pull data to build the report!')
+
+        # The chunks are fetched while they are encoded, so the build stage includes the fetching.
+        report_parts = iter_stage(
+            'encode',
+            iter_encoded_parts(chain([first_chunk], report_chunks), report_format, arrow_schema)
+        )
+        with stage('build') as build_stage:
+            report_data = b''.join(report_parts)
+            build_stage.bytes = len(report_data)
+
+    metadata['s3_object_key'] = get_content_object_key(report_type, metadata['report_date'], report_data, report_format)
+    with stage('upload') as upload_stage:
+        upload_stage.bytes = len(report_data)
+        return save(
+            report_data,
+            s3_bucket_name,
+            metadata['s3_object_key'],
+            metadata,
+            get_content_headers(report_format),
+            s3_client
+        )
+
+
+def _stream_report(
+        report_type: str,
+        fetch_strategy: str,
+        report_format: str,
+        s3_bucket_name: str,
+        s3_object_key: str,
+        metadata: Dict,
+        s3_client: Optional[boto3.client] = None
+) -> str:
+    """
+    Fetches the report chunk by chunk and streams it to S3 while it is being fetched.
+
+    Args:
+        report_type: str: Determine which report to generate
+        fetch_strategy: str: How the report data is pulled from the databases.
+        report_format: str: Format of the uploaded report.
+        s3_bucket_name: str: S3 Bucket name where the report will be uploaded.
+        s3_object_key: str: File name for the report.
+        metadata: Dict: Metadata for the s3 object.
+        s3_client: Optional[boto3.client]: An existing S3 client to reuse.
+
+    Returns:
+        A Download Link for the Report.
+
+    """
+    PostgresSession, MysqlSession = get_postgres_session_class(), get_mysql_session_class()
+    with PostgresSession() as postgres_session, MysqlSession() as mysql_session:
+        report_chunks, arrow_schema = _get_report_chunks(
+            report_type,
+            fetch_strategy,
+            report_format,
+            postgres_session,
+            mysql_session
+        )
+
+        # Pull the first chunk before starting the upload, so an empty report never reaches S3.
+        first_chunk = next(report_chunks, None)
+        if first_chunk is None or first_chunk.empty:
+            logger.exception('Failed to Pull the data.')
+            raise DataFetchError('Failed to Pull data to build the report!')
+
+        # The chunks are fetched and encoded while they are uploaded, so the upload stage includes the others.
+        report_parts = iter_stage(
+            'encode',
+            iter_encoded_parts(chain([first_chunk], report_chunks), report_format, arrow_schema)
+        )
+        with stage('upload'):
+            download_link = save_stream(
+                report_parts,
+                s3_bucket_name,
+                s3_object_key,
+                metadata,
+                get_content_headers(report_format),
+                s3_client
+            )
+
+    return download_link
+
+
+def _build_and_upload_delta_report(
+        report_type: str,
+        fetch_strategy: str,
+        report_format: str,
+        s3_bucket_name: str,
+        metadata: Dict,
+        s3_client: Optional[boto3.client] = None
+) -> str:
+    """
+    Builds the whole report, compares it with the latest full report of the same type and format, and uploads
+    only the rows that differ, next to the full reports. The base report is recorded in the metadata.
+    Without a base report to compare with, the full report is uploaded instead, and becomes the next base.
+
+    Args:
+        report_type: str: Determine which report to generate
+        fetch_strategy: str: How the report data is pulled from the databases.
+        report_format: str: Format of the uploaded report, one of the CSV formats.
+        s3_bucket_name: str: S3 Bucket name where the report will be uploaded.
+        metadata: Dict: Metadata for the s3 object, and the report details.
+        s3_client: Optional[boto3.client]: An existing S3 client to reuse.
+
+    Returns:
+        A Download Link for the Report.
+
+    """
+    # The base is downloaded first, so a missing base doesn't cost anything more than a full report.
+    with stage('download_base') as download_stage:
+        base_details, base_report = _load_delta_base(report_type, report_format, s3_client)
+        if base_report is not None:
+            download_stage.rows = len(base_report)
+
+    PostgresSession, MysqlSession = get_postgres_session_class(), get_mysql_session_class()
+    with PostgresSession() as postgres_session, MysqlSession() as mysql_session:
+        report_chunks, _ = _get_report_chunks(report_type, fetch_strategy, report_format, postgres_session, mysql_session)
+        first_chunk = next(report_chunks, None)
+        if first_chunk is None or first_chunk.empty:
+            logger.exception('Failed to Pull the data.')
+            raise DataFetchError('Failed to Pull data to build the report!')
+
+        report = read_delta_report_chunks(chain([first_chunk], report_chunks))
+
+    report_data = encode_delta_report(report, base_details, base_report, metadata)
+
+    with stage('upload') as upload_stage:
+        upload_stage.bytes = len(report_data)
+        return save(
+            report_data,
+            s3_bucket_name,
+            metadata['s3_object_key'],
+            metadata,
+            get_content_headers(report_format),
+            s3_client
+        )
+
+
+def _load_delta_base(
+        report_type: str,
+        report_format: str,
+        s3_client: Optional[boto3.client] = None
+) -> Tuple[Optional[ReportsGenerated], Optional[pd.DataFrame]]:
+    """
+    Looks up the base of a delta report, and downloads it.
+
+    Args:
+        report_type: str: Type of the delta report, one of the ValidReports values.
+        report_format: str: Format of the delta report, one of the CSV formats.
+        s3_client: Optional[boto3.client]: An existing S3 client to reuse.
+
+    Returns:
+        The details of the base report and the base report, each None if there is none to use.
+
+    """
+    PostgresSession = get_postgres_session_class()
+    with PostgresSession() as postgres_session:
+        base_details = find_delta_base(
+            postgres_session,
+            report_type,
+            report_format,
+            date.today(),
+            settings.report_delta_max_base_age_days
+        )
+    return base_details, read_delta_base(base_details, s3_client)
@@ -0,0 +1,345 @@
+"""
+Runs EXPLAIN on the SQL generated by a report against the configured databases, and flags the plans that
+won't hold up at production table sizes: full table scans, and sorts (filesorts) or temporary tables for the
+GROUP BY / ORDER BY instead of reading an index in order. For every table of the report queries it also checks
+that the indexes declared on the models exist, and points at the migration creating the missing ones.
+
+    python -m report.index_advisor customer_x
+    python -m report.index_advisor customer_x --assume-large-tables --fail-on-issues
+
+On small tables (like the sample data of setup/) PostgreSQL rightly prefers a sequential scan, even with
+the index in place. --assume-large-tables discourages those, to see the plan the index would give.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import argparse
+import json
+import re
+import sys
+
+from sqlalchemy import Column, Index, Integer, MetaData, Table, inspect
+from sqlalchemy.engine import Connection, Dialect
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.util import find_tables
+
+from database.migrate import MIGRATIONS_DIR
+from .customer_x_report import (
+    get_active_users_fingerprint_query,
+    get_active_users_query,
+    get_lessons_completed_query,
+    get_staged_lessons_completed_query
+)
+from .customer_x_rollup import get_lessons_completed_per_day_query, get_rolled_up_report_query, get_window_days
+from .report_types import ValidReports
+
+
+FULL_SCAN = 'full_scan'
+FILESORT = 'filesort'
+TEMPORARY = 'temporary'
+
+
+@dataclass(frozen=True)
+class ReportQuery:
+    """
+    One of the queries a report runs. The temporary tables are created before the query is explained,
+    and their own (expected) full scans are not flagged.
+    """
+    name: str
+    database: str
+    statement: Select
+    temporary_tables: Tuple[Table, ...] = ()
+
+
+@dataclass(frozen=True)
+class PlanIssue:
+    kind: str
+    table: Optional[str]
+    detail: str
+
+
+@dataclass
+class QueryAdvice:
+    query: ReportQuery
+    plan: Any
+    issues: List[PlanIssue] = field(default_factory=list)
+    # The missing indexes, with the DDL creating them and the migration that ships it.
+    missing_indexes: List[Tuple[Index, str, Optional[Path]]] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.issues and not self.missing_indexes
+
+
+def get_customer_x_report_queries(
+        postgres_session: Session,
+        mysql_session: Session,
+        chunksize: int = 1000
+) -> List[ReportQuery]:
+    """
+    Returns the queries of every fetch strategy of the customer_x report, with a representative chunk of user ids.
+
+    Args:
+        postgres_session: Session: Session object for PostgreSQL DB
+        mysql_session: Session: Session object for MySQL DB
+        chunksize: int: Number of user ids in the `user_id IN (...)` of the lessons query
+
+    Returns:
+        The queries to explain
+    """
+    start_date = datetime.now() - timedelta(days=60)
+    window_days = get_window_days(start_date, datetime.now() - timedelta(days=1))
+    staged_users = Table(
+        'report_active_users_explain',
+        MetaData(),
+        Column('user_id', Integer, primary_key=True, autoincrement=False),
+        prefixes=['TEMPORARY']
+    )
+
+    return [
+        ReportQuery('active_users', 'postgres', get_active_users_query(postgres_session).statement),
+        ReportQuery('active_users_fingerprint', 'postgres', get_active_users_fingerprint_query(postgres_session).statement),
+        ReportQuery(
+            'lessons_completed',
+            'mysql',
+            get_lessons_completed_query(mysql_session, list(range(1, chunksize + 1)), start_date).statement
+        ),
+        ReportQuery(
+            'staged_lessons_completed',
+            'mysql',
+            get_staged_lessons_completed_query(mysql_session, staged_users, start_date).statement,
+            temporary_tables=(staged_users,)
+        ),
+        ReportQuery(
+            'lessons_completed_per_day',
+            'mysql',
+            get_lessons_completed_per_day_query(mysql_session, window_days).statement
+        ),
+        ReportQuery(
+            'rolled_up_report',
+            'postgres',
+            get_rolled_up_report_query(postgres_session, window_days[0], window_days[-1]).statement
+        ),
+    ]
+
+
+REPORT_QUERIES: Dict[str, Callable[[Session, Session], List[ReportQuery]]] = {
+    ValidReports.CUSTOMER_X.value: get_customer_x_report_queries,
+    # Built from the same queries as customer_x.
+    ValidReports.CUSTOMER_X_DAILY.value: get_customer_x_report_queries,
+}
+
+
+def explain(connection: Connection, statement: Select) -> Any:
+    """
+    Returns the plan of a query: the json plan on PostgreSQL, the EXPLAIN rows on MySQL,
+    and the EXPLAIN QUERY PLAN rows on SQLite.
+
+    Args:
+        connection: Connection: Connection to the database the query runs on
+        statement: Select: The query
+
+    Returns:
+        The plan, as returned by the database
+    """
+    sql, parameters = _compile_for_driver(statement, connection.dialect)
+    dialect_name = connection.dialect.name
+    if dialect_name == 'postgresql':
+        plan = connection.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {sql}', parameters).scalar()
+        return json.loads(plan) if isinstance(plan, str) else plan
+    if dialect_name == 'sqlite':
+        return [dict(row) for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}', parameters).mappings()]
+    return [dict(row) for row in connection.exec_driver_sql(f'EXPLAIN {sql}', parameters).mappings()]
+
+
+def find_plan_issues(dialect_name: str, plan: Any, ignored_tables: Tuple[str, ...] = ()) -> List[PlanIssue]:
+    """
+    Finds the full scans, sorts and temporary tables in a plan returned by `explain`.
+
+    Args:
+        dialect_name: str: Name of the SQLAlchemy dialect of the database: postgresql, mysql or sqlite
+        plan: Any: The plan
+        ignored_tables: Tuple[str, ...]: Tables whose full scans are expected, like the staged users
+
+    Returns:
+        The issues, in plan order
+    """
+    if dialect_name == 'postgresql':
+        issues = _find_postgres_plan_issues(plan[0]['Plan'])
+    elif dialect_name == 'mysql':
+        issues = _find_mysql_plan_issues(plan)
+    elif dialect_name == 'sqlite':
+        issues = _find_sqlite_plan_issues(plan)
+    else:
+        raise ValueError(f'Unsupported database: {dialect_name}')
+
+    return [issue for issue in issues if not (issue.kind == FULL_SCAN and issue.table in ignored_tables)]
+
+
+def _find_postgres_plan_issues(node: Dict) -> List[PlanIssue]:
+    issues = []
+    if node['Node Type'] == 'Seq Scan':
+        condition = f" (filter: {node['Filter']})" if 'Filter' in node else ''
+        issues.append(PlanIssue(FULL_SCAN, node.get('Relation Name'), f"Seq Scan on {node.get('Relation Name')}{condition}"))
+    elif node['Node Type'] == 'Sort':
+        issues.append(PlanIssue(FILESORT, None, f"Sort on {', '.join(node.get('Sort Key', []))}"))
+    for child in node.get('Plans', []):
+        issues.extend(_find_postgres_plan_issues(child))
+    return issues
+
+
+def _find_mysql_plan_issues(rows: List[Dict]) -> List[PlanIssue]:
+    issues = []
+    for row in rows:
+        extra = row.get('Extra') or ''
+        if row.get('type') == 'ALL':
+            issues.append(PlanIssue(FULL_SCAN, row.get('table'), f"Full scan of {row.get('table')} (~{row.get('rows')} rows)"))
+        if 'Using filesort' in extra:
+            issues.append(PlanIssue(FILESORT, row.get('table'), f"Filesort on {row.get('table')}: {extra}"))
+        if 'Using temporary' in extra:
+            issues.append(PlanIssue(TEMPORARY, row.get('table'), f"Temporary table on {row.get('table')}: {extra}"))
+    return issues
+
+
+_SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(.*)$')
+_SQLITE_TEMP_B_TREE = re.compile(r'^USE TEMP B-TREE FOR (.+)$')
+
+
+def _find_sqlite_plan_issues(rows: List[Dict]) -> List[PlanIssue]:
+    issues = []
+    for row in rows:
+        detail = row['detail']
+        scan = _SQLITE_SCAN.match(detail)
+        if scan and 'INDEX' not in scan.group(2):
+            issues.append(PlanIssue(FULL_SCAN, scan.group(1), detail))
+        temp_b_tree = _SQLITE_TEMP_B_TREE.match(detail)
+        if temp_b_tree:
+            kind = FILESORT if 'ORDER BY' in temp_b_tree.group(1) else TEMPORARY
+            issues.append(PlanIssue(kind, None, detail))
+    return issues
+
+
+def find_missing_indexes(connection: Connection, report_query: ReportQuery) -> List[Tuple[Index, str, Optional[Path]]]:
+    """
+    Returns the indexes declared on the models of the tables a query reads, that don't exist in the database.
+
+    Args:
+        connection: Connection: Connection to the database the query runs on
+        report_query: ReportQuery: The query
+
+    Returns:
+        Every missing index, with the DDL creating it and the migration that ships it (None if there is none)
+    """
+    inspector = inspect(connection)
+    temporary_tables = set(report_query.temporary_tables)
+    missing_indexes = []
+    for table in find_tables(report_query.statement, include_joins=True):
+        if table in temporary_tables or not table.indexes:
+            continue
+        existing_index_names = set(index['name'] for index in inspector.get_indexes(table.name))
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing_index_names:
+                ddl = str(CreateIndex(index).compile(dialect=connection.dialect)).strip()
+                missing_indexes.append((index, ddl, _find_migration(report_query.database, index.name)))
+    return missing_indexes
+
+
+def _find_migration(database: str, index_name: str) -> Optional[Path]:
+    for path in sorted((MIGRATIONS_DIR / database).glob('*.sql')):
+        if index_name in path.read_text():
+            return path
+    return None
+
+
+def advise_report_indexes(
+        report_type: str,
+        postgres_session: Session,
+        mysql_session: Session,
+        assume_large_tables: bool = False
+) -> List[QueryAdvice]:
+    """
+    Explains every query of a report. Nothing is written: the temporary tables and planner settings
+    are rolled back with the transactions of the sessions.
+
+    Args:
+        report_type: str: One of the ValidReports values
+        postgres_session: Session: Session object for PostgreSQL DB
+        mysql_session: Session: Session object for MySQL DB
+        assume_large_tables: bool: Discourage sequential scans on PostgreSQL, which it picks for small tables anyway
+
+    Returns:
+        The advice for every query of the report
+    """
+    sessions = {'postgres': postgres_session, 'mysql': mysql_session}
+    advice = []
+    try:
+        if assume_large_tables and postgres_session.get_bind().dialect.name == 'postgresql':
+            postgres_session.connection().exec_driver_sql('SET LOCAL enable_seqscan = off')
+
+        for report_query in REPORT_QUERIES[report_type](postgres_session, mysql_session):
+            connection = sessions[report_query.database].connection()
+            for table in report_query.temporary_tables:
+                table.create(connection)
+            try:
+                plan = explain(connection, report_query.statement)
+            finally:
+                for table in report_query.temporary_tables:
+                    table.drop(connection)
+
+            ignored_tables = tuple(table.name for table in report_query.temporary_tables)
+            advice.append(QueryAdvice(
+                report_query,
+                plan,
+                issues=find_plan_issues(connection.dialect.name, plan, ignored_tables),
+                missing_indexes=find_missing_indexes(connection, report_query)
+            ))
+    finally:
+        postgres_session.rollback()
+        mysql_session.rollback()
+
+    return advice
+
+
+def format_advice(report_type: str, advice: List[QueryAdvice]) -> str:
+    lines = []
+    for query_advice in advice:
+        lines.append(f'[{report_type}] {query_advice.query.name} ({query_advice.query.database})')
+        if query_advice.ok:
+            lines.append('    ok, index driven')
+        for issue in query_advice.issues:
+            lines.append(f'    {issue.kind}: {issue.detail}')
+        for index, ddl, migration in query_advice.missing_indexes:
+            shipped_in = f'created by {migration.relative_to(MIGRATIONS_DIR.parents[1])}' if migration else 'no migration creates it yet'
+            lines.append(f'    missing index {index.name} ({shipped_in}):')
+            lines.append(f'        {ddl};')
+    return '\n'.join(lines)
+
+
+def _compile_for_driver(statement: Select, dialect: Dialect) -> Tuple[str, Any]:
+    compiled = statement.compile(dialect=dialect, compile_kwargs={'render_postcompile': True})
+    if compiled.positional:
+        return str(compiled), tuple(compiled.params[name] for name in compiled.positiontup)
+    return str(compiled), compiled.params
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the query plans of a report against the configured databases.')
+    parser.add_argument('report_type', choices=[report.value for report in ValidReports])
+    parser.add_argument('--assume-large-tables', action='store_true', help='Discourage sequential scans on PostgreSQL.')
+    parser.add_argument('--fail-on-issues', action='store_true', help='Exit with status 1 if any plan has an issue.')
+    args = parser.parse_args()
+
+    from database.connections import get_postgres_session_class, get_mysql_session_class
+    with get_postgres_session_class()() as postgres_session, get_mysql_session_class()() as mysql_session:
+        advice = advise_report_indexes(args.report_type, postgres_session, mysql_session, args.assume_large_tables)
+
+    print(format_advice(args.report_type, advice))
+    if args.fail_on_issues and not all(query_advice.ok for query_advice in advice):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
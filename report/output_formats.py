@@ -0,0 +1,239 @@
+from .report_types import ReportFormat
+from typing import Dict, Iterable, Iterator, List, Optional
+import io
+import logging
+import zlib
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+# S3 object headers for every report format, so consumers know what they are downloading.
+CONTENT_HEADERS = {
+    ReportFormat.CSV.value: {'ContentType': 'text/csv'},
+    ReportFormat.CSV_GZIP.value: {'ContentType': 'text/csv', 'ContentEncoding': 'gzip'},
+    ReportFormat.CSV_ZSTD.value: {'ContentType': 'text/csv', 'ContentEncoding': 'zstd'},
+    ReportFormat.PARQUET.value: {'ContentType': 'application/vnd.apache.parquet'},
+}
+
+# The pandas compression of every CSV report format, to read the reports back.
+CSV_COMPRESSIONS = {
+    ReportFormat.CSV.value: None,
+    ReportFormat.CSV_GZIP.value: 'gzip',
+    ReportFormat.CSV_ZSTD.value: 'zstd',
+}
+
+GZIP_COMPRESSION_LEVEL = 6
+ZSTD_COMPRESSION_LEVEL = 3
+
+
+def get_content_headers(report_format: str) -> Dict[str, str]:
+    """
+    Returns the S3 ContentType (and ContentEncoding, for the compressed formats) for a report format.
+
+    Args:
+        report_format: str: One of the ReportFormat values
+
+    Returns:
+        The headers, as keyword arguments for the S3 upload
+
+    """
+    if report_format not in CONTENT_HEADERS:
+        raise ValueError(f'Unknown report format: {report_format}')
+    return dict(CONTENT_HEADERS[report_format])
+
+
+def iter_in_key_order(report_chunks: Iterable[pd.DataFrame], key: str) -> Iterator[pd.DataFrame]:
+    """
+    Passes the report chunks through, checking that they come in `key` order: sorted within every chunk,
+    and every chunk starting at or after the last key of the previous one. Chunks that do can be written out
+    one after the other as they arrive, without collecting the whole report to sort it at the end.
+
+    Args:
+        report_chunks: Iterable[pd.DataFrame]: The report, as consecutive chunks with the same columns.
+        key: str: The column the report is ordered by.
+
+    Returns:
+        An iterator over the same chunks. Raises a ValueError on the first chunk out of order.
+
+    """
+    last_key = None
+    for chunk_number, report_chunk in enumerate(report_chunks):
+        if not report_chunk.empty:
+            keys = report_chunk[key]
+            if not keys.is_monotonic_increasing or (last_key is not None and keys.iloc[0] < last_key):
+                raise ValueError(f'Chunk {chunk_number} of the report is not in {key} order.')
+            last_key = keys.iloc[-1]
+        yield report_chunk
+
+
+def iter_csv_parts(report_chunks: Iterable[pd.DataFrame]) -> Iterator[str]:
+    """
+    Serialises the report chunks to CSV one at a time. Only the first chunk carries the header row.
+
+    Args:
+        report_chunks: Iterable[pd.DataFrame]: The report, as consecutive chunks with the same columns.
+
+    Returns:
+        An iterator over the CSV text of every chunk.
+
+    """
+    for chunk_number, report_chunk in enumerate(report_chunks):
+        yield report_chunk.to_csv(index=False, header=chunk_number == 0)
+
+
+def iter_encoded_parts(
+        report_chunks: Iterable[pd.DataFrame],
+        report_format: str,
+        arrow_schema: Optional['pyarrow.Schema'] = None
+) -> Iterator[bytes]:
+    """
+    Serialises the report chunks one at a time in the requested format. The compressors are streaming,
+    and every Parquet chunk becomes its own row group, so only one chunk is ever encoded at a time.
+
+    Args:
+        report_chunks: Iterable[pd.DataFrame]: The report, as consecutive chunks with the same columns.
+        report_format: str: One of the ReportFormat values
+        arrow_schema: Optional[pyarrow.Schema]: Schema of the Parquet file. Inferred from the first chunk if not passed.
+
+    Returns:
+        An iterator over the encoded report, piece by piece.
+
+    """
+    if report_format == ReportFormat.CSV.value:
+        for csv_part in iter_csv_parts(report_chunks):
+            yield csv_part.encode('utf-8')
+
+    elif report_format == ReportFormat.CSV_GZIP.value:
+        # wbits=31 writes the gzip header and trailer, instead of a raw zlib stream.
+        compressor = zlib.compressobj(GZIP_COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+        for csv_part in iter_csv_parts(report_chunks):
+            yield compressor.compress(csv_part.encode('utf-8'))
+        yield compressor.flush()
+
+    elif report_format == ReportFormat.CSV_ZSTD.value:
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError('The zstandard package is needed for zstd compressed reports.')
+        compressor = zstandard.ZstdCompressor(level=ZSTD_COMPRESSION_LEVEL).compressobj()
+        for csv_part in iter_csv_parts(report_chunks):
+            yield compressor.compress(csv_part.encode('utf-8'))
+        yield compressor.flush()
+
+    elif report_format == ReportFormat.PARQUET.value:
+        yield from _iter_parquet_parts(report_chunks, arrow_schema)
+
+    else:
+        raise ValueError(f'Unknown report format: {report_format}')
+
+
+def encode_report(report: pd.DataFrame, report_format: str, arrow_schema: Optional['pyarrow.Schema'] = None) -> bytes:
+    """
+    Serialises a whole report in the requested format.
+
+    Args:
+        report: pd.DataFrame: The report
+        report_format: str: One of the ReportFormat values
+        arrow_schema: Optional[pyarrow.Schema]: Schema of the Parquet file. Inferred from the report if not passed.
+
+    Returns:
+        The encoded report
+
+    """
+    return b''.join(iter_encoded_parts([report], report_format, arrow_schema))
+
+
+def read_csv_report(report_data: bytes, report_format: str) -> pd.DataFrame:
+    """
+    Reads an encoded CSV report back, every value as its exact text in the CSV (empty for the missing ones),
+    so the report can be compared and written out again without any change from dtype conversions.
+
+    Args:
+        report_data: bytes: The encoded report
+        report_format: str: One of the CSV ReportFormat values
+
+    Returns:
+        The report, with string columns
+
+    """
+    if report_format not in CSV_COMPRESSIONS:
+        raise ValueError(f'Not a CSV report format: {report_format}')
+    return pd.read_csv(
+        io.BytesIO(report_data),
+        dtype=str,
+        keep_default_na=False,
+        compression=CSV_COMPRESSIONS[report_format]
+    )
+
+
+class _ParquetSink:
+    """
+    A write-only file object for the Parquet writer, which keeps the bytes written since they were last taken.
+    The writer needs tell() to keep counting from the start of the file, even after the bytes were handed out.
+    """
+
+    def __init__(self):
+        self._pending: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._pending.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b''.join(self._pending)
+        self._pending.clear()
+        return data
+
+
+def _iter_parquet_parts(report_chunks: Iterable[pd.DataFrame], arrow_schema: Optional['pyarrow.Schema']) -> Iterator[bytes]:
+    """
+    Writes every report chunk as a row group of a single Parquet file, handing out the bytes after every row group.
+
+    Args:
+        report_chunks: Iterable[pd.DataFrame]: The report, as consecutive chunks with the same columns.
+        arrow_schema: Optional[pyarrow.Schema]: Schema of the Parquet file. Inferred from the first chunk if not passed.
+
+    Returns:
+        An iterator over the Parquet file, piece by piece.
+
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError('The pyarrow package is needed for Parquet reports.')
+
+    sink = _ParquetSink()
+    writer = None
+    for report_chunk in report_chunks:
+        if arrow_schema is None:
+            arrow_schema = pa.Table.from_pandas(report_chunk, preserve_index=False).schema.remove_metadata()
+        if writer is None:
+            writer = pq.ParquetWriter(sink, arrow_schema, compression='zstd')
+
+        # Columns that are all empty in a chunk come out of pandas as float NaN, whatever their type.
+        columns = [
+            pa.nulls(len(report_chunk), type=field.type) if report_chunk[field.name].isna().all()
+            else pa.array(report_chunk[field.name], type=field.type, from_pandas=True)
+            for field in arrow_schema
+        ]
+        writer.write_table(pa.Table.from_arrays(columns, schema=arrow_schema))
+        yield sink.take()
+
+    if writer is None:
+        raise ValueError('Cannot write a Parquet report without any chunks.')
+    writer.close()
+    yield sink.take()
@@ -0,0 +1,117 @@
+"""
+The steps of generating a report that don't depend on how its data is fetched, shared by report.generator and
+report.async_generator: the parameters a report is reused with, the details it is recorded with, and the reuse
+of the same report generated earlier today.
+"""
+from datetime import date
+from typing import Dict, Optional
+from uuid import uuid4
+import json
+import logging
+
+import boto3
+
+from database.models import ReportsGenerated
+from services.aws_s3 import get_download_link_if_exists
+from services.instrumentation import ReportMetrics
+from services.report_history import get_report_parameters
+from config import settings
+from .delta import get_report_object_key, supports_delta
+from .report_types import ValidReports
+
+
+logger = logging.getLogger(__name__)
+
+
+def check_delta(report_type: str, report_format: str, delta: bool) -> bool:
+    """
+    Returns whether the report is generated as a delta: only when it was asked for and the report supports it.
+    """
+    if delta and not supports_delta(report_type, report_format):
+        logger.warning(f'The {report_type} report in {report_format} can not be generated as a delta, generating it in full.')
+        return False
+    return delta
+
+
+def get_reuse_parameters(report_type: str, report_format: str, delta: bool = False) -> str:
+    """
+    Builds the report_parameters a report is recorded and reused with: the options, and the settings, that change
+    its content. The fetch strategy and streaming do not. The ones added over time are only recorded when they are
+    not the defaults, so the reports generated before they existed are still reused.
+
+    Args:
+        report_type: str: Type of the report, one of the ValidReports values.
+        report_format: str: Format of the report, one of the ReportFormat values.
+        delta: bool: Whether the report is a delta.
+
+    Returns:
+        The report parameters, as built by get_report_parameters.
+    """
+    report_parameters = {'report_format': report_format}
+    if delta:
+        report_parameters['delta'] = True
+    if settings.report_typed_schema:
+        # The typed columns are written differently, e.g. 3 lessons instead of 3.0.
+        report_parameters['typed_schema'] = True
+    if report_type == ValidReports.CUSTOMER_X_DAILY.value:
+        report_parameters['daily_days'] = settings.report_daily_days
+    return get_report_parameters(**report_parameters)
+
+
+def new_report_details(report_type: str, report_format: str, report_parameters: str) -> Dict:
+    """
+    Builds the details of a new report, uploaded as the metadata of its S3 object and saved in reports_generated.
+    The object key is the one of a streamed report, reports built in memory replace it with the hash of their content.
+
+    Args:
+        report_type: str: Type of the report, one of the ValidReports values.
+        report_format: str: Format of the report, one of the ReportFormat values.
+        report_parameters: str: The report parameters, as built by get_reuse_parameters.
+
+    Returns:
+        The details of the report.
+    """
+    report_id = str(uuid4())
+    return {
+        'report_id': report_id,
+        's3_object_key': get_report_object_key(report_type, str(date.today()), report_id, report_format),
+        's3_bucket': settings.s3_bucket_name,
+        'report_date': str(date.today()),
+        'report_type': report_type,
+        'report_format': report_format,
+        'report_parameters': report_parameters
+    }
+
+
+def add_report_metrics(report_details: Dict, report_metrics: ReportMetrics):
+    # Added after the upload, the metrics are saved with the report details, not in the S3 object metadata.
+    report_details['metrics'] = json.dumps(report_metrics.summary())
+
+
+def get_existing_report_link(
+        existing_report: Optional[ReportsGenerated],
+        s3_client: Optional[boto3.client] = None
+) -> Optional[str]:
+    """
+    Re-signs a download link for the same report generated earlier today, if it is still on S3.
+
+    Args:
+        existing_report: Optional[ReportsGenerated]: The report found by find_existing_report, if any.
+        s3_client: Optional[boto3.client]: An existing S3 client to reuse.
+
+    Returns:
+        A fresh Download Link for the existing Report, or None if it has to be generated.
+    """
+    if existing_report is None:
+        return None
+
+    download_link = get_download_link_if_exists(
+        existing_report.s3_bucket,
+        existing_report.s3_object_key,
+        s3_client
+    )
+    if download_link is None:
+        logger.warning(f'Report {existing_report.report_id} is missing from S3, generating it again.')
+    else:
+        logger.info(f'Reusing report {existing_report.report_id}, generated earlier today.')
+    return download_link
@@ -3,3 +3,36 @@ from enum import Enum
 
 class ValidReports(Enum):
     CUSTOMER_X = 'customer_x'
+    # The lessons completed by every active user on each of the last report_daily_days days, one column per day.
+    CUSTOMER_X_DAILY = 'customer_x_daily'
+
+
+class ReportFormat(Enum):
+    # The value doubles as the file extension of the uploaded report.
+    CSV = 'csv'
+    CSV_GZIP = 'csv.gz'
+    CSV_ZSTD = 'csv.zst'
+    PARQUET = 'parquet'
+
+
+class FetchStrategy(Enum):
+    # Pull a chunk of users, then the lessons for that chunk, one chunk after the other.
+    SERIAL = 'serial'
+    # Pull the users and the lessons at the same time, with a pool of MySQL workers.
+    PIPELINED = 'pipelined'
+    # Load the active user ids into a MySQL temporary table once, and join against it in a single query.
+    STAGED_JOIN = 'staged_join'
+    # Keep the lessons completed per user per day in a rollup table, and only count the days not rolled up yet.
+    INCREMENTAL = 'incremental'
+    # Page the active users by keyset, and checkpoint every chunk locally,
+    # so a failed run resumes after the last good chunk instead of starting over.
+    RESUMABLE = 'resumable'
+    # Split the active users into user_id ranges, and fetch and merge every range in a worker process of its own.
+    SHARDED = 'sharded'
+
+
+class DeltaChange(Enum):
+    # How a row of a delta report differs from the same row of its base report.
+    ADDED = 'added'
+    REMOVED = 'removed'
+    CHANGED = 'changed'
@@ -0,0 +1,202 @@
+from .batch import ReportRequest, ReportResult, run_report, summarise_results
+from database.connections import get_postgres_engine, get_mysql_engine
+from services.aws_s3 import get_s3_client
+from config import settings
+from exceptions.report_gen_exceptions import ReportQueueFull
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import fields
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+import boto3
+import json
+import logging
+import signal
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class ReportService:
+    """
+    Generates the reports requested to a long running process, so the engines, their connection pools and the
+    S3 client are set up once instead of for every report. Up to `max_workers` reports are generated at a time,
+    and up to `max_queued` more wait for a worker. The same request coming in while it is still queued or
+    running is not generated again, it waits for the one in flight.
+    """
+
+    def __init__(
+            self,
+            max_workers: Optional[int] = None,
+            max_queued: Optional[int] = None,
+            s3_client: Optional[boto3.client] = None
+    ):
+        self.max_workers = max(1, max_workers or settings.report_batch_workers)
+        self.max_queued = max(0, settings.service_max_queued_reports if max_queued is None else max_queued)
+        self.s3_client = s3_client
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='report-service')
+        self._in_flight: Dict[ReportRequest, Future] = {}
+        self._lock = threading.Lock()
+
+    def warm_up(self):
+        """
+        Creates the S3 client, and opens a first connection to each database, so the first report doesn't pay
+        for them. A database that can't be reached is only logged, the reports will fail with the details.
+        """
+        if self.s3_client is None:
+            self.s3_client = get_s3_client()
+        for get_engine in (get_postgres_engine, get_mysql_engine):
+            try:
+                with get_engine().connect():
+                    pass
+            except Exception as e:
+                logger.warning(f'Failed to warm up the connection pool of {get_engine.__name__}. Details: {str(e)}')
+
+    def submit(self, report_request: ReportRequest) -> Tuple[Future, bool]:
+        """
+        Queues a report, unless the same report is already queued or running.
+
+        Args:
+            report_request: ReportRequest: The report to generate.
+
+        Returns:
+            The future of the report's ReportResult, and whether it is shared with an earlier request.
+        """
+        with self._lock:
+            report_future = self._in_flight.get(report_request)
+            if report_future is not None:
+                return report_future, True
+            if len(self._in_flight) >= self.max_workers + self.max_queued:
+                raise ReportQueueFull(f'{len(self._in_flight)} reports are already queued or running.')
+
+            if self.s3_client is None:
+                self.s3_client = get_s3_client()
+            report_future = self._executor.submit(run_report, report_request, self.s3_client)
+            self._in_flight[report_request] = report_future
+
+        report_future.add_done_callback(lambda _: self._forget(report_request))
+        return report_future, False
+
+    def generate(self, report_request: ReportRequest, timeout: Optional[float] = None) -> ReportResult:
+        report_future, _ = self.submit(report_request)
+        return report_future.result(timeout)
+
+    def status(self) -> Dict:
+        with self._lock:
+            in_flight = len(self._in_flight)
+        return {
+            'status': 'ok',
+            'workers': self.max_workers,
+            'max_queued': self.max_queued,
+            'in_flight': in_flight,
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for get_engine in (get_postgres_engine, get_mysql_engine):
+            try:
+                get_engine().dispose()
+            except Exception as e:
+                logger.warning(f'Failed to dispose of {get_engine.__name__}. Details: {str(e)}')
+
+    def _forget(self, report_request: ReportRequest):
+        with self._lock:
+            self._in_flight.pop(report_request, None)
+
+
+class ReportRequestHandler(BaseHTTPRequestHandler):
+    """
+    The HTTP api of the report service.
+
+    - `POST /reports` with a json object with the report_type, and any of the other ReportRequest options.
+      Answers once the report is generated, with the summary of the report (status, duration, download link).
+    - `GET /health` answers with the number of reports in flight.
+    """
+    server: 'ReportServer'
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/health':
+            self._send_json(HTTPStatus.OK, self.server.report_service.status())
+        else:
+            self._send_json(HTTPStatus.NOT_FOUND, {'error': f'Unknown path {self.path}'})
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/reports':
+            self._send_json(HTTPStatus.NOT_FOUND, {'error': f'Unknown path {self.path}'})
+            return
+
+        try:
+            report_request = self._read_report_request()
+        except ValueError as e:
+            self._send_json(HTTPStatus.BAD_REQUEST, {'error': str(e)})
+            return
+
+        try:
+            report_future, shared = self.server.report_service.submit(report_request)
+        except ReportQueueFull as e:
+            self._send_json(HTTPStatus.SERVICE_UNAVAILABLE, {'error': str(e)})
+            return
+
+        report_summary = summarise_results([report_future.result()])[0]
+        report_summary['shared'] = shared
+        status = HTTPStatus.OK if report_summary['status'] == 'ok' else HTTPStatus.INTERNAL_SERVER_ERROR
+        self._send_json(status, report_summary)
+
+    def log_message(self, format: str, *args):
+        logger.info(f'{self.address_string()} - {format % args}')
+
+    def _read_report_request(self) -> ReportRequest:
+        content_length = int(self.headers.get('Content-Length') or 0)
+        try:
+            options = json.loads(self.rfile.read(content_length) or b'{}')
+        except json.JSONDecodeError as e:
+            raise ValueError(f'The request body is not valid json. Details: {str(e)}')
+        if not isinstance(options, dict) or 'report_type' not in options:
+            raise ValueError('The request needs a json object with a report_type.')
+
+        unknown_options = set(options) - set(field.name for field in fields(ReportRequest))
+        if unknown_options:
+            raise ValueError(f'Unknown options: {sorted(unknown_options)}')
+        return ReportRequest(**options)
+
+    def _send_json(self, status: HTTPStatus, body: Dict):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class ReportServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], report_service: ReportService):
+        super().__init__(address, ReportRequestHandler)
+        self.report_service = report_service
+
+
+def serve(host: Optional[str] = None, port: Optional[int] = None, max_workers: Optional[int] = None):
+    """
+    Runs the report service until it is interrupted.
+
+    Args:
+        host: Optional[str]: Address to listen on. Default = service_host.
+        port: Optional[int]: Port to listen on. Default = service_port.
+        max_workers: Optional[int]: Number of reports generated at the same time. Default = report_batch_workers.
+    """
+    report_service = ReportService(max_workers=max_workers)
+    report_service.warm_up()
+    server = ReportServer((host or settings.service_host, port or settings.service_port), report_service)
+    if threading.current_thread() is threading.main_thread():
+        # serve_forever has to be stopped from another thread.
+        signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    logger.info(f'Report service listening on {server.server_address[0]}:{server.server_address[1]}.')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info('Stopping the report service.')
+    finally:
+        server.server_close()
+        report_service.close()
@@ -0,0 +1,131 @@
+import os
+import time
+from dataclasses import replace
+import pandas as pd
+import pytest
+from unittest.mock import patch
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from database.models import MindUsers
+from report.active_users_cache import ActiveUsersCache, get_active_users_fingerprint
+from report.customer_x_report import get_active_users_fingerprint_query, read_active_user_chunks
+from pydantic import ValidationError
+from config import Settings, settings
+
+
+TOTAL_USERS = 50
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    cache_dir = tmp_path / 'active_users'
+    monkeypatch.setattr(settings, 'report_active_users_cache', True)
+    monkeypatch.setattr(settings, 'report_active_users_cache_dir', str(cache_dir))
+    monkeypatch.setattr(settings, 'report_active_users_cache_ttl_seconds', 3600)
+    monkeypatch.setattr(settings, 'report_active_users_cache_max_bytes', 1024 * 1024)
+    return cache_dir
+
+
+@pytest.fixture
+def postgres_session(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "users.db"}')
+    MindUsers.__table__.create(engine)
+    with sessionmaker(bind=engine)() as session:
+        session.add_all(
+            MindUsers(user_id=user_id, user_name=f'User{user_id}', active_status='inactive' if user_id % 7 == 0 else 'active')
+            for user_id in range(1, TOTAL_USERS + 1)
+        )
+        session.commit()
+        yield session
+
+
+def read_users(postgres_session, chunksize=10):
+    # Counts the reads of the active users from the database, the cache only reads them to take a snapshot.
+    with patch('report.customer_x_report.pd.read_sql', wraps=pd.read_sql) as read_sql:
+        chunks = list(read_active_user_chunks(postgres_session, chunksize))
+    return chunks, read_sql.call_count
+
+
+def test_snapshot_is_read_while_the_users_are_unchanged(postgres_session, cache_dir, monkeypatch):
+    chunks, database_reads = read_users(postgres_session)
+    cached_chunks, cached_database_reads = read_users(postgres_session)
+
+    assert (database_reads, cached_database_reads) == (1, 0)
+    assert [len(chunk) for chunk in cached_chunks] == [10, 10, 10, 10, 3]
+    monkeypatch.setattr(settings, 'report_active_users_cache', False)
+    expected_chunks, _ = read_users(postgres_session)
+    for chunk, cached_chunk, expected_chunk in zip(chunks, cached_chunks, expected_chunks):
+        pd.testing.assert_frame_equal(chunk, expected_chunk)
+        pd.testing.assert_frame_equal(cached_chunk, expected_chunk)
+    assert len(list(cache_dir.glob('*.parquet'))) == 1
+
+
+@pytest.mark.parametrize('change', ['new user', 'deactivated user', 'renamed user'])
+def test_snapshot_is_taken_again_when_the_users_change(postgres_session, cache_dir, change):
+    read_users(postgres_session)
+
+    if change == 'new user':
+        postgres_session.add(MindUsers(user_id=TOTAL_USERS + 1, user_name='NewUser', active_status='active'))
+    elif change == 'deactivated user':
+        postgres_session.get(MindUsers, 1).active_status = 'inactive'
+    else:
+        postgres_session.get(MindUsers, 1).user_name = 'RenamedUser'
+    postgres_session.commit()
+    # A rename only shows in the writes PostgreSQL counts on mindtickle_users, SQLite has no such statistics.
+    watermark = 1 if change == 'renamed user' else None
+    with patch('report.active_users_cache.get_users_modification_watermark', return_value=watermark):
+        chunks, database_reads = read_users(postgres_session)
+
+    assert database_reads == 1
+    expected_users = pd.read_sql('SELECT user_id, user_name FROM mindtickle_users WHERE active_status = \'active\' '
+                                 'ORDER BY user_id', postgres_session.connection())
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), expected_users)
+
+
+def test_expired_snapshot_is_taken_again(postgres_session, cache_dir):
+    read_users(postgres_session)
+    [snapshot_path] = cache_dir.glob('*.parquet')
+    expired = time.time() - settings.report_active_users_cache_ttl_seconds - 1
+    os.utime(snapshot_path, (expired, expired))
+
+    _, database_reads = read_users(postgres_session)
+
+    assert database_reads == 1
+    assert snapshot_path.stat().st_mtime > expired
+
+
+def test_oldest_snapshots_are_evicted_beyond_the_size_cap(postgres_session, tmp_path):
+    fingerprint = get_active_users_fingerprint(postgres_session, get_active_users_fingerprint_query(postgres_session))
+    users = pd.DataFrame({'user_id': range(1000), 'user_name': [f'User{user_id}' for user_id in range(1000)]})
+    cache = ActiveUsersCache(tmp_path / 'active_users', ttl_seconds=3600, max_bytes=1024 * 1024)
+    for watermark in range(3):
+        list(cache.read_chunks(replace(fingerprint, watermark=watermark), 100, lambda: [users]))
+        time.sleep(0.01)
+    assert len(list(cache.cache_dir.glob('*.parquet'))) == 3
+
+    # Room for the snapshot just taken, and not for any other.
+    snapshot_size = next(cache.cache_dir.glob('*.parquet')).stat().st_size
+    cache.max_bytes = snapshot_size + snapshot_size // 2
+    latest_fingerprint = replace(fingerprint, watermark=3)
+    list(cache.read_chunks(latest_fingerprint, 100, lambda: [users]))
+
+    assert list(cache.cache_dir.glob('*.parquet')) == [cache.cache_dir / f'active_users_{latest_fingerprint.key}.parquet']
+
+
+def test_failed_snapshot_leaves_nothing_behind(postgres_session, tmp_path):
+    fingerprint = get_active_users_fingerprint(postgres_session, get_active_users_fingerprint_query(postgres_session))
+    cache = ActiveUsersCache(tmp_path / 'active_users', ttl_seconds=3600, max_bytes=1024 * 1024)
+
+    def fetch_chunks():
+        yield pd.DataFrame({'user_id': [1], 'user_name': ['User1']})
+        raise RuntimeError('Connection lost')
+
+    with pytest.raises(RuntimeError):
+        cache.read_chunks(fingerprint, 100, fetch_chunks)
+
+    assert [path.name for path in cache.cache_dir.iterdir()] == ['active_users.lock']
+
+
+def test_cache_is_refused_with_adaptive_chunks():
+    with pytest.raises(ValidationError, match='report_adaptive_chunks'):
+        Settings(report_active_users_cache=True, report_adaptive_chunks=True)
@@ -0,0 +1,153 @@
+import json
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from exceptions.report_gen_exceptions import DataFetchError, DataSaveFailure
+from report.batch import ReportRequest, generate_reports_batch, load_manifest, summarise_results
+from report.generator import generate_report
+from config import settings
+
+
+class FakeGenerateReport:
+    """
+    Stands in for generate_report, recording the calls and how many ran at the same time.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, report_type, stream, fetch_strategy, report_format, force_refresh, s3_client, pending_report_details, delta):
+        with self.lock:
+            self.calls.append((report_format, s3_client))
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.05)
+        with self.lock:
+            self.running -= 1
+        if report_format == 'parquet':
+            raise DataFetchError('Failed to Pull data to build the report!')
+        download_link = f'https://test-bucket/{report_type}.{report_format}'
+        pending_report_details.append({'report_type': report_type, 'download_link': download_link})
+        return download_link
+
+
+def test_generate_reports_batch():
+    fake_generate_report = FakeGenerateReport()
+    shared_s3_client = MagicMock()
+    report_requests = [
+        ReportRequest('customer_x'),
+        ReportRequest('customer_x', report_format='parquet'),
+        ReportRequest('customer_x', report_format='csv.gz'),
+        ReportRequest('customer_x', report_format='csv.zst'),
+        ReportRequest('customer_x'),
+    ]
+
+    with patch('report.batch.generate_report', fake_generate_report), \
+            patch('report.batch.get_postgres_session_class'), \
+            patch('report.batch.save_many_to_db') as mock_save_many_to_db:
+        results = generate_reports_batch(report_requests, max_workers=2, s3_client=shared_s3_client)
+
+    # The details of the three generated reports are saved together, once.
+    mock_save_many_to_db.assert_called_once()
+    assert sorted(details['download_link'] for details in mock_save_many_to_db.call_args.args[1]) == [
+        'https://test-bucket/customer_x.csv',
+        'https://test-bucket/customer_x.csv.gz',
+        'https://test-bucket/customer_x.csv.zst',
+    ]
+    assert [result.request for result in results] == report_requests
+    assert [result.succeeded for result in results] == [True, False, True, True, True]
+    assert results[0].download_link == 'https://test-bucket/customer_x.csv'
+    assert results[1].error == 'DataFetchError: Failed to Pull data to build the report!'
+    assert all(result.duration_seconds > 0 for result in results)
+    # The duplicated request only ran once, and at most two reports ran at the same time, on one S3 client.
+    assert len(fake_generate_report.calls) == 4
+    assert fake_generate_report.max_running == 2
+    assert all(s3_client is shared_s3_client for _, s3_client in fake_generate_report.calls)
+
+    summary = summarise_results(results)
+    assert [report_summary['status'] for report_summary in summary] == ['ok', 'failed', 'ok', 'ok', 'ok']
+
+
+def test_reports_are_failed_when_their_details_are_not_saved():
+    report_requests = [ReportRequest('customer_x'), ReportRequest('customer_x', report_format='parquet')]
+
+    with patch('report.batch.generate_report', FakeGenerateReport()), \
+            patch('report.batch.get_postgres_session_class'), \
+            patch('report.batch.save_many_to_db', side_effect=DataSaveFailure('Failed to save report details to the DB.')):
+        results = generate_reports_batch(report_requests, s3_client=MagicMock())
+
+    assert results[0].error == 'DataSaveFailure: Failed to save report details to the DB.'
+    assert results[1].error == 'DataFetchError: Failed to Pull data to build the report!'
+
+
+@pytest.mark.parametrize('saved', [True, False])
+def test_resumable_checkpoints_are_cleared_once_the_details_are_saved(tmp_path, monkeypatch, saved):
+    checkpoint_dir = tmp_path / 'report_checkpoints'
+    (checkpoint_dir / 'customer_x').mkdir(parents=True)
+    monkeypatch.setattr(settings, 'report_checkpoint_dir', str(checkpoint_dir))
+
+    def save_many_to_db(session, pending_report_details):
+        # The report is uploaded, but until its details are committed a rerun still has to resume it.
+        assert (checkpoint_dir / 'customer_x').is_dir()
+        if not saved:
+            raise DataSaveFailure('Failed to save report details to the DB.')
+
+    with patch('report.batch.generate_report', FakeGenerateReport()), \
+            patch('report.batch.get_postgres_session_class'), \
+            patch('report.batch.save_many_to_db', side_effect=save_many_to_db):
+        [result] = generate_reports_batch([ReportRequest('customer_x', fetch_strategy='resumable')], s3_client=MagicMock())
+
+    assert result.succeeded == saved
+    assert (checkpoint_dir / 'customer_x').is_dir() != saved
+
+
+def test_checkpoints_of_a_report_saved_by_the_batch_are_left_to_the_batch():
+    pending_report_details = []
+    with patch('report.generator._build_and_upload_report', return_value='download_link'), \
+            patch('report.generator.clear_report_checkpoints') as mock_clear_report_checkpoints:
+        generate_report(
+            'customer_x',
+            fetch_strategy='resumable',
+            force_refresh=True,
+            s3_client=MagicMock(),
+            pending_report_details=pending_report_details
+        )
+
+    assert len(pending_report_details) == 1
+    mock_clear_report_checkpoints.assert_not_called()
+
+
+def test_load_manifest(tmp_path):
+    manifest_path = tmp_path / 'manifest.json'
+    manifest_path.write_text(json.dumps([
+        'customer_x',
+        {'report_type': 'customer_x', 'report_format': 'parquet', 'stream': True},
+    ]))
+
+    report_requests = load_manifest(manifest_path, fetch_strategy='staged_join')
+
+    assert report_requests == [
+        ReportRequest('customer_x', fetch_strategy='staged_join'),
+        ReportRequest('customer_x', stream=True, fetch_strategy='staged_join', report_format='parquet'),
+    ]
+
+
+@pytest.mark.parametrize('manifest', [
+    {'report_type': 'customer_x'},
+    ['customer_y'],
+    [{'report_format': 'csv'}],
+    [{'report_type': 'customer_x', 'format': 'csv'}],
+    [{'report_type': 'customer_x', 'report_format': 'xlsx'}],
+])
+def test_load_manifest_rejects_invalid_manifests(tmp_path, manifest):
+    manifest_path = tmp_path / 'manifest.json'
+    manifest_path.write_text(json.dumps(manifest))
+
+    with pytest.raises(ValueError):
+        load_manifest(manifest_path)
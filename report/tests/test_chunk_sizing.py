@@ -0,0 +1,50 @@
+import pytest
+from report.chunk_sizing import AdaptiveChunkSizer, MAX_RESIZE_FACTOR
+
+
+MEGABYTE = 1024 * 1024
+
+
+def make_sizer(initial_size=1000, memory_budget=64 * MEGABYTE, target_seconds=2.0, **options):
+    return AdaptiveChunkSizer(initial_size, memory_budget, target_seconds, **options)
+
+
+def test_cheap_chunks_grow_by_at_most_the_resize_factor():
+    chunk_sizer = make_sizer()
+
+    # 1 KB and 0.1 ms per user: 2 seconds or 64 MB would take far more users.
+    sizes = [chunk_sizer.observe(chunk_sizer.size, chunk_sizer.size * 2, chunk_sizer.size * 1024, chunk_sizer.size * 0.0001)
+             for _ in range(3)]
+
+    assert sizes == [2000, 4000, 8000]
+
+
+def test_chunks_shrink_to_the_memory_budget():
+    chunk_sizer = make_sizer(memory_budget=10 * MEGABYTE)
+
+    # 40 KB per user, a few power users with long histories: 256 users fit in the budget.
+    for _ in range(5):
+        chunk_sizer.observe(chunk_sizer.size, chunk_sizer.size * 100, chunk_sizer.size * 40 * 1024, 0.01)
+
+    assert chunk_sizer.size == 256
+    assert [observation.chunk_size for observation in chunk_sizer.observations] == [1000, 500, 256, 256, 256]
+
+
+def test_chunks_shrink_to_the_target_latency():
+    chunk_sizer = make_sizer(target_seconds=1.0)
+
+    chunk_sizer.observe(1000, 3000, MEGABYTE, 4.0)
+
+    assert chunk_sizer.size == 1000 / MAX_RESIZE_FACTOR
+    chunk_sizer.observe(500, 1500, MEGABYTE, 2.0)
+    assert chunk_sizer.size == 250
+
+
+def test_size_stays_within_its_bounds():
+    chunk_sizer = make_sizer(initial_size=50, min_size=100, max_size=150)
+    assert chunk_sizer.size == 100
+
+    chunk_sizer.observe(100, 100, 100, 0.0)
+    assert chunk_sizer.size == 150
+    # Zero users (the last page) tell nothing about the cost of a user.
+    assert chunk_sizer.observe(0, 0, 0, 0.5) == 150
@@ -0,0 +1,194 @@
+import io
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from datetime import date, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from database.models import (
+    PostgresBase,
+    MysqlBase,
+    MindUsers,
+    LessonCompletion,
+    LessonCompletionRollup,
+    LessonCompletionRollupDay
+)
+from report.customer_x_daily import (
+    build_daily_lessons_matrix,
+    get_customer_x_daily_arrow_schema,
+    get_customer_x_daily_report_chunks,
+    get_daily_window
+)
+from report.checkpoints import clear_report_checkpoints
+from report.customer_x_report import get_customer_x_report_chunks
+from report.report_types import FetchStrategy
+from report.output_formats import encode_report
+from services.instrumentation import record_report
+from config import settings
+
+
+TOTAL_USERS = 90
+
+
+@pytest.fixture
+def sessions(tmp_path):
+    users_engine = create_engine(f'sqlite:///{tmp_path / "users.db"}')
+    PostgresBase.metadata.create_all(
+        users_engine,
+        tables=[MindUsers.__table__, LessonCompletionRollup.__table__, LessonCompletionRollupDay.__table__]
+    )
+    lessons_engine = create_engine(f'sqlite:///{tmp_path / "lessons.db"}')
+    MysqlBase.metadata.create_all(lessons_engine)
+
+    with sessionmaker(bind=users_engine)() as postgres_session, sessionmaker(bind=lessons_engine)() as mysql_session:
+        postgres_session.add_all(
+            MindUsers(user_id=user_id, user_name=f'User{user_id}', active_status='inactive' if user_id % 7 == 0 else 'active')
+            for user_id in range(1, TOTAL_USERS + 1)
+        )
+        mysql_session.add_all(
+            LessonCompletion(user_id=user_id, lesson_id=lesson_id, completion_date=date.today() - timedelta(days=1 + (user_id * lesson_id) % 50))
+            # Every fifth user has not completed any lessons.
+            for user_id in range(1, TOTAL_USERS + 1) if user_id % 5
+            for lesson_id in range(1, 5)
+        )
+        # On the first whole day of the customer_x report, and on the day before it.
+        mysql_session.add_all(
+            LessonCompletion(user_id=1, lesson_id=lesson_id, completion_date=date.today() - timedelta(days=days_ago))
+            for lesson_id, days_ago in [(5, 59), (6, 60)]
+        )
+        postgres_session.commit()
+        mysql_session.commit()
+        yield postgres_session, mysql_session
+
+
+def test_daily_window_ends_yesterday():
+    first_day, window = get_daily_window(3, today=date(2024, 3, 1))
+
+    assert first_day == date(2024, 2, 27)
+    assert window == [date(2024, 2, 27), date(2024, 2, 28), date(2024, 2, 29)]
+
+
+def test_build_daily_lessons_matrix():
+    matrix = build_daily_lessons_matrix(
+        np.array([10, 20, 30]),
+        np.array([10, 10, 20, 25, 30, 30]),
+        np.array(['2024-01-01', '2024-01-03', '2024-01-02', '2024-01-02', '2023-12-31', '2024-01-04'], dtype='datetime64[D]'),
+        np.array([2, 5, 1, 9, 7, 3]),
+        date(2024, 1, 1),
+        3
+    )
+
+    # User 25 is not in the chunk, and the lessons of user 30 are outside of the window.
+    np.testing.assert_array_equal(matrix, [[2, 0, 5], [0, 1, 0], [0, 0, 0]])
+    assert matrix.dtype == np.int32
+
+
+def test_daily_report_counts_every_day_of_the_window(sessions, monkeypatch):
+    postgres_session, mysql_session = sessions
+    monkeypatch.setattr(settings, 'report_daily_days', 30)
+    first_day, window = get_daily_window(30)
+
+    with record_report('customer_x_daily') as metrics:
+        daily_df = pd.concat(get_customer_x_daily_report_chunks(postgres_session, mysql_session), ignore_index=True)
+
+    lessons_df = pd.read_sql(mysql_session.query(LessonCompletion).statement, mysql_session.connection())
+    lessons_df['completion_date'] = pd.to_datetime(lessons_df['completion_date']).dt.date
+    expected_df = (
+        lessons_df[lessons_df['completion_date'] >= first_day]
+        .pivot_table(index='user_id', columns='completion_date', values='lesson_id', aggfunc='count')
+        .reindex(index=daily_df['user_id'], columns=window, fill_value=0)
+        .fillna(0)
+        .astype('int32')
+    )
+
+    active_user_ids = [user_id for user_id in range(1, TOTAL_USERS + 1) if user_id % 7]
+    assert daily_df['user_id'].tolist() == active_user_ids
+    assert daily_df.columns.tolist() == ['user_id', 'user_name'] + [day.isoformat() for day in window]
+    assert expected_df.to_numpy().sum() > 0
+    np.testing.assert_array_equal(daily_df[[day.isoformat() for day in window]].to_numpy(), expected_df.to_numpy())
+    # Users without any lessons still get a row, all zeros.
+    assert daily_df.loc[daily_df['user_id'] == 5, window[0].isoformat():].to_numpy().sum() == 0
+    assert metrics.summary()['stages']['build_matrix']['rows'] == len(active_user_ids)
+
+
+@pytest.mark.parametrize('fetch_strategy', [FetchStrategy.PIPELINED.value, FetchStrategy.STAGED_JOIN.value])
+def test_daily_report_is_the_same_from_the_merged_chunks(sessions, fetch_strategy):
+    postgres_session, mysql_session = sessions
+    serial_df = pd.concat(get_customer_x_daily_report_chunks(postgres_session, mysql_session), ignore_index=True)
+    merged_df = pd.concat(get_customer_x_daily_report_chunks(postgres_session, mysql_session, fetch_strategy), ignore_index=True)
+
+    pd.testing.assert_frame_equal(merged_df, serial_df)
+
+
+@pytest.mark.parametrize('days', [60, 61])
+@pytest.mark.parametrize('fetch_strategy', [FetchStrategy.SERIAL.value, FetchStrategy.PIPELINED.value])
+def test_daily_report_beyond_the_merged_chunks_window(sessions, monkeypatch, fetch_strategy, days):
+    postgres_session, mysql_session = sessions
+    # The customer_x report starts 60 days ago at the current time, so its first whole day is 59 days ago.
+    monkeypatch.setattr(settings, 'report_daily_days', days)
+
+    if fetch_strategy == FetchStrategy.SERIAL.value:
+        daily_df = pd.concat(get_customer_x_daily_report_chunks(postgres_session, mysql_session), ignore_index=True)
+        assert len(daily_df.columns) == 2 + days
+        assert daily_df.iloc[:, 2 + days - 60].sum() == 1
+    else:
+        with pytest.raises(ValueError, match='only be fetched with the serial strategy'):
+            get_customer_x_daily_report_chunks(postgres_session, mysql_session, fetch_strategy)
+
+
+def test_daily_report_of_the_whole_merged_chunks_window(sessions, monkeypatch):
+    postgres_session, mysql_session = sessions
+    monkeypatch.setattr(settings, 'report_daily_days', 59)
+    serial_df = pd.concat(get_customer_x_daily_report_chunks(postgres_session, mysql_session), ignore_index=True)
+    assert serial_df.iloc[:, 2].sum() == 1
+
+    pipelined_df = pd.concat(
+        get_customer_x_daily_report_chunks(postgres_session, mysql_session, FetchStrategy.PIPELINED.value),
+        ignore_index=True
+    )
+
+    pd.testing.assert_frame_equal(pipelined_df, serial_df)
+
+
+def test_daily_report_from_chunks_splitting_a_user(sessions, monkeypatch):
+    postgres_session, mysql_session = sessions
+    # The incremental chunks are slices of report rows, 7 rows split the lessons of some users across two chunks.
+    monkeypatch.setattr(settings, 'report_chunk_size', 7)
+    serial_df = pd.concat(get_customer_x_daily_report_chunks(postgres_session, mysql_session), ignore_index=True)
+    report_chunks = list(get_customer_x_report_chunks(postgres_session, mysql_session, FetchStrategy.INCREMENTAL.value))
+    assert any(chunk['user_id'].iloc[-1] == next_chunk['user_id'].iloc[0] for chunk, next_chunk in zip(report_chunks, report_chunks[1:]))
+
+    incremental_df = pd.concat(
+        get_customer_x_daily_report_chunks(postgres_session, mysql_session, FetchStrategy.INCREMENTAL.value),
+        ignore_index=True
+    )
+
+    pd.testing.assert_frame_equal(incremental_df, serial_df)
+
+
+def test_resumable_daily_report_checkpoints_are_its_own(sessions, tmp_path, monkeypatch):
+    postgres_session, mysql_session = sessions
+    checkpoint_dir = tmp_path / 'checkpoints'
+    monkeypatch.setattr(settings, 'report_checkpoint_dir', str(checkpoint_dir))
+    serial_df = pd.concat(get_customer_x_daily_report_chunks(postgres_session, mysql_session), ignore_index=True)
+
+    resumable_df = pd.concat(
+        get_customer_x_daily_report_chunks(postgres_session, mysql_session, FetchStrategy.RESUMABLE.value),
+        ignore_index=True
+    )
+
+    pd.testing.assert_frame_equal(resumable_df, serial_df)
+    assert [path.name for path in checkpoint_dir.iterdir() if path.is_dir()] == ['customer_x_daily']
+    # What the generator does once the report is saved.
+    clear_report_checkpoints(checkpoint_dir, 'customer_x_daily')
+    assert [path for path in checkpoint_dir.iterdir() if path.is_dir()] == []
+
+
+def test_daily_report_as_parquet(sessions):
+    postgres_session, mysql_session = sessions
+    daily_df = pd.concat(get_customer_x_daily_report_chunks(postgres_session, mysql_session), ignore_index=True)
+    table = pq.read_table(io.BytesIO(encode_report(daily_df, 'parquet', get_customer_x_daily_arrow_schema())))
+
+    assert table.num_rows == len(daily_df)
+    assert table.schema.names == daily_df.columns.tolist()
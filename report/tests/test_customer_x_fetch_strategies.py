@@ -0,0 +1,426 @@
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+import pandas as pd
+from datetime import date, datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from database.models import (
+    PostgresBase,
+    MysqlBase,
+    MindUsers,
+    LessonCompletion,
+    LessonCompletionRollup,
+    LessonCompletionRollupDay
+)
+from report.customer_x_report import (
+    generate_customer_x_report,
+    get_customer_x_report_chunks,
+    iter_customer_x_report_chunks,
+    iter_customer_x_report_chunks_pipelined,
+    iter_customer_x_report_chunks_resumable,
+    iter_customer_x_report_chunks_staged
+)
+from report import customer_x_report
+from report.checkpoints import clear_report_checkpoints
+from report.chunk_sizing import AdaptiveChunkSizer
+from report.customer_x_sharded import get_shard_ranges, iter_customer_x_report_chunks_sharded
+from report.customer_x_rollup import (
+    get_window_days,
+    iter_customer_x_report_chunks_incremental,
+    refresh_lesson_completion_rollup
+)
+from report.report_types import FetchStrategy
+from services.instrumentation import record_report
+from config import settings
+from exceptions.report_gen_exceptions import DataFetchError
+
+
+# SQLite files stand in for the two production databases, so the fetch strategies can be compared locally.
+TOTAL_USERS = 250
+
+
+@pytest.fixture(autouse=True)
+def checkpoint_dir(tmp_path, monkeypatch):
+    checkpoint_dir = tmp_path / 'checkpoints'
+    monkeypatch.setattr(settings, 'report_checkpoint_dir', str(checkpoint_dir))
+    return checkpoint_dir
+
+
+@pytest.fixture
+def postgres_session_factory(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "users.db"}')
+    PostgresBase.metadata.create_all(
+        engine,
+        tables=[MindUsers.__table__, LessonCompletionRollup.__table__, LessonCompletionRollupDay.__table__]
+    )
+    SessionClass = sessionmaker(bind=engine)
+    with SessionClass() as session:
+        session.add_all(
+            MindUsers(
+                user_id=user_id,
+                user_name=f'User{user_id}',
+                active_status='inactive' if user_id % 7 == 0 else 'active'
+            )
+            for user_id in range(1, TOTAL_USERS + 1)
+        )
+        session.commit()
+    return SessionClass
+
+
+@pytest.fixture
+def mysql_session_factory(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "lessons.db"}')
+    MysqlBase.metadata.create_all(engine)
+    SessionClass = sessionmaker(bind=engine)
+    today = date.today()
+    with SessionClass() as session:
+        session.add_all(
+            LessonCompletion(
+                user_id=user_id,
+                lesson_id=lesson_id,
+                completion_date=today - timedelta(days=2 + (user_id * lesson_id) % 70)
+            )
+            # Every fifth user has not completed any lessons.
+            for user_id in range(1, TOTAL_USERS + 1) if user_id % 5
+            for lesson_id in range(1, 6)
+        )
+        session.commit()
+    return SessionClass
+
+
+def test_pipelined_chunks_match_serial_chunks(postgres_session_factory, mysql_session_factory):
+    with postgres_session_factory() as postgres_session, mysql_session_factory() as mysql_session:
+        serial_chunks = list(iter_customer_x_report_chunks(postgres_session, mysql_session, chunksize=20))
+        pipelined_chunks = list(
+            iter_customer_x_report_chunks_pipelined(
+                postgres_session,
+                mysql_session_factory,
+                concurrency=3,
+                chunksize=20
+            )
+        )
+
+    assert len(pipelined_chunks) == len(serial_chunks)
+    for pipelined_chunk, serial_chunk in zip(pipelined_chunks, serial_chunks):
+        pd.testing.assert_frame_equal(pipelined_chunk, serial_chunk)
+
+
+def test_adaptive_chunks_make_the_same_report(postgres_session_factory, mysql_session_factory):
+    # A budget of ~10 users worth of merged rows, starting from chunks of 50 users.
+    chunk_sizer = AdaptiveChunkSizer(initial_size=50, memory_budget=10 * 2000, target_seconds=60.0, min_size=5)
+    with postgres_session_factory() as postgres_session, mysql_session_factory() as mysql_session:
+        serial_df = pd.concat(iter_customer_x_report_chunks(postgres_session, mysql_session, chunksize=20), ignore_index=True)
+        adaptive_chunks = list(iter_customer_x_report_chunks(postgres_session, mysql_session, chunk_sizer=chunk_sizer))
+
+    pd.testing.assert_frame_equal(pd.concat(adaptive_chunks, ignore_index=True), serial_df)
+    chunk_sizes = [observation.chunk_size for observation in chunk_sizer.observations]
+    assert chunk_sizes[0] == 50
+    assert chunk_sizes[-1] < 50
+    # Every chunk was fetched with the size picked after the previous one.
+    assert [observation.users for observation in chunk_sizer.observations[:-1]] == chunk_sizes[:-1]
+
+
+@pytest.mark.parametrize('setting, read_function', [('db_stream_results', 'read_sql_frame'), ('db_bulk_export', 'read_sql_bulk_frame')])
+def test_adaptive_chunks_read_the_users_like_the_other_queries(postgres_session_factory, mysql_session_factory, monkeypatch, setting, read_function):
+    with postgres_session_factory() as postgres_session, mysql_session_factory() as mysql_session:
+        serial_df = pd.concat(iter_customer_x_report_chunks(postgres_session, mysql_session, chunksize=20), ignore_index=True)
+        monkeypatch.setattr(settings, setting, True)
+        chunk_sizer = AdaptiveChunkSizer(initial_size=20, memory_budget=10 * 2000, target_seconds=60.0, min_size=5)
+        with patch(f'report.customer_x_report.{read_function}', wraps=getattr(customer_x_report, read_function)) as mock_read:
+            adaptive_chunks = list(iter_customer_x_report_chunks(postgres_session, mysql_session, chunk_sizer=chunk_sizer))
+
+    pd.testing.assert_frame_equal(pd.concat(adaptive_chunks, ignore_index=True), serial_df)
+    # The lessons of every chunk, and every page of users.
+    assert mock_read.call_count >= 2 * len(adaptive_chunks)
+
+
+def test_generate_customer_x_report_pipelined(postgres_session_factory, mysql_session_factory):
+    with postgres_session_factory() as postgres_session, mysql_session_factory() as mysql_session:
+        serial_df = generate_customer_x_report(postgres_session, mysql_session)
+        pipelined_df = generate_customer_x_report(postgres_session, mysql_session, FetchStrategy.PIPELINED.value)
+
+    assert serial_df['user_id'].is_monotonic_increasing
+    assert set(serial_df['user_id']) == {user_id for user_id in range(1, TOTAL_USERS + 1) if user_id % 7}
+    pd.testing.assert_frame_equal(pipelined_df, serial_df)
+
+
+@pytest.mark.parametrize('fetch_size', [7, 1000])
+def test_staged_join_chunks_match_serial_chunks(postgres_session_factory, mysql_session_factory, fetch_size):
+    with postgres_session_factory() as postgres_session, mysql_session_factory() as mysql_session:
+        serial_chunks = list(iter_customer_x_report_chunks(postgres_session, mysql_session, chunksize=20))
+        staged_chunks = list(
+            iter_customer_x_report_chunks_staged(
+                postgres_session,
+                mysql_session,
+                chunksize=20,
+                fetch_size=fetch_size
+            )
+        )
+
+    assert len(staged_chunks) == len(serial_chunks)
+    for staged_chunk, serial_chunk in zip(staged_chunks, serial_chunks):
+        pd.testing.assert_frame_equal(staged_chunk, serial_chunk)
+
+
+def test_generate_customer_x_report_staged_join(postgres_session_factory, mysql_session_factory):
+    with postgres_session_factory() as postgres_session, mysql_session_factory() as mysql_session:
+        serial_df = generate_customer_x_report(postgres_session, mysql_session)
+        staged_df = generate_customer_x_report(postgres_session, mysql_session, FetchStrategy.STAGED_JOIN.value)
+
+    pd.testing.assert_frame_equal(staged_df, serial_df)
+
+
+def test_generate_customer_x_report_incremental(postgres_session_factory, mysql_session_factory):
+    with postgres_session_factory() as postgres_session, mysql_session_factory() as mysql_session:
+        serial_df = generate_customer_x_report(postgres_session, mysql_session)
+        first_run_df = generate_customer_x_report(postgres_session, mysql_session, FetchStrategy.INCREMENTAL.value)
+        second_run_df = generate_customer_x_report(postgres_session, mysql_session, FetchStrategy.INCREMENTAL.value)
+
+    pd.testing.assert_frame_equal(first_run_df, serial_df)
+    pd.testing.assert_frame_equal(second_run_df, serial_df)
+
+
+def test_incremental_chunks_have_report_chunk_size_rows(postgres_session_factory, mysql_session_factory, monkeypatch):
+    monkeypatch.setattr(settings, 'report_chunk_size', 40)
+    with postgres_session_factory() as postgres_session, mysql_session_factory() as mysql_session:
+        serial_df = generate_customer_x_report(postgres_session, mysql_session)
+        incremental_chunks = list(
+            get_customer_x_report_chunks(postgres_session, mysql_session, FetchStrategy.INCREMENTAL.value)
+        )
+
+    assert len(serial_df) > 80
+    assert [len(chunk) for chunk in incremental_chunks[:-1]] == [40] * (len(incremental_chunks) - 1)
+    pd.testing.assert_frame_equal(pd.concat(incremental_chunks, ignore_index=True), serial_df)
+
+
+def test_rollup_only_refreshes_new_and_late_arrival_days(postgres_session_factory, mysql_session_factory):
+    window_days = get_window_days(datetime.now() - timedelta(days=60), datetime.now() - timedelta(days=1))
+    assert window_days[0] == date.today() - timedelta(days=59)
+    assert window_days[-1] == date.today() - timedelta(days=1)
+
+    with postgres_session_factory() as postgres_session, mysql_session_factory() as mysql_session:
+        first_run_days = refresh_lesson_completion_rollup(postgres_session, mysql_session, window_days, late_arrival_days=2)
+        second_run_days = refresh_lesson_completion_rollup(postgres_session, mysql_session, window_days, late_arrival_days=2)
+        no_recheck_days = refresh_lesson_completion_rollup(postgres_session, mysql_session, window_days, late_arrival_days=0)
+
+        # Sliding the window by one day only rolls up the new day, and the late arrival window.
+        next_window_days = window_days[1:] + [window_days[-1] + timedelta(days=1)]
+        next_run_days = refresh_lesson_completion_rollup(postgres_session, mysql_session, next_window_days, late_arrival_days=2)
+        pruned_days = postgres_session.query(LessonCompletionRollup).filter(
+            LessonCompletionRollup.completion_date < next_window_days[0]
+        ).count()
+
+    assert first_run_days == window_days
+    assert second_run_days == window_days[-2:]
+    assert no_recheck_days == []
+    assert next_run_days == next_window_days[-2:]
+    assert pruned_days == 0
+
+
+def test_rollup_picks_up_late_arriving_completions(postgres_session_factory, mysql_session_factory):
+    yesterday = date.today() - timedelta(days=1)
+    with postgres_session_factory() as postgres_session, mysql_session_factory() as mysql_session:
+        list(iter_customer_x_report_chunks_incremental(postgres_session, mysql_session))
+
+        mysql_session.add(LessonCompletion(user_id=1, lesson_id=99, completion_date=yesterday))
+        mysql_session.commit()
+
+        report_df = pd.concat(iter_customer_x_report_chunks_incremental(postgres_session, mysql_session))
+
+    late_row = report_df[(report_df['user_id'] == 1) & (report_df['completion_date'] == yesterday)]
+    assert late_row['lessons_completed'].tolist() == [1]
+
+
+def test_pipelined_chunks_stop_early(postgres_session_factory, mysql_session_factory):
+    with postgres_session_factory() as postgres_session:
+        report_chunks = iter_customer_x_report_chunks_pipelined(
+            postgres_session,
+            mysql_session_factory,
+            concurrency=2,
+            chunksize=10
+        )
+        first_chunk = next(report_chunks)
+        # Closing the generator should stop the producer and the workers without hanging.
+        report_chunks.close()
+
+    assert first_chunk['user_id'].min() == 1
+
+
+@pytest.mark.parametrize('fetch_strategy', [strategy.value for strategy in FetchStrategy])
+def test_generate_customer_x_report_records_its_stages(postgres_session_factory, mysql_session_factory, fetch_strategy):
+    with postgres_session_factory() as postgres_session, mysql_session_factory() as mysql_session:
+        with record_report('customer_x') as metrics:
+            report_df = generate_customer_x_report(postgres_session, mysql_session, fetch_strategy)
+
+    stages = metrics.summary()['stages']
+    assert stages['concat']['rows'] == len(report_df)
+    assert 'sort' not in stages
+    if fetch_strategy in (FetchStrategy.SERIAL.value, FetchStrategy.PIPELINED.value):
+        # One users query and one lessons query per chunk of 1000 users, even from the pipelined workers.
+        assert stages['fetch_users']['count'] == stages['fetch_lessons']['count'] == stages['merge']['count'] == 1
+        assert stages['merge']['rows'] == len(report_df)
+    if fetch_strategy == FetchStrategy.STAGED_JOIN.value:
+        assert stages['stage_users']['rows'] == len({user_id for user_id in range(1, TOTAL_USERS + 1) if user_id % 7})
+    if fetch_strategy == FetchStrategy.INCREMENTAL.value:
+        assert stages['rollup_refresh']['count'] == 1
+        assert stages['fetch_report']['rows'] == len(report_df)
+
+
+@pytest.mark.parametrize('fetch_strategy', [strategy.value for strategy in FetchStrategy])
+def test_typed_schema_report_matches_the_untyped_report(postgres_session_factory, mysql_session_factory, fetch_strategy, monkeypatch):
+    with postgres_session_factory() as postgres_session, mysql_session_factory() as mysql_session:
+        untyped_df = generate_customer_x_report(postgres_session, mysql_session)
+        monkeypatch.setattr(settings, 'report_typed_schema', True)
+        with record_report('customer_x') as metrics:
+            typed_df = generate_customer_x_report(postgres_session, mysql_session, fetch_strategy)
+
+    assert typed_df['user_id'].dtype == 'int32'
+    assert isinstance(typed_df['user_name'].dtype, pd.CategoricalDtype)
+    assert typed_df['lessons_completed'].dtype == pd.Int8Dtype()
+    assert typed_df['completion_date'].dtype == 'datetime64[ns]'
+    assert typed_df.memory_usage(deep=True).sum() < untyped_df.memory_usage(deep=True).sum()
+    assert metrics.summary()['stages']['apply_schema']['memory_saved_bytes'] > 0
+
+    pd.testing.assert_frame_equal(
+        typed_df.astype({'user_id': 'int64', 'user_name': 'object', 'lessons_completed': 'Float64'}),
+        untyped_df.astype({'lessons_completed': 'Float64'}).assign(completion_date=pd.to_datetime(untyped_df['completion_date']))
+    )
+
+
+def test_resumable_chunks_match_serial_chunks(postgres_session_factory, mysql_session_factory, checkpoint_dir):
+    with postgres_session_factory() as postgres_session, mysql_session_factory() as mysql_session:
+        serial_chunks = list(iter_customer_x_report_chunks(postgres_session, mysql_session, chunksize=20))
+        resumable_chunks = list(
+            iter_customer_x_report_chunks_resumable(postgres_session, mysql_session, checkpoint_dir, chunksize=20)
+        )
+        # A complete checkpoint is read back as it is, without querying again.
+        with record_report('customer_x') as metrics:
+            rerun_chunks = list(
+                iter_customer_x_report_chunks_resumable(postgres_session, mysql_session, checkpoint_dir, chunksize=20)
+            )
+
+    assert len(resumable_chunks) == len(serial_chunks)
+    for resumable_chunk, serial_chunk in zip(resumable_chunks, serial_chunks):
+        pd.testing.assert_frame_equal(resumable_chunk, serial_chunk)
+    # Missing dates come back from the checkpoint as None instead of NaN, which makes no difference to the report.
+    assert pd.concat(rerun_chunks).to_csv(index=False) == pd.concat(serial_chunks).to_csv(index=False)
+    assert set(metrics.summary()['stages']) == {'read_checkpoint'}
+
+
+def test_resumable_report_resumes_after_the_last_good_chunk(postgres_session_factory, mysql_session_factory, checkpoint_dir, monkeypatch):
+    import report.customer_x_report as customer_x_report
+    merge_lessons_completed = customer_x_report.merge_lessons_completed
+    merged_chunks = []
+
+    def fail_on_the_fourth_chunk(mysql_session, df_active_users_part, start_date):
+        if len(merged_chunks) == 3:
+            raise DataFetchError('Failed to pull data from Lessons Completed DB.')
+        merged_chunks.append(df_active_users_part['user_id'].iloc[0])
+        return merge_lessons_completed(mysql_session, df_active_users_part, start_date)
+
+    with postgres_session_factory() as postgres_session, mysql_session_factory() as mysql_session:
+        serial_df = pd.concat(iter_customer_x_report_chunks(postgres_session, mysql_session, chunksize=20), ignore_index=True)
+
+        monkeypatch.setattr(customer_x_report, 'merge_lessons_completed', fail_on_the_fourth_chunk)
+        with pytest.raises(DataFetchError):
+            list(iter_customer_x_report_chunks_resumable(postgres_session, mysql_session, checkpoint_dir, chunksize=20))
+        monkeypatch.setattr(customer_x_report, 'merge_lessons_completed', merge_lessons_completed)
+
+        with record_report('customer_x') as metrics:
+            resumed_df = pd.concat(
+                iter_customer_x_report_chunks_resumable(postgres_session, mysql_session, checkpoint_dir, chunksize=20),
+                ignore_index=True
+            )
+
+    stages = metrics.summary()['stages']
+    assert stages['read_checkpoint']['count'] == 3
+    # The first page fetched again starts right after the last checkpointed user.
+    assert stages['fetch_users']['count'] == stages['checkpoint']['count'] == len(serial_df['user_id'].unique()) // 20 + 1 - 3
+    assert resumed_df.to_csv(index=False) == serial_df.to_csv(index=False)
+
+
+def test_checkpoints_are_not_resumed_with_other_options(postgres_session_factory, mysql_session_factory, checkpoint_dir):
+    with postgres_session_factory() as postgres_session, mysql_session_factory() as mysql_session:
+        list(iter_customer_x_report_chunks_resumable(postgres_session, mysql_session, checkpoint_dir, chunksize=20))
+        with record_report('customer_x') as metrics:
+            other_chunks = list(
+                iter_customer_x_report_chunks_resumable(postgres_session, mysql_session, checkpoint_dir, chunksize=50)
+            )
+        clear_report_checkpoints(checkpoint_dir, 'customer_x')
+
+    stages = metrics.summary()['stages']
+    assert 'read_checkpoint' not in stages
+    assert stages['fetch_users']['count'] == len(other_chunks) == 5
+    assert not (checkpoint_dir / 'customer_x').exists()
+
+
+@pytest.mark.parametrize('fetch_strategy', [FetchStrategy.SERIAL.value, FetchStrategy.INCREMENTAL.value])
+def test_built_report_is_encoded_chunk_by_chunk(postgres_session_factory, mysql_session_factory, fetch_strategy):
+    from report.generator import _build_and_upload_report
+
+    with postgres_session_factory() as postgres_session, mysql_session_factory() as mysql_session:
+        expected_csv = generate_customer_x_report(postgres_session, mysql_session).to_csv(index=False)
+
+    with patch('report.generator.get_postgres_session_class', return_value=postgres_session_factory), \
+            patch('report.generator.get_mysql_session_class', return_value=mysql_session_factory), \
+            patch('report.generator.save', return_value='download_link') as mock_save, \
+            record_report('customer_x') as metrics:
+        download_link = _build_and_upload_report('customer_x', fetch_strategy, 'csv', 'bucket', {'report_date': '2024-01-01'})
+
+    assert download_link == 'download_link'
+    assert mock_save.call_args.args[0] == expected_csv.encode('utf-8')
+    stages = metrics.summary()['stages']
+    assert stages['build']['bytes'] == stages['upload']['bytes'] == len(expected_csv)
+    assert 'concat' not in stages
+
+
+def test_shard_ranges_cover_the_user_ids():
+    assert get_shard_ranges(1, 10, 3) == [(1, 5), (5, 9), (9, 11)]
+    assert get_shard_ranges(5, 5, 4) == [(5, 6)]
+    assert get_shard_ranges(1, 3, 8) == [(1, 2), (2, 3), (3, 4)]
+
+
+def test_sharded_chunks_match_serial_chunks(postgres_session_factory, mysql_session_factory):
+    with postgres_session_factory() as postgres_session, mysql_session_factory() as mysql_session:
+        serial_df = pd.concat(iter_customer_x_report_chunks(postgres_session, mysql_session, chunksize=20), ignore_index=True)
+        with record_report('customer_x') as metrics:
+            sharded_chunks = list(
+                iter_customer_x_report_chunks_sharded(postgres_session, mysql_session, shard_count=3, chunksize=20, max_workers=2)
+            )
+
+    pd.testing.assert_frame_equal(pd.concat(sharded_chunks, ignore_index=True), serial_df)
+    stages = metrics.summary()['stages']
+    assert stages['fetch_shard']['count'] == 3
+    assert stages['fetch_shard']['rows'] == stages['merge']['rows'] == len(serial_df)
+
+
+def test_sharded_chunks_bound_the_shards_in_flight(postgres_session_factory, mysql_session_factory):
+    submitted_shards = []
+
+    # Worker threads stand in for the worker processes, so the submitted shards can be followed.
+    class ThreadShardExecutor(ThreadPoolExecutor):
+        def __init__(self, max_workers, mp_context, initializer, initargs):
+            super().__init__(max_workers, initializer=initializer, initargs=initargs)
+
+        def submit(self, fn, *args):
+            submitted_shards.append(args)
+            return super().submit(fn, *args)
+
+    with postgres_session_factory() as postgres_session, mysql_session_factory() as mysql_session, \
+            patch('report.customer_x_sharded.ProcessPoolExecutor', ThreadShardExecutor):
+        sharded_chunks = iter_customer_x_report_chunks_sharded(
+            postgres_session,
+            mysql_session,
+            shard_count=5,
+            chunksize=20,
+            max_workers=2,
+            report_type='customer_x_daily'
+        )
+        next(sharded_chunks)
+        # The third shard is submitted once the first one is done, the others wait.
+        assert len(submitted_shards) == 3
+        list(sharded_chunks)
+
+    assert len(submitted_shards) == 5
+    assert {shard_args[3] for shard_args in submitted_shards} == {'customer_x_daily'}
@@ -3,7 +3,7 @@ from unittest.mock import MagicMock, patch
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 from database.models import MindUsers, LessonCompletion
-from report.customer_x_report import get_active_users_query, get_lessons_completed_query
+from report.customer_x_report import get_active_users_page_query, get_active_users_query, get_lessons_completed_query
 
 
 class TestYourFunctions(unittest.TestCase):
@@ -39,6 +39,17 @@ class TestYourFunctions(unittest.TestCase):
         self.assertIsNotNone(result_query)
         # Add more specific assertions based on your expectations
 
+    def test_get_active_users_page_query(self):
+        first_page = str(get_active_users_page_query(Session(), None, 1000).statement.compile(compile_kwargs={'literal_binds': True}))
+        next_page = str(get_active_users_page_query(Session(), 42, 1000).statement.compile(compile_kwargs={'literal_binds': True}))
+
+        self.assertNotIn('user_id >', first_page)
+        self.assertIn('mindtickle_users.user_id > 42', next_page)
+        for page in (first_page, next_page):
+            self.assertIn('ORDER BY mindtickle_users.user_id', page)
+            self.assertIn('LIMIT 1000', page)
+            self.assertNotIn('OFFSET', page)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,197 @@
+import boto3
+import pandas as pd
+import pytest
+from datetime import date, timedelta
+from unittest.mock import MagicMock, patch
+from uuid import UUID, uuid4
+from moto import mock_s3
+from sqlalchemy import create_engine, UUID as UUIDType
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import sessionmaker
+from database.models import ReportsGenerated
+from report.delta import apply_report_delta, compute_report_delta, reconstruct_report
+from report.generator import generate_report
+from report.output_formats import encode_report, read_csv_report
+from services.aws_s3 import download, get_content_hash
+from config import settings
+
+
+KEYS = ('user_id', 'completion_date')
+REGION_NAME = 'ap-south-1'
+
+
+# reports_generated uses the PostgreSQL UUID column type, SQLite stands in for it here with a plain CHAR column.
+@compiles(UUIDType, 'sqlite')
+def compile_uuid_for_sqlite(type_, compiler, **kw):
+    return 'CHAR(32)'
+
+
+def make_report(rows):
+    # Like a merged customer_x chunk: users without lessons have no completion date, and float lesson counts.
+    return pd.DataFrame(rows, columns=['user_id', 'user_name', 'completion_date', 'lessons_completed'])
+
+
+def as_text(report):
+    return read_csv_report(encode_report(report, 'csv'), 'csv')
+
+
+BASE_REPORT = make_report([
+    (2, 'User2', date(2024, 1, 1), 1.0),
+    (2, 'User2', date(2024, 1, 2), 3.0),
+    (9, 'User9', None, None),
+    (10, 'User10', date(2024, 1, 1), 2.0),
+    (11, 'User11', date(2024, 1, 1), 4.0),
+])
+
+REPORT = make_report([
+    (2, 'User2', date(2024, 1, 2), 3.0),
+    (2, 'User2', date(2024, 1, 3), 1.0),
+    (9, 'User9', date(2024, 1, 3), 5.0),
+    (10, 'User10', date(2024, 1, 1), 7.0),
+    (11, 'User11', date(2024, 1, 1), 4.0),
+    (12, 'User12', None, None),
+])
+
+
+def test_compute_report_delta():
+    delta_report = compute_report_delta(as_text(BASE_REPORT), as_text(REPORT), KEYS)
+
+    assert delta_report.values.tolist() == [
+        ['2', 'User2', '2024-01-01', '1.0', 'removed'],
+        ['2', 'User2', '2024-01-03', '1.0', 'added'],
+        ['9', 'User9', '', '', 'removed'],
+        ['9', 'User9', '2024-01-03', '5.0', 'added'],
+        ['10', 'User10', '2024-01-01', '7.0', 'changed'],
+        ['12', 'User12', '', '', 'added'],
+    ]
+
+
+def test_apply_report_delta_rebuilds_the_report():
+    base_report, report = as_text(BASE_REPORT), as_text(REPORT)
+    delta_report = read_csv_report(encode_report(compute_report_delta(base_report, report, KEYS), 'csv.gz'), 'csv.gz')
+
+    rebuilt_report = apply_report_delta(base_report, delta_report, KEYS)
+
+    assert encode_report(rebuilt_report, 'csv') == encode_report(REPORT, 'csv')
+
+
+def test_unchanged_report_has_an_empty_delta():
+    delta_report = compute_report_delta(as_text(REPORT), as_text(REPORT), KEYS)
+
+    assert delta_report.empty
+    assert encode_report(apply_report_delta(as_text(REPORT), delta_report, KEYS), 'csv') == encode_report(REPORT, 'csv')
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    monkeypatch.setattr(settings, 's3_bucket_name', 'test-bucket')
+    monkeypatch.setattr(settings, 's3_skip_unchanged_uploads', False)
+    with mock_s3():
+        s3_client = boto3.client('s3', region_name=REGION_NAME)
+        s3_client.create_bucket(Bucket='test-bucket', CreateBucketConfiguration={'LocationConstraint': REGION_NAME})
+        yield s3_client
+
+
+@pytest.fixture
+def postgres_session_class():
+    engine = create_engine('sqlite://')
+    ReportsGenerated.__table__.create(engine)
+    return sessionmaker(bind=engine)
+
+
+def save_report_details(postgres_session_class, report_details):
+    report_details = {
+        **report_details,
+        'report_id': UUID(report_details['report_id']),
+        'report_date': date.fromisoformat(report_details['report_date']),
+    }
+    if 'base_report_id' in report_details:
+        report_details['base_report_id'] = UUID(report_details['base_report_id'])
+    with postgres_session_class() as postgres_session:
+        postgres_session.add(ReportsGenerated(**report_details))
+        postgres_session.commit()
+
+
+def generate_delta_report(postgres_session_class, s3_client, report, delta=True):
+    pending_report_details = []
+    with patch('report.generator.get_postgres_session_class', return_value=postgres_session_class), \
+            patch('report.generator.get_mysql_session_class', return_value=MagicMock()), \
+            patch('report.generator._get_report_chunks', return_value=(iter([report[:3], report[3:]]), None)):
+        download_link = generate_report(
+            'customer_x',
+            s3_client=s3_client,
+            force_refresh=True,
+            pending_report_details=pending_report_details,
+            delta=delta
+        )
+    return download_link, pending_report_details[0]
+
+
+def test_delta_report_against_the_last_full_report(postgres_session_class, s3_client):
+    base_key = f'customer_x_report/{date.today() - timedelta(days=1)}.csv'
+    s3_client.put_object(Bucket='test-bucket', Key=base_key, Body=encode_report(BASE_REPORT, 'csv'))
+    base_report_id = uuid4()
+    with postgres_session_class() as postgres_session:
+        postgres_session.add(ReportsGenerated(
+            report_id=base_report_id,
+            s3_object_key=base_key,
+            s3_bucket='test-bucket',
+            report_date=date.today() - timedelta(days=1),
+            report_type='customer_x',
+            download_link='https://test-bucket.s3.amazonaws.com/base',
+            report_format='csv',
+        ))
+        postgres_session.commit()
+
+    download_link, report_details = generate_delta_report(postgres_session_class, s3_client, REPORT)
+
+    assert report_details['base_report_id'] == str(base_report_id)
+    assert report_details['s3_object_key'] == f'customer_x_report/{date.today()}/{report_details["report_id"]}.delta.csv'
+    assert report_details['s3_object_key'] in download_link
+    delta_report = read_csv_report(download('test-bucket', report_details['s3_object_key'], s3_client), 'csv')
+    assert delta_report['change'].tolist() == ['removed', 'added', 'removed', 'added', 'changed', 'added']
+
+    save_report_details(postgres_session_class, report_details)
+    with postgres_session_class() as postgres_session:
+        assert reconstruct_report(postgres_session, report_details['report_id'], s3_client) == encode_report(REPORT, 'csv')
+
+
+def test_delta_report_without_a_base_is_uploaded_in_full(postgres_session_class, s3_client):
+    _, report_details = generate_delta_report(postgres_session_class, s3_client, REPORT)
+
+    assert 'base_report_id' not in report_details
+    content_hash = get_content_hash(encode_report(REPORT, 'csv'))
+    assert report_details['s3_object_key'] == f'customer_x_report/{date.today()}/{content_hash}.csv'
+    assert download('test-bucket', report_details['s3_object_key'], s3_client) == encode_report(REPORT, 'csv')
+
+    # The full report is the base of the next delta.
+    save_report_details(postgres_session_class, report_details)
+    _, next_report_details = generate_delta_report(postgres_session_class, s3_client, REPORT)
+    assert next_report_details['base_report_id'] == report_details['report_id']
+
+
+def test_full_report_generated_again_keeps_the_delta_base(postgres_session_class, s3_client):
+    _, base_report_details = generate_delta_report(postgres_session_class, s3_client, BASE_REPORT)
+    save_report_details(postgres_session_class, base_report_details)
+    _, delta_report_details = generate_delta_report(postgres_session_class, s3_client, REPORT)
+    save_report_details(postgres_session_class, delta_report_details)
+
+    # A full report of the same day, generated again with --force-refresh.
+    _, report_details = generate_delta_report(postgres_session_class, s3_client, REPORT, delta=False)
+
+    assert report_details['s3_object_key'] != base_report_details['s3_object_key']
+    assert download('test-bucket', base_report_details['s3_object_key'], s3_client) == encode_report(BASE_REPORT, 'csv')
+    with postgres_session_class() as postgres_session:
+        rebuilt_report = reconstruct_report(postgres_session, delta_report_details['report_id'], s3_client)
+    assert rebuilt_report == encode_report(REPORT, 'csv')
+
+
+def test_full_report_generated_again_with_the_same_content_is_not_uploaded_again(postgres_session_class, s3_client, monkeypatch):
+    monkeypatch.setattr(settings, 's3_skip_unchanged_uploads', True)
+    _, report_details = generate_delta_report(postgres_session_class, s3_client, REPORT, delta=False)
+
+    with patch.object(s3_client, 'upload_fileobj', wraps=s3_client.upload_fileobj) as mock_upload_fileobj:
+        _, next_report_details = generate_delta_report(postgres_session_class, s3_client, REPORT, delta=False)
+
+    assert next_report_details['s3_object_key'] == report_details['s3_object_key']
+    mock_upload_fileobj.assert_not_called()
@@ -0,0 +1,105 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from database.models import MindUsers, LessonCompletion, LessonCompletionRollup, LessonCompletionRollupDay
+from report.index_advisor import FILESORT, FULL_SCAN, TEMPORARY, advise_report_indexes, find_plan_issues
+
+
+POSTGRES_PLAN = [{
+    'Plan': {
+        'Node Type': 'Sort',
+        'Sort Key': ['mindtickle_users.user_id'],
+        'Plans': [{
+            'Node Type': 'Seq Scan',
+            'Relation Name': 'mindtickle_users',
+            'Filter': "((active_status)::text = 'active'::text)",
+        }],
+    },
+}]
+
+POSTGRES_INDEXED_PLAN = [{
+    'Plan': {
+        'Node Type': 'Index Only Scan',
+        'Relation Name': 'mindtickle_users',
+        'Index Name': 'ix_mindtickle_users_active_status_user_id',
+    },
+}]
+
+MYSQL_PLAN = [
+    {'id': 1, 'table': 'report_active_users_1', 'type': 'ALL', 'rows': 1000, 'Extra': 'Using temporary; Using filesort'},
+    {'id': 1, 'table': 'lesson_completion', 'type': 'ALL', 'rows': 5000000, 'Extra': 'Using where; Using join buffer (hash join)'},
+]
+
+MYSQL_INDEXED_PLAN = [
+    {'id': 1, 'table': 'lesson_completion', 'type': 'range', 'rows': 1200, 'Extra': 'Using where; Using index'},
+]
+
+
+def test_postgres_plan_issues():
+    issues = find_plan_issues('postgresql', POSTGRES_PLAN)
+
+    assert [(issue.kind, issue.table) for issue in issues] == [(FILESORT, None), (FULL_SCAN, 'mindtickle_users')]
+    assert 'mindtickle_users.user_id' in issues[0].detail
+    assert find_plan_issues('postgresql', POSTGRES_INDEXED_PLAN) == []
+
+
+def test_mysql_plan_issues():
+    issues = find_plan_issues('mysql', MYSQL_PLAN, ignored_tables=('report_active_users_1',))
+
+    assert [(issue.kind, issue.table) for issue in issues] == [
+        (FILESORT, 'report_active_users_1'),
+        (TEMPORARY, 'report_active_users_1'),
+        (FULL_SCAN, 'lesson_completion'),
+    ]
+    assert find_plan_issues('mysql', MYSQL_INDEXED_PLAN) == []
+
+
+@pytest.fixture
+def sessions(tmp_path):
+    postgres_engine = create_engine(f'sqlite:///{tmp_path / "users.db"}')
+    mysql_engine = create_engine(f'sqlite:///{tmp_path / "lessons.db"}')
+    user_tables = [MindUsers.__table__, LessonCompletionRollup.__table__, LessonCompletionRollupDay.__table__]
+    MindUsers.metadata.create_all(postgres_engine, tables=user_tables)
+    LessonCompletion.metadata.create_all(mysql_engine, tables=[LessonCompletion.__table__])
+    with Session(postgres_engine) as postgres_session, Session(mysql_engine) as mysql_session:
+        yield postgres_session, mysql_session
+
+
+def test_indexed_tables_give_index_driven_plans(sessions):
+    advice = advise_report_indexes('customer_x', *sessions)
+
+    by_name = {query_advice.query.name: query_advice for query_advice in advice}
+    assert set(by_name) == {
+        'active_users', 'active_users_fingerprint', 'lessons_completed', 'staged_lessons_completed',
+        'lessons_completed_per_day', 'rolled_up_report'
+    }
+    for name in ('active_users', 'active_users_fingerprint', 'lessons_completed', 'lessons_completed_per_day', 'rolled_up_report'):
+        assert by_name[name].ok, (name, by_name[name].issues, by_name[name].missing_indexes)
+
+
+def test_missing_index_is_flagged_with_its_migration(sessions):
+    postgres_session, mysql_session = sessions
+    mysql_session.connection().exec_driver_sql('DROP INDEX ix_lesson_completion_user_id_completion_date')
+    mysql_session.commit()
+
+    advice = {query_advice.query.name: query_advice for query_advice in advise_report_indexes('customer_x', *sessions)}
+
+    lessons_completed = advice['lessons_completed']
+    assert FILESORT in [issue.kind for issue in lessons_completed.issues]
+    [(index, ddl, migration)] = lessons_completed.missing_indexes
+    assert index.name == 'ix_lesson_completion_user_id_completion_date'
+    assert ddl.startswith('CREATE INDEX ix_lesson_completion_user_id_completion_date ON lesson_completion')
+    assert migration.name == '001_add_lesson_completion_indexes.sql'
+    assert advice['active_users'].ok
+
+
+def test_full_scan_without_indexes(sessions):
+    postgres_session, _ = sessions
+    postgres_session.connection().exec_driver_sql('DROP INDEX ix_mindtickle_users_active_status_user_id')
+    postgres_session.commit()
+
+    advice = {query_advice.query.name: query_advice for query_advice in advise_report_indexes('customer_x', *sessions)}
+
+    assert (FULL_SCAN, 'mindtickle_users') in [(issue.kind, issue.table) for issue in advice['active_users'].issues]
+    assert advice['active_users'].missing_indexes[0][2].name == '005_add_mindtickle_users_active_index.sql'
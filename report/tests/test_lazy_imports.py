@@ -0,0 +1,33 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import report
+
+
+PROJECT_ROOT = Path(__file__).parents[2]
+HEAVY_MODULES = ('pandas', 'boto3', 'sqlalchemy', 'pydantic', 'config', 'database.connections')
+
+
+def test_report_types_do_not_import_the_report_generation():
+    # A fresh interpreter, the current one already imported everything through the other tests.
+    check_imports = (
+        'import sys, report; '
+        'from report.report_types import ValidReports; '
+        f'print(",".join(module for module in {HEAVY_MODULES!r} if module in sys.modules))'
+    )
+    result = subprocess.run(
+        [sys.executable, '-c', check_imports],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+
+    assert result.stdout.strip() == ''
+
+
+def test_generate_report_is_loaded_on_first_access():
+    from report import generator
+
+    assert report.generate_report is generator.generate_report
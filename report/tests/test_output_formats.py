@@ -0,0 +1,126 @@
+import gzip
+import io
+import unittest
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from report.customer_x_report import get_customer_x_arrow_schema
+from report.output_formats import encode_report, get_content_headers, iter_encoded_parts, iter_in_key_order
+from report.report_types import ReportFormat
+from report.typed_schema import downcast_integers
+
+
+class TestOutputFormats(unittest.TestCase):
+    def setUp(self):
+        self.report_chunks = [
+            pd.DataFrame({
+                'user_id': [1, 1, 3],
+                'user_name': ['User1', 'User1', 'User3'],
+                'lessons_completed': np.array([2, 1, 4], dtype='int8'),
+                'completion_date': [date(2023, 9, 16), date(2023, 9, 18), date(2023, 9, 16)]
+            }),
+            # A chunk where nobody completed a lesson, straight out of the left merge.
+            pd.DataFrame({
+                'user_id': [5, 6],
+                'user_name': ['User5', 'User6'],
+                'lessons_completed': [np.nan, np.nan],
+                'completion_date': [np.nan, np.nan]
+            }),
+        ]
+        self.expected_csv = ''.join(
+            chunk.to_csv(index=False, header=chunk_number == 0)
+            for chunk_number, chunk in enumerate(self.report_chunks)
+        )
+
+    def test_csv(self):
+        encoded = b''.join(iter_encoded_parts(self.report_chunks, ReportFormat.CSV.value))
+
+        self.assertEqual(encoded.decode('utf-8'), self.expected_csv)
+
+    def test_gzip_csv(self):
+        encoded = b''.join(iter_encoded_parts(self.report_chunks, ReportFormat.CSV_GZIP.value))
+
+        self.assertEqual(gzip.decompress(encoded).decode('utf-8'), self.expected_csv)
+
+    def test_zstd_csv(self):
+        zstandard = import_or_skip('zstandard')
+
+        encoded = b''.join(iter_encoded_parts(self.report_chunks, ReportFormat.CSV_ZSTD.value))
+
+        decompressed = zstandard.ZstdDecompressor().decompressobj().decompress(encoded)
+        self.assertEqual(decompressed.decode('utf-8'), self.expected_csv)
+
+    def test_parquet_writes_a_row_group_per_chunk(self):
+        encoded = b''.join(
+            iter_encoded_parts(self.report_chunks, ReportFormat.PARQUET.value, get_customer_x_arrow_schema())
+        )
+
+        parquet_file = pq.ParquetFile(io.BytesIO(encoded))
+        self.assertEqual(parquet_file.metadata.num_row_groups, 2)
+        table = parquet_file.read()
+        self.assertEqual(table.schema, get_customer_x_arrow_schema())
+        self.assertEqual(table.column('user_id').to_pylist(), [1, 1, 3, 5, 6])
+        self.assertEqual(table.column('lessons_completed').to_pylist(), [2, 1, 4, None, None])
+        self.assertEqual(table.column('completion_date').to_pylist()[:2], [date(2023, 9, 16), date(2023, 9, 18)])
+
+    def test_parquet_holds_widened_lesson_counts(self):
+        widened_chunk = pd.DataFrame({
+            'user_id': [7],
+            'user_name': ['User7'],
+            'lessons_completed': downcast_integers(pd.Series([300], name='lessons_completed'), 'int8'),
+            'completion_date': [date(2023, 9, 17)]
+        })
+        self.assertEqual(widened_chunk['lessons_completed'].dtype, 'int16')
+
+        encoded = b''.join(iter_encoded_parts(
+            [self.report_chunks[0], widened_chunk],
+            ReportFormat.PARQUET.value,
+            get_customer_x_arrow_schema()
+        ))
+
+        table = pq.read_table(io.BytesIO(encoded))
+        self.assertEqual(table.column('lessons_completed').to_pylist(), [2, 1, 4, 300])
+
+    def test_parquet_infers_the_schema_from_the_first_chunk(self):
+        encoded = encode_report(self.report_chunks[0], ReportFormat.PARQUET.value)
+
+        read_back = pq.read_table(io.BytesIO(encoded)).to_pandas()
+        pd.testing.assert_frame_equal(read_back, self.report_chunks[0])
+
+    def test_content_headers(self):
+        self.assertEqual(get_content_headers(ReportFormat.CSV.value), {'ContentType': 'text/csv'})
+        self.assertEqual(get_content_headers(ReportFormat.CSV_GZIP.value)['ContentEncoding'], 'gzip')
+        self.assertEqual(get_content_headers(ReportFormat.CSV_ZSTD.value)['ContentEncoding'], 'zstd')
+        self.assertNotIn('ContentEncoding', get_content_headers(ReportFormat.PARQUET.value))
+        with self.assertRaises(ValueError):
+            get_content_headers('xlsx')
+
+    def test_chunks_in_key_order_pass_through(self):
+        chunks = self.report_chunks + [pd.DataFrame(columns=self.report_chunks[0].columns)]
+
+        self.assertEqual(list(iter_in_key_order(chunks, 'user_id')), chunks)
+
+    def test_chunks_out_of_key_order_are_rejected(self):
+        passed_chunks = []
+        with self.assertRaisesRegex(ValueError, 'Chunk 1 of the report is not in user_id order'):
+            for chunk in iter_in_key_order(self.report_chunks[::-1], 'user_id'):
+                passed_chunks.append(chunk)
+        self.assertEqual(len(passed_chunks), 1)
+
+        unsorted_chunk = self.report_chunks[0].iloc[::-1]
+        with self.assertRaises(ValueError):
+            list(iter_in_key_order([unsorted_chunk], 'user_id'))
+
+
+def import_or_skip(module_name):
+    try:
+        return __import__(module_name)
+    except ImportError:
+        raise unittest.SkipTest(f'{module_name} is not installed.')
+
+
+if __name__ == '__main__':
+    unittest.main()
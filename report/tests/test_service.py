@@ -0,0 +1,139 @@
+import json
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+from report.batch import ReportRequest
+from report.service import ReportService, ReportServer
+from exceptions.report_gen_exceptions import ReportQueueFull
+
+
+@pytest.fixture
+def report_service():
+    report_service = ReportService(max_workers=1, max_queued=1, s3_client=MagicMock())
+    yield report_service
+    report_service._executor.shutdown(wait=True)
+
+
+@pytest.fixture
+def server_url(report_service):
+    server = ReportServer(('127.0.0.1', 0), report_service)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def post_report(server_url, body):
+    request = Request(f'{server_url}/reports', data=json.dumps(body).encode(), method='POST')
+    try:
+        with urlopen(request, timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_report_is_generated_with_the_shared_client(report_service):
+    with patch('report.batch.generate_report', return_value='download_link') as mock_generate_report:
+        result = report_service.generate(ReportRequest('customer_x', report_format='parquet'), timeout=10)
+
+    assert result.download_link == 'download_link'
+    assert mock_generate_report.call_args.kwargs['s3_client'] is report_service.s3_client
+    assert mock_generate_report.call_args.kwargs['report_format'] == 'parquet'
+    assert report_service.status()['in_flight'] == 0
+
+
+def test_identical_requests_in_flight_are_generated_once(report_service):
+    release = threading.Event()
+
+    def slow_report(**options):
+        release.wait(10)
+        return 'download_link'
+
+    with patch('report.batch.generate_report', side_effect=slow_report) as mock_generate_report:
+        first_future, first_shared = report_service.submit(ReportRequest('customer_x'))
+        second_future, second_shared = report_service.submit(ReportRequest('customer_x'))
+        release.set()
+        first_result, second_result = first_future.result(10), second_future.result(10)
+
+    assert second_future is first_future
+    assert (first_shared, second_shared) == (False, True)
+    assert first_result.download_link == second_result.download_link == 'download_link'
+    mock_generate_report.assert_called_once()
+
+
+def test_requests_beyond_the_queue_are_turned_away(report_service):
+    release = threading.Event()
+
+    with patch('report.batch.generate_report', side_effect=lambda **options: release.wait(10) and 'download_link'):
+        report_service.submit(ReportRequest('customer_x'))
+        report_service.submit(ReportRequest('customer_x', report_format='parquet'))
+        with pytest.raises(ReportQueueFull):
+            report_service.submit(ReportRequest('customer_x', report_format='csv.gz'))
+        # Identical to a report in flight, so it doesn't need a place in the queue.
+        report_service.submit(ReportRequest('customer_x'))
+        release.set()
+
+
+def test_post_report(server_url):
+    with patch('report.batch.generate_report', return_value='download_link'):
+        status, body = post_report(server_url, {'report_type': 'customer_x', 'report_format': 'parquet'})
+
+    assert status == 200
+    assert body['status'] == 'ok'
+    assert body['download_link'] == 'download_link'
+    assert body['report_format'] == 'parquet'
+
+
+def test_concurrent_posts_share_the_report(server_url):
+    release = threading.Event()
+
+    def slow_report(**options):
+        release.wait(10)
+        return 'download_link'
+
+    with patch('report.batch.generate_report', side_effect=slow_report) as mock_generate_report, \
+            ThreadPoolExecutor(max_workers=2) as executor:
+        responses = [executor.submit(post_report, server_url, {'report_type': 'customer_x'}) for _ in range(2)]
+        threading.Timer(0.2, release.set).start()
+        results = [response.result() for response in responses]
+
+    assert [status for status, _ in results] == [200, 200]
+    assert sorted(body['shared'] for _, body in results) == [False, True]
+    mock_generate_report.assert_called_once()
+
+
+def test_failed_report_is_a_server_error(server_url):
+    with patch('report.batch.generate_report', side_effect=RuntimeError('S3 is down')):
+        status, body = post_report(server_url, {'report_type': 'customer_x'})
+
+    assert status == 500
+    assert body['status'] == 'failed'
+    assert 'S3 is down' in body['error']
+
+
+@pytest.mark.parametrize('body', [
+    {'report_format': 'csv'},
+    {'report_type': 'nope'},
+    {'report_type': 'customer_x', 'color': 'red'},
+    {'report_type': ['customer_x']},
+    {'report_type': 'customer_x', 'stream': 'yes'},
+    {'report_type': 'customer_x', 'force_refresh': 1},
+    {'report_type': 'customer_x', 'report_format': {'csv': True}},
+    ['customer_x'],
+])
+def test_invalid_requests_are_rejected(server_url, body):
+    status, response_body = post_report(server_url, body)
+
+    assert status == 400
+    assert response_body['error']
+
+
+def test_health(server_url):
+    with urlopen(f'{server_url}/health', timeout=10) as response:
+        body = json.loads(response.read())
+
+    assert body == {'status': 'ok', 'workers': 1, 'max_queued': 1, 'in_flight': 0}
@@ -0,0 +1,101 @@
+import unittest
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from pydantic import ValidationError
+
+from config import Settings
+from exceptions.report_gen_exceptions import DataTypeOverflow
+from report.typed_schema import (
+    CATEGORY,
+    DATE,
+    apply_typed_schema,
+    concat_typed_chunks,
+    downcast_integers,
+    get_integer_dtype
+)
+
+
+class TestTypedSchema(unittest.TestCase):
+    def test_unknown_integer_overflow_setting_is_rejected(self):
+        with self.assertRaises(ValidationError):
+            Settings(report_integer_overflow='rasie')
+        self.assertEqual(Settings(report_integer_overflow='raise').report_integer_overflow, 'raise')
+
+    def test_get_integer_dtype(self):
+        self.assertEqual(get_integer_dtype(0, 127), 'int8')
+        self.assertEqual(get_integer_dtype(0, 128), 'int16')
+        self.assertEqual(get_integer_dtype(-40_000, 5, 'int8'), 'int32')
+        self.assertEqual(get_integer_dtype(0, 1, 'int32'), 'int32')
+        with self.assertRaises(DataTypeOverflow):
+            get_integer_dtype(0, 2 ** 63)
+
+    def test_downcast_integers_never_wraps(self):
+        lessons_completed = pd.Series([1, 127, 300], name='lessons_completed')
+
+        # astype would turn 300 into 44.
+        self.assertEqual(lessons_completed.astype('int8').tolist()[-1], 44)
+
+        widened = downcast_integers(lessons_completed, 'int8')
+        self.assertEqual(widened.dtype, np.dtype('int16'))
+        self.assertEqual(widened.tolist(), [1, 127, 300])
+
+        with self.assertRaises(DataTypeOverflow):
+            downcast_integers(lessons_completed, 'int8', on_overflow='raise')
+
+        self.assertEqual(downcast_integers(lessons_completed.head(2), 'int8').dtype, np.dtype('int8'))
+
+    def test_downcast_integers_keeps_missing_values(self):
+        lessons_completed = pd.Series([2.0, np.nan, 4.0], name='lessons_completed')
+
+        downcast = downcast_integers(lessons_completed, 'int8')
+
+        self.assertEqual(downcast.dtype, pd.Int8Dtype())
+        self.assertTrue(pd.isna(downcast[1]))
+        self.assertEqual(downcast_integers(pd.Series([1, 2]), 'int8', nullable=True).dtype, pd.Int8Dtype())
+        self.assertEqual(downcast_integers(pd.Series([], dtype=object), 'int8').dtype, np.dtype('int8'))
+
+    def test_apply_typed_schema(self):
+        report = pd.DataFrame({
+            'user_id': np.arange(1, 1001),
+            'user_name': ['User1', 'User2'] * 500,
+            'lessons_completed': [3.0, np.nan] * 500,
+            'completion_date': [date(2023, 9, 16), np.nan] * 500,
+        })
+
+        typed_report, memory_saved = apply_typed_schema(
+            report,
+            {'user_id': 'int32', 'user_name': CATEGORY, 'lessons_completed': 'Int8', 'completion_date': DATE, 'missing': 'int8'}
+        )
+
+        self.assertEqual(typed_report['user_id'].dtype, np.dtype('int32'))
+        self.assertIsInstance(typed_report['user_name'].dtype, pd.CategoricalDtype)
+        self.assertEqual(typed_report['lessons_completed'].dtype, pd.Int8Dtype())
+        self.assertEqual(typed_report['completion_date'].dtype, np.dtype('datetime64[ns]'))
+        self.assertEqual(
+            memory_saved,
+            report.memory_usage(index=False, deep=True).sum() - typed_report.memory_usage(index=False, deep=True).sum()
+        )
+        self.assertGreater(memory_saved, 0)
+        # The CSV only loses the float formatting of the counts.
+        self.assertEqual(
+            typed_report.to_csv(index=False),
+            report.assign(lessons_completed=['3', '']*500).to_csv(index=False)
+        )
+
+    def test_concat_typed_chunks_keeps_categories(self):
+        chunks = [
+            pd.DataFrame({'user_name': pd.Series(['User1', 'User2'], dtype='category')}),
+            pd.DataFrame({'user_name': pd.Series(['User3'], dtype='category')}),
+        ]
+
+        self.assertEqual(pd.concat(chunks)['user_name'].dtype, np.dtype('object'))
+        concatenated = concat_typed_chunks(chunks)
+        self.assertIsInstance(concatenated['user_name'].dtype, pd.CategoricalDtype)
+        self.assertEqual(concatenated['user_name'].tolist(), ['User1', 'User2', 'User3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+from exceptions.report_gen_exceptions import DataTypeOverflow
+from pandas.api.types import union_categoricals
+from typing import Dict, List, Tuple
+import logging
+import numpy as np
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+INTEGER_DTYPES = ['int8', 'int16', 'int32', 'int64']
+
+# The other dtypes a typed schema can ask for, next to the (nullable, when capitalised) integer ones.
+CATEGORY = 'category'
+DATE = 'date'
+
+
+def get_integer_dtype(minimum: int, maximum: int, smallest_dtype: str = 'int8') -> str:
+    """
+    Returns the smallest integer dtype, starting from smallest_dtype, that holds every value between minimum and maximum.
+
+    Args:
+        minimum: int: Smallest value to hold
+        maximum: int: Largest value to hold
+        smallest_dtype: str: The dtype to start from
+
+    Returns:
+        The numpy name of the dtype
+    """
+    for dtype in INTEGER_DTYPES[INTEGER_DTYPES.index(smallest_dtype):]:
+        dtype_info = np.iinfo(dtype)
+        if dtype_info.min <= minimum and maximum <= dtype_info.max:
+            return dtype
+    raise DataTypeOverflow(f'No integer type holds values between {minimum} and {maximum}.')
+
+
+def downcast_integers(
+        series: pd.Series,
+        dtype: str = 'int8',
+        on_overflow: str = 'widen',
+        nullable: bool = False
+) -> pd.Series:
+    """
+    Casts a column of integers to `dtype`, after checking every value fits in it. Unlike astype, values that
+    don't fit never wrap around: the column is widened to the next integer type that holds them, or, with
+    on_overflow='raise', DataTypeOverflow is raised.
+
+    Args:
+        series: pd.Series: The column to cast
+        dtype: str: The integer dtype to cast to, like int8
+        on_overflow: str: What to do when the values don't fit, `widen` or `raise`
+        nullable: bool: Cast to the nullable (pandas) integer type, which keeps missing values without turning into floats.
+            Columns with missing values are always cast to the nullable type.
+
+    Returns:
+        The cast column
+    """
+    values = series.dropna()
+    target_dtype = dtype
+    if not values.empty:
+        minimum, maximum = int(values.min()), int(values.max())
+        target_dtype = get_integer_dtype(minimum, maximum, dtype)
+        if target_dtype != dtype:
+            if on_overflow == 'raise':
+                raise DataTypeOverflow(f'{series.name} has values between {minimum} and {maximum}, which do not fit in {dtype}.')
+            logger.warning(f'{series.name} has values between {minimum} and {maximum}, widened from {dtype} to {target_dtype}.')
+
+    if nullable or len(values) < len(series):
+        target_dtype = target_dtype.capitalize()
+    return series.astype(target_dtype)
+
+
+def apply_typed_schema(df: pd.DataFrame, schema: Dict[str, str], on_overflow: str = 'widen') -> Tuple[pd.DataFrame, int]:
+    """
+    Casts the columns of a dataframe to the compact dtypes of a typed schema. Columns missing from the dataframe
+    are skipped, so the same schema can be applied to every query that makes up a report.
+
+    The schema maps a column to one of:
+    - an integer dtype (int8 ... int64), range checked with downcast_integers. Capitalised (Int8 ...) for nullable.
+    - `category`, for strings that repeat.
+    - `date`, for dates, stored as datetime64 instead of datetime.date objects.
+
+    Args:
+        df: pd.DataFrame: The dataframe
+        schema: Dict[str, str]: The dtype of every column
+        on_overflow: str: What to do when integers don't fit their dtype, `widen` or `raise`
+
+    Returns:
+        The cast dataframe, and the number of bytes it saved
+    """
+    memory_before = df.memory_usage(index=False, deep=True).sum()
+    columns = {}
+    for column, dtype in schema.items():
+        if column not in df.columns:
+            continue
+        if dtype == CATEGORY:
+            columns[column] = df[column].astype('category')
+        elif dtype == DATE:
+            columns[column] = pd.to_datetime(df[column])
+        elif dtype.lower() in INTEGER_DTYPES:
+            columns[column] = downcast_integers(df[column], dtype.lower(), on_overflow, nullable=dtype[0].isupper())
+        else:
+            raise ValueError(f'Unknown typed schema dtype: {dtype}')
+
+    df = df.assign(**columns)
+    memory_saved = int(memory_before - df.memory_usage(index=False, deep=True).sum())
+    return df, memory_saved
+
+
+def concat_typed_chunks(df_list: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatenates dataframe chunks, keeping their categorical columns categorical. pd.concat falls back to
+    object columns as soon as two chunks have different categories, so the chunks first get the union of them.
+
+    Args:
+        df_list: List[pd.DataFrame]: The chunks, with the same columns
+
+    Returns:
+        The concatenated dataframe
+    """
+    categorical_columns = [
+        column for column, dtype in df_list[0].dtypes.items() if isinstance(dtype, pd.CategoricalDtype)
+    ]
+    for column in categorical_columns:
+        categories = union_categoricals([df[column] for df in df_list]).categories
+        df_list = [df.assign(**{column: df[column].cat.set_categories(categories)}) for df in df_list]
+
+    return pd.concat(df_list, ignore_index=True)
@@ -1,7 +1,13 @@
 import boto3
+import hashlib
+import io
 import logging
+import queue
+import threading
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
 from config import settings
-from typing import Dict
+from typing import Dict, Iterable, List, Optional, Union
 from botocore.exceptions import (
     ParamValidationError,
     ClientError
@@ -9,31 +15,153 @@ from botocore.exceptions import (
 import botocore
 from exceptions.report_gen_exceptions import (
     UploadFailure,
+    DownloadFailure,
     S3ClientCreationError
 )
 
 
 logger = logging.getLogger(__name__)
 
+# S3 rejects multipart uploads where any part, other than the last one, is smaller than 5 MiB.
+MIN_MULTIPART_PART_SIZE = 5 * 1024 * 1024
 
-def save(file_to_upload: str, bucket_name: str, object_key: str, metadata: Dict) -> str:
+# Object metadata holding the SHA-256 of the uploaded content, to skip uploading the same content again.
+CONTENT_HASH_METADATA_KEY = 'content-sha256'
+
+# boto3 clients are thread safe, so the whole process shares one, along with its connection pool.
+_s3_clients: List[boto3.client] = []
+_s3_client_lock = threading.Lock()
+
+
+def save(
+        file_to_upload: Union[str, bytes],
+        bucket_name: str,
+        object_key: str,
+        metadata: Dict,
+        extra_args: Optional[Dict] = None,
+        s3_client: Optional[boto3.client] = None
+) -> str:
     """
     The save function calls the s3 client creation, and then calls the upload function.
 
     Args:
-        file_to_upload: str: File as a string object.
+        file_to_upload: Union[str, bytes]: File as a string or bytes object.
+        bucket_name: str: S3 Bucket name where the file will be uploaded.
+        object_key: str: File name to be uploaded.
+        metadata: Dict: Metadata for the s3 object.
+        extra_args: Optional[Dict]: Extra object headers, like ContentType and ContentEncoding.
+        s3_client: Optional[boto3.client]: An existing S3 client to reuse. The shared client is used if not passed.
+
+    Returns:
+        A pre-signed direct download link for the uploaded file.
+    """
+    if s3_client is None:
+        s3_client = get_s3_client()
+    download_link = upload_to_s3(
+        s3_client,
+        file_to_upload,
+        bucket_name,
+        object_key,
+        metadata,
+        extra_args,
+        transfer_config=get_transfer_config(),
+        skip_unchanged=settings.s3_skip_unchanged_uploads
+    )
+    return download_link
+
+
+def save_stream(
+        file_parts: Iterable[Union[str, bytes]],
+        bucket_name: str,
+        object_key: str,
+        metadata: Dict,
+        extra_args: Optional[Dict] = None,
+        s3_client: Optional[boto3.client] = None
+) -> str:
+    """
+    The save_stream function calls the s3 client creation, and then streams the file parts to S3
+    as a multipart upload.
+
+    Args:
+        file_parts: Iterable[Union[str, bytes]]: The file, as consecutive pieces in the order they should be written.
         bucket_name: str: S3 Bucket name where the file will be uploaded.
         object_key: str: File name to be uploaded.
         metadata: Dict: Metadata for the s3 object.
+        extra_args: Optional[Dict]: Extra object headers, like ContentType and ContentEncoding.
+        s3_client: Optional[boto3.client]: An existing S3 client to reuse. The shared client is used if not passed.
 
     Returns:
         A pre-signed direct download link for the uploaded file.
     """
-    s3_client = create_s3_client()
-    download_link = upload_to_s3(s3_client, file_to_upload, bucket_name, object_key, metadata)
+    if s3_client is None:
+        s3_client = get_s3_client()
+    download_link = upload_stream_to_s3(
+        s3_client,
+        file_parts,
+        bucket_name,
+        object_key,
+        metadata,
+        extra_args=extra_args,
+        part_size=settings.s3_multipart_part_size,
+        max_pending_parts=settings.s3_max_pending_parts,
+        upload_concurrency=settings.s3_transfer_concurrency
+    )
     return download_link
 
 
+def get_download_link_if_exists(
+        bucket_name: str,
+        object_key: str,
+        s3_client: Optional[boto3.client] = None
+) -> Optional[str]:
+    """
+    Generates a fresh pre-signed download link for a file that was uploaded earlier,
+    after checking that the file is still on S3.
+
+    Args:
+        bucket_name: str: S3 bucket where the file should be present.
+        object_key: str: Filename of the file for which the link will be generated.
+        s3_client: Optional[boto3.client]: An existing S3 client to reuse. The shared client is used if not passed.
+
+    Returns:
+        A pre-signed direct download link, or None if the file is not on S3 (anymore).
+    """
+    if s3_client is None:
+        s3_client = get_s3_client()
+    try:
+        s3_client.head_object(Bucket=bucket_name, Key=object_key)
+    except ClientError as e:
+        # A missing object comes back as a plain 404, HEAD responses have no error body.
+        if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey', 'NotFound'):
+            logger.warning(f'Failed to check {object_key} on S3. Details: {str(e)}')
+        return None
+
+    return get_s3_download_link(s3_client, bucket_name, object_key)
+
+
+def download(bucket_name: str, object_key: str, s3_client: Optional[boto3.client] = None) -> bytes:
+    """
+    Downloads a file that was uploaded earlier, like the base of a delta report.
+
+    Args:
+        bucket_name: str: S3 bucket where the file should be present.
+        object_key: str: Filename of the file to download.
+        s3_client: Optional[boto3.client]: An existing S3 client to reuse. The shared client is used if not passed.
+
+    Returns:
+        The content of the file.
+    """
+    if s3_client is None:
+        s3_client = get_s3_client()
+    downloaded = io.BytesIO()
+    try:
+        s3_client.download_fileobj(bucket_name, object_key, downloaded, Config=get_transfer_config())
+    except ClientError as e:
+        logger.error(f'Failed to download s3://{bucket_name}/{object_key}. Details: {str(e)}')
+        raise DownloadFailure(f'Failed to download the file from S3. Details: {str(e)}')
+    return downloaded.getvalue()
+
+
 # TODO: This is not the best way to connect to AWS services (using the access_key and key_id)
 # But this is the only setup I have ATM on my local machine.
 # If using AWS IAM role that are preconfigured, the function will remain mostly the same,
@@ -52,7 +180,8 @@ def create_s3_client():
             aws_secret_access_key=settings.aws_secret_access_key,
             config=boto3.session.Config(
                 s3={'addressing_style': 'path'},
-                signature_version='s3v4'
+                signature_version='s3v4',
+                max_pool_connections=settings.s3_max_pool_connections
             ),
             region_name=settings.region_name
         )
@@ -66,41 +195,117 @@ def create_s3_client():
         return s3
 
 
+def get_s3_client() -> boto3.client:
+    """
+    Returns the S3 client shared by the whole process, creating it the first time.
+    Reusing it saves the client setup (and the TLS handshakes of its pooled connections) on every upload.
+
+    Returns:
+        The shared s3 client.
+    """
+    if not _s3_clients:
+        with _s3_client_lock:
+            if not _s3_clients:
+                _s3_clients.append(create_s3_client())
+    return _s3_clients[0]
+
+
+def reset_s3_client():
+    """
+    Drops the shared S3 client, the next get_s3_client creates a new one. For when the settings change.
+    """
+    with _s3_client_lock:
+        _s3_clients.clear()
+
+
+def get_transfer_config() -> TransferConfig:
+    """
+    Returns the transfer settings of the uploads: files larger than s3_multipart_part_size are uploaded
+    in parts of that size, s3_transfer_concurrency parts at a time.
+
+    Returns:
+        The boto3 TransferConfig.
+    """
+    return TransferConfig(
+        multipart_threshold=settings.s3_multipart_part_size,
+        multipart_chunksize=settings.s3_multipart_part_size,
+        max_concurrency=settings.s3_transfer_concurrency
+    )
+
+
+def get_content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def get_existing_content_hash(s3_client: boto3.client, bucket_name: str, object_key: str) -> Optional[str]:
+    """
+    Returns the content hash recorded on an object already on S3.
+
+    Args:
+        s3_client: boto3.client: The boto3 client to check with.
+        bucket_name: str: S3 bucket where the file should be present.
+        object_key: str: Filename of the file to check.
+
+    Returns:
+        The content hash, or None if the object is missing or was uploaded without one.
+    """
+    try:
+        response = s3_client.head_object(Bucket=bucket_name, Key=object_key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey', 'NotFound'):
+            logger.warning(f'Failed to check {object_key} on S3. Details: {str(e)}')
+        return None
+    return response.get('Metadata', {}).get(CONTENT_HASH_METADATA_KEY)
+
+
 def upload_to_s3(
         s3_client: boto3.client,
-        file_to_upload: str,
+        file_to_upload: Union[str, bytes],
         bucket_name: str,
         object_key: str,
-        metadata: Dict
+        metadata: Dict,
+        extra_args: Optional[Dict] = None,
+        transfer_config: Optional[TransferConfig] = None,
+        skip_unchanged: bool = False
 ) -> str:
     """
-    The upload_to_s3 function uploads a file to an S3 bucket.
+    The upload_to_s3 function uploads a file to an S3 bucket. The SHA-256 of the content is saved in the object
+    metadata, and with `skip_unchanged` set, the upload is skipped if the object already has the same content.
+    The object then keeps the metadata of the earlier upload.
 
     Args:
         s3_client: boto3.client: The boto3 client where the file needs to be uploaded.
-        file_to_upload: str: File as a string object.
+        file_to_upload: Union[str, bytes]: File as a string or bytes object.
         bucket_name: str: S3 Bucket name where the file will be uploaded.
         object_key: str: File name to be uploaded.
         metadata: Dict: Metadata for the s3 object.
+        extra_args: Optional[Dict]: Extra object headers, like ContentType and ContentEncoding.
+        transfer_config: Optional[TransferConfig]: Multipart threshold, part size and concurrency. boto3 defaults if not passed.
+        skip_unchanged: bool: Don't upload the file again if the object on S3 has the same content hash.
 
     Returns:
         A pre-signed direct download link for the uploaded file.
     """
-    # Create a new S3 Client.
-    # s3_client = create_s3_client()
+    if isinstance(file_to_upload, str):
+        file_to_upload = file_to_upload.encode('utf-8')
+    content_hash = get_content_hash(file_to_upload)
+    if skip_unchanged and get_existing_content_hash(s3_client, bucket_name, object_key) == content_hash:
+        logger.info(f's3://{bucket_name}/{object_key} already has the same content, skipping the upload.')
+        return get_s3_download_link(s3_client, bucket_name, object_key)
 
     # Try to upload the file in the specified S3.
     # If any of the Parameters passed cause an error, it will be caught by the ParamValidationError.
-    # If the Bucket name is wrong, it will be caught as ClientError.
+    # If the Bucket name is wrong, it will be caught as ClientError (S3UploadFailedError, for the multipart uploads).
     try:
-        s3_client.put_object(
-            Body=file_to_upload,
-            Bucket=bucket_name,
-            Key=object_key,
-            Metadata=metadata
+        s3_client.upload_fileobj(
+            io.BytesIO(file_to_upload),
+            bucket_name,
+            object_key,
+            ExtraArgs={'Metadata': {**metadata, CONTENT_HASH_METADATA_KEY: content_hash}, **(extra_args or {})},
+            Config=transfer_config
         )
         logger.debug(f"Report uploaded to S3: s3://{bucket_name}/{object_key}")
-    except ClientError as e:
+    except (ClientError, S3UploadFailedError) as e:
         logger.error(f'Failed to connect to the S3 bucket. Details: {str(e)}')
         raise UploadFailure(f'Failed to upload the file to S3. Details: {str(e)}')
     except ParamValidationError as e:
@@ -135,3 +340,131 @@ def get_s3_download_link(s3_client: boto3.client, bucket_name: str, object_key:
     )
 
     return url
+
+
+def upload_stream_to_s3(
+        s3_client: boto3.client,
+        file_parts: Iterable[Union[str, bytes]],
+        bucket_name: str,
+        object_key: str,
+        metadata: Dict,
+        extra_args: Optional[Dict] = None,
+        part_size: int = MIN_MULTIPART_PART_SIZE,
+        max_pending_parts: int = 4,
+        upload_concurrency: int = 1
+) -> str:
+    """
+    The upload_stream_to_s3 function uploads a file to an S3 bucket as a multipart upload, while the file is
+    still being produced. The pieces are buffered until there is a full part, which is then handed over to
+    `upload_concurrency` background threads for the upload, so producing the next part overlaps with uploading
+    the previous ones.
+    At most `max_pending_parts` parts wait for the upload at any time, which keeps memory bounded.
+    If anything fails, the multipart upload is aborted so no partial object or orphaned parts are left behind.
+
+    Args:
+        s3_client: boto3.client: The boto3 client where the file needs to be uploaded.
+        file_parts: Iterable[Union[str, bytes]]: The file, as consecutive pieces in the order they should be written.
+        bucket_name: str: S3 Bucket name where the file will be uploaded.
+        object_key: str: File name to be uploaded.
+        metadata: Dict: Metadata for the s3 object.
+        extra_args: Optional[Dict]: Extra object headers, like ContentType and ContentEncoding.
+        part_size: int: Size of every uploaded part, except the last one. Minimum 5 MiB.
+        max_pending_parts: int: Number of full parts that can wait for the upload before the producer is blocked.
+        upload_concurrency: int: Number of parts uploaded at the same time.
+
+    Returns:
+        A pre-signed direct download link for the uploaded file.
+    """
+    if part_size < MIN_MULTIPART_PART_SIZE:
+        raise ValueError(f'Multipart part size should be at least {MIN_MULTIPART_PART_SIZE} bytes.')
+
+    try:
+        upload_id = s3_client.create_multipart_upload(
+            Bucket=bucket_name,
+            Key=object_key,
+            Metadata=metadata,
+            **(extra_args or {})
+        )['UploadId']
+    except ClientError as e:
+        logger.error(f'Failed to connect to the S3 bucket. Details: {str(e)}')
+        raise UploadFailure(f'Failed to upload the file to S3. Details: {str(e)}')
+    except ParamValidationError as e:
+        logger.exception(f'Upload to AWS failed because of invalid Parameters passed.\nDetails: {str(e)}')
+        raise UploadFailure(f'Upload to AWS failed, because invalid Parameters were passed.\nDetails: {str(e)}')
+
+    pending_parts = queue.Queue(maxsize=max_pending_parts)
+    uploaded_parts = []
+    upload_errors = []
+
+    # The uploader keeps draining the queue even after a failure, so the producer can never block on a full queue.
+    def upload_pending_parts():
+        while True:
+            pending_part = pending_parts.get()
+            if pending_part is None:
+                return
+            if upload_errors:
+                continue
+            part_number, body = pending_part
+            try:
+                response = s3_client.upload_part(
+                    Body=body,
+                    Bucket=bucket_name,
+                    Key=object_key,
+                    PartNumber=part_number,
+                    UploadId=upload_id
+                )
+                uploaded_parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+            except Exception as e:
+                upload_errors.append(e)
+
+    uploaders = [
+        threading.Thread(target=upload_pending_parts, daemon=True)
+        for _ in range(max(1, upload_concurrency))
+    ]
+    for uploader in uploaders:
+        uploader.start()
+
+    buffer = bytearray()
+    part_number = 0
+    try:
+        try:
+            for file_part in file_parts:
+                if upload_errors:
+                    break
+                buffer += file_part.encode('utf-8') if isinstance(file_part, str) else file_part
+                while len(buffer) >= part_size:
+                    part_number += 1
+                    pending_parts.put((part_number, bytes(buffer[:part_size])))
+                    del buffer[:part_size]
+
+            # The last part can be smaller than the part size, and S3 needs at least one part.
+            if buffer or part_number == 0:
+                part_number += 1
+                pending_parts.put((part_number, bytes(buffer)))
+        finally:
+            # One end marker per uploader.
+            for uploader in uploaders:
+                pending_parts.put(None)
+            for uploader in uploaders:
+                uploader.join()
+
+        if upload_errors:
+            raise upload_errors[0]
+
+        s3_client.complete_multipart_upload(
+            Bucket=bucket_name,
+            Key=object_key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': sorted(uploaded_parts, key=lambda part: part['PartNumber'])}
+        )
+        logger.debug(f"Report uploaded to S3 in {part_number} parts: s3://{bucket_name}/{object_key}")
+    except BaseException as e:
+        s3_client.abort_multipart_upload(Bucket=bucket_name, Key=object_key, UploadId=upload_id)
+        if isinstance(e, (ClientError, ParamValidationError)):
+            logger.error(f'Failed to upload the file to S3. Details: {str(e)}')
+            raise UploadFailure(f'Failed to upload the file to S3. Details: {str(e)}')
+        raise
+
+    # Generate a direct download link for the uploaded report.
+    download_link = get_s3_download_link(s3_client, bucket_name, object_key)
+    return download_link
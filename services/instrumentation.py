@@ -0,0 +1,349 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, TypeVar
+import json
+import logging
+import os
+import resource
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# The metrics of the report being generated in the current thread (or task).
+# Worker threads don't inherit it by themselves, they have to run in a copy of the caller's context.
+_current_metrics: ContextVar[Optional['ReportMetrics']] = ContextVar('report_metrics', default=None)
+
+MEGABYTE = 1024 * 1024
+
+
+def current_rss_bytes() -> int:
+    """
+    Returns the resident memory of the process. Falls back to the peak resident memory where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@dataclass
+class StageRecord:
+    """
+    One run of a stage of the report. Stages can nest, so the duration of a stage includes its nested stages.
+    """
+    name: str
+    chunk: Optional[int] = None
+    rows: Optional[int] = None
+    bytes: Optional[int] = None
+    memory_saved_bytes: Optional[int] = None
+    started_at: float = 0.0
+    duration_seconds: float = 0.0
+    peak_memory_bytes: int = 0
+
+
+@dataclass
+class ReportMetrics:
+    """
+    Collects the stages of a single report, and samples the memory of the process while the report runs.
+    Safe to record into from several threads.
+    """
+    report_type: str
+    sample_interval: float = 0.01
+    outcome: str = 'generated'
+    stages: List[StageRecord] = field(default_factory=list)
+    started_at: float = 0.0
+    duration_seconds: float = 0.0
+    baseline_memory_bytes: int = 0
+    peak_memory_bytes: int = 0
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self._active: List[StageRecord] = []
+        self._stop_sampling = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_memory, name='report-metrics', daemon=True)
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self.baseline_memory_bytes = self.peak_memory_bytes = current_rss_bytes()
+        self._sampler.start()
+
+    def stop(self):
+        self._stop_sampling.set()
+        self._sampler.join()
+        self._observe_memory()
+        self.duration_seconds = time.perf_counter() - self.started_at
+
+    def begin(self, record: StageRecord):
+        record.started_at = time.perf_counter()
+        with self._lock:
+            self._active.append(record)
+        self._observe_memory()
+
+    def end(self, record: StageRecord):
+        self._observe_memory()
+        record.duration_seconds = time.perf_counter() - record.started_at
+        with self._lock:
+            self._active.remove(record)
+            self.stages.append(record)
+        logger.debug(json.dumps({
+            'event': 'report_stage',
+            'report_type': self.report_type,
+            'stage': record.name,
+            'chunk': record.chunk,
+            'duration_seconds': round(record.duration_seconds, 6),
+            'rows': record.rows,
+            'bytes': record.bytes,
+            'memory_saved_bytes': record.memory_saved_bytes,
+            'peak_memory_mb': round(self._memory_increase_mb(record.peak_memory_bytes), 2),
+        }))
+
+    def add_stages(self, records: List[StageRecord]):
+        """
+        Adds the stages recorded by another process, like a worker process fetching a shard of the report.
+        Their memory is the memory of that process, so it is not counted towards the memory of this report.
+        """
+        with self._lock:
+            self.stages.extend(replace(record, peak_memory_bytes=0) for record in records)
+
+    def discard(self, record: StageRecord):
+        with self._lock:
+            self._active.remove(record)
+
+    def _sample_memory(self):
+        while not self._stop_sampling.wait(self.sample_interval):
+            self._observe_memory()
+
+    def _observe_memory(self):
+        rss = current_rss_bytes()
+        with self._lock:
+            self.peak_memory_bytes = max(self.peak_memory_bytes, rss)
+            for record in self._active:
+                record.peak_memory_bytes = max(record.peak_memory_bytes, rss)
+
+    def _memory_increase_mb(self, memory_bytes: int) -> float:
+        return max(0, memory_bytes - self.baseline_memory_bytes) / MEGABYTE
+
+    def summary(self) -> Dict:
+        """
+        Aggregates the stages by name. The memory figures are the increase over the memory in use when the
+        report started, and the durations of chunked stages are summed, even if the chunks ran concurrently.
+
+        Returns:
+            The summary, ready to be dumped as json.
+        """
+        duration_seconds = self.duration_seconds or time.perf_counter() - self.started_at
+        with self._lock:
+            stages = list(self.stages)
+
+        stage_summaries = {}
+        for record in stages:
+            stage_summary = stage_summaries.setdefault(record.name, {
+                'count': 0,
+                'duration_seconds': 0.0,
+                'max_duration_seconds': 0.0,
+                'rows': None,
+                'bytes': None,
+                'memory_saved_bytes': None,
+                'peak_memory_mb': 0.0,
+            })
+            stage_summary['count'] += 1
+            stage_summary['duration_seconds'] += record.duration_seconds
+            stage_summary['max_duration_seconds'] = max(stage_summary['max_duration_seconds'], record.duration_seconds)
+            for counter in ('rows', 'bytes', 'memory_saved_bytes'):
+                if getattr(record, counter) is not None:
+                    stage_summary[counter] = (stage_summary[counter] or 0) + getattr(record, counter)
+            stage_summary['peak_memory_mb'] = max(
+                stage_summary['peak_memory_mb'],
+                self._memory_increase_mb(record.peak_memory_bytes)
+            )
+
+        for stage_summary in stage_summaries.values():
+            for measure in ('duration_seconds', 'max_duration_seconds'):
+                stage_summary[measure] = round(stage_summary[measure], 6)
+            stage_summary['peak_memory_mb'] = round(stage_summary['peak_memory_mb'], 2)
+
+        return {
+            'report_type': self.report_type,
+            'outcome': self.outcome,
+            'duration_seconds': round(duration_seconds, 6),
+            'peak_memory_mb': round(self._memory_increase_mb(self.peak_memory_bytes), 2),
+            'stages': stage_summaries,
+        }
+
+
+def get_current_metrics() -> Optional[ReportMetrics]:
+    return _current_metrics.get()
+
+
+@contextmanager
+def record_report(
+        report_type: str,
+        sample_interval: float = 0.01,
+        textfile_dir: Optional[str] = None
+) -> Iterator[ReportMetrics]:
+    """
+    Records the stages of a report generated in the block. Once the block is done, the summary is logged
+    as json, and written as a Prometheus textfile (for the node exporter textfile collector) to textfile_dir.
+
+    Args:
+        report_type: str: Type of the report being generated.
+        sample_interval: float: Seconds between two samples of the memory in use.
+        textfile_dir: Optional[str]: Directory to write the Prometheus textfile to. Not written if not passed.
+
+    Returns:
+        The metrics of the report, which keep filling in until the block is done.
+    """
+    metrics = ReportMetrics(report_type, sample_interval=sample_interval)
+    token = _current_metrics.set(metrics)
+    metrics.start()
+    try:
+        yield metrics
+    except BaseException:
+        metrics.outcome = 'failed'
+        raise
+    finally:
+        metrics.stop()
+        _current_metrics.reset(token)
+        summary = metrics.summary()
+        logger.info(json.dumps({'event': 'report_metrics', **summary}))
+        if textfile_dir:
+            try:
+                write_prometheus_textfile(summary, Path(textfile_dir))
+            except OSError as e:
+                logger.warning(f'Failed to write the Prometheus textfile. Details: {str(e)}')
+
+
+@contextmanager
+def record_stages(report_type: str) -> Iterator[ReportMetrics]:
+    """
+    Records the stages run in the block, without sampling the memory or logging a summary. For the stages
+    a worker process runs for a report, which are sent back and added to the report with ReportMetrics.add_stages.
+
+    Args:
+        report_type: str: Type of the report being generated.
+
+    Returns:
+        The metrics, with the stages recorded so far.
+    """
+    metrics = ReportMetrics(report_type)
+    token = _current_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current_metrics.reset(token)
+
+
+@contextmanager
+def stage(name: str, chunk: Optional[int] = None, rows: Optional[int] = None) -> Iterator[StageRecord]:
+    """
+    Times a stage of the report being recorded. The rows and bytes the stage handled can be set on the
+    yielded record, once they are known. Outside of record_report, nothing is recorded.
+
+    Args:
+        name: str: Name of the stage.
+        chunk: Optional[int]: Number of the chunk, for stages that run once per chunk.
+        rows: Optional[int]: Number of rows the stage handled, if known up front.
+
+    Returns:
+        The record of the stage.
+    """
+    record = StageRecord(name, chunk=chunk, rows=rows)
+    metrics = _current_metrics.get()
+    if metrics is None:
+        yield record
+        return
+
+    metrics.begin(record)
+    try:
+        yield record
+    finally:
+        metrics.end(record)
+
+
+def iter_stage(name: str, items: Iterable[T]) -> Iterator[T]:
+    """
+    Records pulling every item out of `items` as a chunk of a stage, with the rows (or, for str and bytes
+    items, the bytes) of the item.
+
+    Args:
+        name: str: Name of the stage.
+        items: Iterable[T]: The chunks, like the dataframes read from a database.
+
+    Returns:
+        An iterator over the same items.
+    """
+    metrics = _current_metrics.get()
+    if metrics is None:
+        yield from items
+        return
+
+    iterator = iter(items)
+    chunk = 0
+    while True:
+        record = StageRecord(name, chunk=chunk)
+        metrics.begin(record)
+        try:
+            item = next(iterator)
+        except StopIteration:
+            metrics.discard(record)
+            return
+        except BaseException:
+            metrics.end(record)
+            raise
+        if isinstance(item, (bytes, str)):
+            record.bytes = len(item)
+        else:
+            record.rows = len(item)
+        metrics.end(record)
+        yield item
+        chunk += 1
+
+
+def write_prometheus_textfile(summary: Dict, textfile_dir: Path):
+    """
+    Writes the summary of a report as a Prometheus textfile, replacing the one of the previous run of the same
+    report type. The file is written next to its final name and then renamed, so the collector never reads half of it.
+
+    Args:
+        summary: Dict: The summary of ReportMetrics.
+        textfile_dir: Path: Directory read by the textfile collector.
+    """
+    report_type = summary['report_type']
+    labels = f'report_type="{report_type}",outcome="{summary["outcome"]}"'
+    lines = [
+        '# HELP report_generation_duration_seconds Wall time of the last run of the report.',
+        '# TYPE report_generation_duration_seconds gauge',
+        f'report_generation_duration_seconds{{{labels}}} {summary["duration_seconds"]}',
+        '# HELP report_generation_peak_memory_bytes Peak memory increase during the last run of the report.',
+        '# TYPE report_generation_peak_memory_bytes gauge',
+        f'report_generation_peak_memory_bytes{{{labels}}} {int(summary["peak_memory_mb"] * MEGABYTE)}',
+        '# HELP report_generation_last_run_timestamp_seconds When the last run of the report finished.',
+        '# TYPE report_generation_last_run_timestamp_seconds gauge',
+        f'report_generation_last_run_timestamp_seconds{{{labels}}} {int(time.time())}',
+    ]
+
+    stage_metrics = (
+        ('report_stage_duration_seconds', 'duration_seconds', 'Time spent in a stage of the last run of the report.'),
+        ('report_stage_runs', 'count', 'Number of times (chunks) a stage ran in the last run of the report.'),
+        ('report_stage_rows', 'rows', 'Rows handled by a stage in the last run of the report.'),
+        ('report_stage_bytes', 'bytes', 'Bytes handled by a stage in the last run of the report.'),
+    )
+    for metric_name, key, description in stage_metrics:
+        lines.append(f'# HELP {metric_name} {description}')
+        lines.append(f'# TYPE {metric_name} gauge')
+        for stage_name, stage_summary in summary['stages'].items():
+            if stage_summary[key] is not None:
+                lines.append(f'{metric_name}{{{labels},stage="{stage_name}"}} {stage_summary[key]}')
+
+    textfile_dir.mkdir(parents=True, exist_ok=True)
+    textfile = textfile_dir / f'report_generator_{report_type}.prom'
+    temporary_file = textfile.with_suffix(f'.prom.{os.getpid()}.tmp')
+    temporary_file.write_text('\n'.join(lines) + '\n')
+    os.replace(temporary_file, textfile)
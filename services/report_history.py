@@ -0,0 +1,197 @@
+from database.models import ReportsGenerated
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import Session
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Iterable, List, Optional
+from uuid import UUID
+import json
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# Newest first. The reports of the same day are ordered by when they were saved, the random report_id only breaks ties.
+NEWEST_FIRST = (ReportsGenerated.report_date.desc(), ReportsGenerated.created_at.desc(), ReportsGenerated.report_id.desc())
+
+
+def get_report_parameters(**parameters) -> str:
+    """
+    Builds the canonical form of the options a report was generated with, so two requests for the
+    same report always end up with the exact same string, whatever order the options came in.
+
+    Args:
+        **parameters: The options that change the content of the report, like report_format.
+
+    Returns:
+        The options as a JSON string, with sorted keys and no whitespace.
+    """
+    return json.dumps(parameters, sort_keys=True, separators=(',', ':'))
+
+
+def find_existing_report(
+        session: Session,
+        report_type: str,
+        report_date: date,
+        report_parameters: str
+) -> Optional[ReportsGenerated]:
+    """
+    Looks up a report of the same type, generated on the same day with the same options, the latest one if there are several.
+
+    Args:
+        session: Session: A SqlAlchemy session object.
+        report_type: str: Type of the report, one of the ValidReports values.
+        report_date: date: The day the report was generated.
+        report_parameters: str: The options of the report, as built by get_report_parameters.
+
+    Returns:
+        The details of the existing report, or None if it was not generated yet.
+    """
+    existing_report = session.scalars(
+        select(ReportsGenerated)
+        .where(
+            ReportsGenerated.report_type == report_type,
+            ReportsGenerated.report_date == report_date,
+            ReportsGenerated.report_parameters == report_parameters
+        )
+        .order_by(*NEWEST_FIRST)
+        .limit(1)
+    ).first()
+
+    if existing_report is not None:
+        logger.debug(f'Found an existing {report_type} report for {report_date}.\nReport ID: {existing_report.report_id}')
+    return existing_report
+
+
+def find_delta_base(
+        session: Session,
+        report_type: str,
+        report_format: str,
+        report_date: date,
+        max_age_days: int
+) -> Optional[ReportsGenerated]:
+    """
+    Looks up the latest full report (not a delta) of a type and format, to generate a delta report against.
+
+    Args:
+        session: Session: A SqlAlchemy session object.
+        report_type: str: Type of the report, one of the ValidReports values.
+        report_format: str: Format of the report, one of the ReportFormat values.
+        report_date: date: The day of the delta report.
+        max_age_days: int: Only full reports generated up to this many days before report_date.
+
+    Returns:
+        The details of the base report, or None if there is no recent enough full report.
+    """
+    return session.scalars(
+        select(ReportsGenerated)
+        .where(
+            ReportsGenerated.report_type == report_type,
+            ReportsGenerated.report_format == report_format,
+            ReportsGenerated.base_report_id.is_(None),
+            ReportsGenerated.report_date.between(report_date - timedelta(days=max_age_days), report_date)
+        )
+        .order_by(*NEWEST_FIRST)
+        .limit(1)
+    ).first()
+
+
+@dataclass
+class ReportPage:
+    """
+    A page of the report history. Pass `next_cursor` to get the next page, it is None on the last page.
+    """
+    reports: List[ReportsGenerated]
+    next_cursor: Optional[str] = None
+
+
+def get_latest_reports(session: Session, report_types: Iterable[str]) -> List[ReportsGenerated]:
+    """
+    Looks up the latest report of every type. One query per type, each reading the last entry of
+    the (report_type, report_date, created_at) index, instead of scanning all the history for the newest rows.
+
+    Args:
+        session: Session: A SqlAlchemy session object.
+        report_types: Iterable[str]: The types of the reports, ValidReports values.
+
+    Returns:
+        The latest report of every type that was ever generated, in the order of report_types.
+    """
+    latest_reports = []
+    for report_type in report_types:
+        latest_report = session.scalars(
+            select(ReportsGenerated)
+            .where(ReportsGenerated.report_type == report_type)
+            .order_by(*NEWEST_FIRST)
+            .limit(1)
+        ).first()
+        if latest_report is not None:
+            latest_reports.append(latest_report)
+    return latest_reports
+
+
+def get_reports_between(
+        session: Session,
+        start_date: date,
+        end_date: date,
+        report_type: Optional[str] = None,
+        page_size: int = 100,
+        cursor: Optional[str] = None
+) -> ReportPage:
+    """
+    Looks up the reports generated between two days (both included), newest first, one page at a time.
+    The pages are read by keyset on (report_date, created_at, report_id), so every page is a range scan of the index,
+    however deep into the history it is.
+
+    Args:
+        session: Session: A SqlAlchemy session object.
+        start_date: date: First day of the range.
+        end_date: date: Last day of the range.
+        report_type: Optional[str]: Only the reports of this type. All the types if not passed.
+        page_size: int: Number of reports per page.
+        cursor: Optional[str]: The next_cursor of the previous page, None for the first page.
+
+    Returns:
+        The page of reports.
+    """
+    if page_size < 1:
+        raise ValueError('The page size should be at least 1.')
+
+    query = select(ReportsGenerated).where(ReportsGenerated.report_date.between(start_date, end_date))
+    if report_type is not None:
+        query = query.where(ReportsGenerated.report_type == report_type)
+    if cursor is not None:
+        cursor_date, cursor_created_at, cursor_report_id = _parse_cursor(cursor)
+        query = query.where(or_(
+            ReportsGenerated.report_date < cursor_date,
+            and_(ReportsGenerated.report_date == cursor_date, ReportsGenerated.created_at < cursor_created_at),
+            and_(
+                ReportsGenerated.report_date == cursor_date,
+                ReportsGenerated.created_at == cursor_created_at,
+                ReportsGenerated.report_id < cursor_report_id
+            )
+        ))
+
+    # One more than the page, to know if there is a next page.
+    reports = session.scalars(
+        query
+        .order_by(*NEWEST_FIRST)
+        .limit(page_size + 1)
+    ).all()
+    if len(reports) <= page_size:
+        return ReportPage(list(reports))
+
+    reports = list(reports[:page_size])
+    last_report = reports[-1]
+    return ReportPage(
+        reports,
+        f'{last_report.report_date.isoformat()}/{last_report.created_at.isoformat()}/{last_report.report_id}'
+    )
+
+
+def _parse_cursor(cursor: str):
+    try:
+        cursor_date, cursor_created_at, cursor_report_id = cursor.split('/')
+        return date.fromisoformat(cursor_date), datetime.fromisoformat(cursor_created_at), UUID(cursor_report_id)
+    except ValueError:
+        raise ValueError(f'Invalid report history cursor: {cursor}')
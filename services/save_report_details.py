@@ -1,7 +1,8 @@
 from database.models import ReportsGenerated
 from exceptions.report_gen_exceptions import DataSaveFailure
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
-from typing import Dict
+from typing import Dict, List
 import logging
 import sys
 
@@ -41,3 +42,33 @@ def save_to_db(session: Session, report_attributes: Dict, download_link: str) ->
     finally:
         session.close()
     return True
+
+
+def save_many_to_db(session: Session, reports_details: List[Dict]) -> int:
+    """
+    Saves the details of several reports in one transaction, with a single multi-row insert,
+    instead of a transaction per report.
+
+    Args:
+        session: Session: A SqlAlchemy session object.
+        reports_details: List[Dict]: All details about every report, including its download_link.
+
+    Returns:
+        The number of reports saved.
+    """
+    if not reports_details:
+        session.close()
+        return 0
+
+    try:
+        session.execute(insert(ReportsGenerated), reports_details)
+        session.commit()
+    # Catching any DB errors while trying to write the report details.
+    except Exception as e:
+        logger.exception(f'Failed to save the details of {len(reports_details)} reports to the DB. Details : {str(e)}')
+        raise DataSaveFailure('Failed to save report details to the DB.')
+    else:
+        logger.debug(f'Details of {len(reports_details)} reports saved to the DB.')
+    finally:
+        session.close()
+    return len(reports_details)
@@ -1,8 +1,20 @@
 import unittest
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 from moto import mock_s3
 import boto3
-from services.aws_s3 import upload_to_s3, create_s3_client, get_s3_download_link
+from boto3.s3.transfer import TransferConfig
+from services.aws_s3 import (
+    upload_to_s3,
+    upload_stream_to_s3,
+    create_s3_client,
+    get_s3_client,
+    reset_s3_client,
+    get_s3_download_link,
+    get_download_link_if_exists,
+    get_content_hash,
+    CONTENT_HASH_METADATA_KEY,
+    MIN_MULTIPART_PART_SIZE
+)
 
 
 class TestUploadToS3(unittest.TestCase):
@@ -30,6 +42,133 @@ class TestUploadToS3(unittest.TestCase):
         obj = conn.Object(bucket_name, object_key)
         uploaded_content = obj.get()["Body"].read().decode("utf-8")
         self.assertEqual(uploaded_content, file_content)
+        self.assertEqual(obj.metadata[CONTENT_HASH_METADATA_KEY], get_content_hash(file_content.encode("utf-8")))
+
+    @mock_s3
+    def test_unchanged_content_is_not_uploaded_again(self):
+        bucket_name = "test-bucket"
+        region_name = "ap-south-1"
+        conn = boto3.resource("s3", region_name=region_name)
+        conn.create_bucket(Bucket=bucket_name, CreateBucketConfiguration={'LocationConstraint': region_name})
+        client = conn.meta.client
+
+        upload_to_s3(client, b"report", bucket_name, "report.csv", {"report_id": "first"}, skip_unchanged=True)
+        with patch.object(client, "upload_fileobj", wraps=client.upload_fileobj) as spy_upload:
+            download_link = upload_to_s3(client, b"report", bucket_name, "report.csv", {"report_id": "second"}, skip_unchanged=True)
+            spy_upload.assert_not_called()
+            # The skipped upload keeps the object, with the metadata of the first upload.
+            self.assertEqual(conn.Object(bucket_name, "report.csv").metadata["report_id"], "first")
+            self.assertIn("report.csv", download_link)
+
+            upload_to_s3(client, b"new report", bucket_name, "report.csv", {"report_id": "third"}, skip_unchanged=True)
+            spy_upload.assert_called_once()
+            upload_to_s3(client, b"new report", bucket_name, "report.csv", {"report_id": "fourth"})
+            self.assertEqual(spy_upload.call_count, 2)
+
+        obj = conn.Object(bucket_name, "report.csv").get()
+        self.assertEqual(obj["Body"].read(), b"new report")
+        self.assertEqual(obj["Metadata"]["report_id"], "fourth")
+
+    @mock_s3
+    def test_large_upload_is_sent_in_parts(self):
+        bucket_name = "test-bucket"
+        region_name = "ap-south-1"
+        conn = boto3.resource("s3", region_name=region_name)
+        conn.create_bucket(Bucket=bucket_name, CreateBucketConfiguration={'LocationConstraint': region_name})
+        file_content = b"".join(bytes([piece]) * (1024 * 1024) for piece in range(12))
+        transfer_config = TransferConfig(
+            multipart_threshold=MIN_MULTIPART_PART_SIZE,
+            multipart_chunksize=MIN_MULTIPART_PART_SIZE,
+            max_concurrency=3
+        )
+
+        upload_to_s3(conn.meta.client, file_content, bucket_name, "report.csv", {"key1": "value1"}, transfer_config=transfer_config)
+
+        obj = conn.Object(bucket_name, "report.csv").get()
+        self.assertEqual(obj["Body"].read(), file_content)
+        self.assertEqual(obj["Metadata"], {"key1": "value1", CONTENT_HASH_METADATA_KEY: get_content_hash(file_content)})
+        self.assertTrue(obj["ETag"].endswith('-3"'))
+
+
+class TestUploadStreamToS3(unittest.TestCase):
+    bucket_name = "test-bucket"
+    object_key = "test-report.csv"
+    region_name = "ap-south-1"
+
+    def create_bucket(self):
+        conn = boto3.resource("s3", region_name=self.region_name)
+        conn.create_bucket(Bucket=self.bucket_name, CreateBucketConfiguration={'LocationConstraint': self.region_name})
+        return conn
+
+    @mock_s3
+    def test_upload_stream_to_s3_in_multiple_parts(self):
+        conn = self.create_bucket()
+
+        # 12 MiB of 1 MiB pieces, uploaded as 3 parts of 5 MiB, 5 MiB and 2 MiB.
+        file_parts = [str(piece) * (1024 * 1024) for piece in range(12)]
+
+        download_link = upload_stream_to_s3(
+            conn.meta.client,
+            iter(file_parts),
+            self.bucket_name,
+            self.object_key,
+            {"key1": "value1"},
+            part_size=MIN_MULTIPART_PART_SIZE,
+            max_pending_parts=1,
+            upload_concurrency=2
+        )
+
+        self.assertTrue(download_link.startswith(f"https://{self.bucket_name}.s3.amazonaws.com/{self.object_key}"))
+        obj = conn.Object(self.bucket_name, self.object_key).get()
+        self.assertEqual(obj["Body"].read().decode("utf-8"), "".join(file_parts))
+        self.assertEqual(obj["Metadata"], {"key1": "value1"})
+        self.assertTrue(obj["ETag"].endswith('-3"'))
+
+    @mock_s3
+    def test_upload_stream_to_s3_with_content_headers(self):
+        conn = self.create_bucket()
+
+        upload_stream_to_s3(
+            conn.meta.client,
+            iter([b"compressed report"]),
+            self.bucket_name,
+            self.object_key,
+            {},
+            extra_args={"ContentType": "text/csv", "ContentEncoding": "gzip"}
+        )
+
+        obj = conn.Object(self.bucket_name, self.object_key).get()
+        self.assertEqual(obj["ContentType"], "text/csv")
+        self.assertEqual(obj["ContentEncoding"], "gzip")
+
+    @mock_s3
+    def test_upload_stream_to_s3_empty_stream(self):
+        conn = self.create_bucket()
+
+        upload_stream_to_s3(conn.meta.client, iter([]), self.bucket_name, self.object_key, {})
+
+        uploaded_content = conn.Object(self.bucket_name, self.object_key).get()["Body"].read()
+        self.assertEqual(uploaded_content, b"")
+
+    @mock_s3
+    def test_upload_stream_to_s3_aborts_when_the_producer_fails(self):
+        conn = self.create_bucket()
+
+        def failing_parts():
+            yield "a" * MIN_MULTIPART_PART_SIZE
+            raise RuntimeError("Chunk fetch failed")
+
+        with self.assertRaises(RuntimeError):
+            upload_stream_to_s3(conn.meta.client, failing_parts(), self.bucket_name, self.object_key, {})
+
+        uploads = conn.meta.client.list_multipart_uploads(Bucket=self.bucket_name)
+        self.assertEqual(uploads.get("Uploads", []), [])
+        objects = conn.meta.client.list_objects_v2(Bucket=self.bucket_name)
+        self.assertEqual(objects["KeyCount"], 0)
+
+    def test_upload_stream_to_s3_rejects_small_parts(self):
+        with self.assertRaises(ValueError):
+            upload_stream_to_s3(MagicMock(), iter([]), self.bucket_name, self.object_key, {}, part_size=1024)
 
 
 class TestGetS3DownloadLink(unittest.TestCase):
@@ -57,5 +196,40 @@ class TestGetS3DownloadLink(unittest.TestCase):
         self.assertEqual(download_link, 'mocked_download_link')
 
 
+class TestGetDownloadLinkIfExists(unittest.TestCase):
+    @mock_s3
+    def test_get_download_link_if_exists(self):
+        bucket_name = "test-bucket"
+        region_name = "ap-south-1"
+        conn = boto3.resource("s3", region_name=region_name)
+        conn.create_bucket(Bucket=bucket_name, CreateBucketConfiguration={'LocationConstraint': region_name})
+        conn.Object(bucket_name, "existing-report.csv").put(Body=b"report")
+        # The shared client is created within the mock.
+        reset_s3_client()
+        self.addCleanup(reset_s3_client)
+
+        download_link = get_download_link_if_exists(bucket_name, "existing-report.csv")
+
+        # create_s3_client signs path style urls.
+        self.assertIn(f"/{bucket_name}/existing-report.csv?", download_link)
+        self.assertIsNone(get_download_link_if_exists(bucket_name, "missing-report.csv"))
+
+
+class TestGetS3Client(unittest.TestCase):
+    def tearDown(self):
+        reset_s3_client()
+
+    @patch('services.aws_s3.create_s3_client')
+    def test_the_client_is_created_once(self, mock_create_s3_client):
+        reset_s3_client()
+
+        self.assertIs(get_s3_client(), get_s3_client())
+        mock_create_s3_client.assert_called_once()
+
+        reset_s3_client()
+        get_s3_client()
+        self.assertEqual(mock_create_s3_client.call_count, 2)
+
+
 if __name__ == '__main__':
     unittest.main()
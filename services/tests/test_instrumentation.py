@@ -0,0 +1,116 @@
+import contextvars
+import threading
+import time
+import unittest
+from tempfile import TemporaryDirectory
+from pathlib import Path
+
+from services.instrumentation import (
+    get_current_metrics,
+    iter_stage,
+    record_report,
+    stage,
+    write_prometheus_textfile
+)
+
+
+class TestInstrumentation(unittest.TestCase):
+    def test_stages_are_recorded_and_summarised(self):
+        with record_report('customer_x', sample_interval=0.001) as metrics:
+            with stage('fetch') as fetch_stage:
+                chunks = list(iter_stage('fetch_users', [[1, 2], [3]]))
+                fetch_stage.rows = 3
+            with stage('encode') as encode_stage:
+                encode_stage.bytes = 10
+            parts = list(iter_stage('upload', [b'abc', b'de']))
+
+        summary = metrics.summary()
+        self.assertIsNone(get_current_metrics())
+        self.assertEqual(chunks, [[1, 2], [3]])
+        self.assertEqual(parts, [b'abc', b'de'])
+        self.assertEqual(summary['outcome'], 'generated')
+        self.assertEqual(set(summary['stages']), {'fetch', 'fetch_users', 'encode', 'upload'})
+        self.assertEqual(summary['stages']['fetch_users']['count'], 2)
+        self.assertEqual(summary['stages']['fetch_users']['rows'], 3)
+        self.assertEqual(summary['stages']['upload']['bytes'], 5)
+        self.assertIsNone(summary['stages']['upload']['rows'])
+        self.assertEqual(summary['stages']['encode']['bytes'], 10)
+        # The nested stage takes part of the time of the outer one.
+        self.assertGreaterEqual(
+            summary['stages']['fetch']['duration_seconds'],
+            summary['stages']['fetch_users']['duration_seconds']
+        )
+        self.assertGreaterEqual(summary['duration_seconds'], summary['stages']['fetch']['duration_seconds'])
+
+    def test_memory_peak_is_recorded_per_stage(self):
+        with record_report('customer_x', sample_interval=0.001) as metrics:
+            with stage('allocate'):
+                block = bytearray(64 * 1024 * 1024)
+                block[::4096] = b'x' * len(block[::4096])
+                # Gives the sampler thread the GIL while the block is still allocated.
+                time.sleep(0.05)
+                del block
+            with stage('idle'):
+                pass
+
+        summary = metrics.summary()
+        self.assertGreater(summary['stages']['allocate']['peak_memory_mb'], 32)
+        self.assertGreater(summary['peak_memory_mb'], 32)
+
+    def test_stages_in_worker_threads(self):
+        def work():
+            with stage('fetch_lessons', rows=5):
+                pass
+
+        with record_report('customer_x') as metrics:
+            # Without a copy of the context, the thread records nothing.
+            bare_thread = threading.Thread(target=work)
+            context_thread = threading.Thread(target=contextvars.copy_context().run, args=(work,))
+            for thread in (bare_thread, context_thread):
+                thread.start()
+                thread.join()
+
+        self.assertEqual(metrics.summary()['stages']['fetch_lessons']['count'], 1)
+
+    def test_failed_report(self):
+        with self.assertRaises(ValueError):
+            with record_report('customer_x') as metrics:
+                with stage('fetch'):
+                    raise ValueError('Boom')
+
+        self.assertEqual(metrics.outcome, 'failed')
+        self.assertEqual(metrics.summary()['stages']['fetch']['count'], 1)
+
+    def test_nothing_is_recorded_outside_a_report(self):
+        with stage('fetch') as fetch_stage:
+            fetch_stage.rows = 1
+        self.assertEqual(list(iter_stage('fetch_users', [[1]])), [[1]])
+        self.assertIsNone(get_current_metrics())
+
+    def test_prometheus_textfile(self):
+        with TemporaryDirectory() as textfile_dir:
+            with record_report('customer_x', textfile_dir=textfile_dir):
+                with stage('upload') as upload_stage:
+                    upload_stage.bytes = 2048
+
+            textfile = (Path(textfile_dir) / 'report_generator_customer_x.prom').read_text()
+            self.assertEqual(list(Path(textfile_dir).iterdir()), [Path(textfile_dir) / 'report_generator_customer_x.prom'])
+
+        self.assertIn('# TYPE report_generation_duration_seconds gauge', textfile)
+        self.assertIn('report_stage_bytes{report_type="customer_x",outcome="generated",stage="upload"} 2048', textfile)
+        self.assertIn('report_stage_runs{report_type="customer_x",outcome="generated",stage="upload"} 1', textfile)
+        self.assertNotIn('report_stage_rows{', textfile)
+
+    def test_write_prometheus_textfile_replaces_the_previous_run(self):
+        summary = {'report_type': 'customer_x', 'outcome': 'generated', 'duration_seconds': 1.5, 'peak_memory_mb': 1.0, 'stages': {}}
+        with TemporaryDirectory() as textfile_dir:
+            write_prometheus_textfile(summary, Path(textfile_dir))
+            write_prometheus_textfile({**summary, 'duration_seconds': 2.5}, Path(textfile_dir))
+            textfile = (Path(textfile_dir) / 'report_generator_customer_x.prom').read_text()
+
+        self.assertIn('report_generation_duration_seconds{report_type="customer_x",outcome="generated"} 2.5', textfile)
+        self.assertNotIn(' 1.5\n', textfile)
+
+
+if __name__ == '__main__':
+    unittest.main()
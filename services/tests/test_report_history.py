@@ -0,0 +1,231 @@
+import json
+import unittest
+from datetime import date, datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+from uuid import UUID, uuid4
+from sqlalchemy import create_engine, UUID as UUIDType
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import sessionmaker
+from database.models import ReportsGenerated
+from report import generator
+from report.report_details import get_reuse_parameters
+from services.report_history import (
+    find_delta_base,
+    find_existing_report,
+    get_latest_reports,
+    get_report_parameters,
+    get_reports_between
+)
+from services.save_report_details import save_many_to_db
+from config import settings
+
+
+# reports_generated uses the PostgreSQL UUID column type, SQLite stands in for it here with a plain CHAR column.
+@compiles(UUIDType, 'sqlite')
+def compile_uuid_for_sqlite(type_, compiler, **kw):
+    return 'CHAR(32)'
+
+
+class TestFindExistingReport(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        ReportsGenerated.__table__.create(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.session.add_all([
+            self.make_report(date.today(), get_report_parameters(report_format='csv')),
+            self.make_report(date.today() - timedelta(days=1), get_report_parameters(report_format='parquet')),
+        ])
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    @staticmethod
+    def make_report(report_date, report_parameters):
+        return ReportsGenerated(
+            report_id=uuid4(),
+            s3_object_key=f'customer_x_report/{report_date}.csv',
+            s3_bucket='test-bucket',
+            report_date=report_date,
+            report_type='customer_x',
+            download_link='https://test-bucket.s3.amazonaws.com/report',
+            report_format='csv',
+            report_parameters=report_parameters
+        )
+
+    def test_report_parameters_are_canonical(self):
+        self.assertEqual(
+            get_report_parameters(report_format='csv', delta=False),
+            get_report_parameters(delta=False, report_format='csv')
+        )
+
+    def test_find_existing_report(self):
+        existing_report = find_existing_report(
+            self.session,
+            'customer_x',
+            date.today(),
+            get_report_parameters(report_format='csv')
+        )
+
+        self.assertEqual(existing_report.s3_object_key, f'customer_x_report/{date.today()}.csv')
+
+    def test_find_existing_report_with_other_parameters_or_day(self):
+        self.assertIsNone(
+            find_existing_report(self.session, 'customer_x', date.today(), get_report_parameters(report_format='parquet'))
+        )
+        self.assertIsNone(
+            find_existing_report(
+                self.session,
+                'customer_x',
+                date.today() - timedelta(days=2),
+                get_report_parameters(report_format='csv')
+            )
+        )
+
+
+class TestReportHistory(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        ReportsGenerated.__table__.create(engine)
+        self.session = sessionmaker(bind=engine)()
+        # Two reports a day over the last five days, a customer_x and a customer_x_daily one.
+        save_many_to_db(sessionmaker(bind=engine)(), [
+            self.make_report_details(report_type, date.today() - timedelta(days=days_ago))
+            for days_ago in range(5)
+            for report_type in ('customer_x', 'customer_x_daily')
+        ])
+
+    def tearDown(self):
+        self.session.close()
+
+    @staticmethod
+    def make_report_details(report_type, report_date):
+        return {
+            'report_id': uuid4(),
+            's3_object_key': f'{report_type}_report/{report_date}.csv',
+            's3_bucket': 'test-bucket',
+            'report_date': report_date,
+            'report_type': report_type,
+            'download_link': f'https://test-bucket.s3.amazonaws.com/{report_type}_report/{report_date}.csv',
+            'report_format': 'csv',
+            'report_parameters': get_report_parameters(report_format='csv'),
+        }
+
+    def test_save_many_to_db(self):
+        self.assertEqual(self.session.query(ReportsGenerated).count(), 10)
+        self.assertEqual(save_many_to_db(self.session, []), 0)
+
+    def test_get_latest_reports(self):
+        latest_reports = get_latest_reports(self.session, ['customer_x_daily', 'customer_x', 'never_generated'])
+
+        self.assertEqual([report.report_type for report in latest_reports], ['customer_x_daily', 'customer_x'])
+        self.assertEqual([report.report_date for report in latest_reports], [date.today(), date.today()])
+
+    def test_get_reports_between_page_by_page(self):
+        start_date, end_date = date.today() - timedelta(days=3), date.today() - timedelta(days=1)
+        reports, cursor = [], None
+        while True:
+            report_page = get_reports_between(self.session, start_date, end_date, page_size=4, cursor=cursor)
+            reports.extend(report_page.reports)
+            cursor = report_page.next_cursor
+            if cursor is None:
+                break
+
+        # Every report of the range once, newest first.
+        self.assertEqual(len(reports), 6)
+        self.assertEqual(len(set(report.report_id for report in reports)), 6)
+        self.assertEqual(
+            [report.report_date for report in reports],
+            sorted((report.report_date for report in reports), reverse=True)
+        )
+        self.assertTrue(all(start_date <= report.report_date <= end_date for report in reports))
+
+    def test_get_reports_between_of_a_type(self):
+        report_page = get_reports_between(
+            self.session,
+            date.today() - timedelta(days=10),
+            date.today(),
+            report_type='customer_x_daily'
+        )
+
+        self.assertEqual(len(report_page.reports), 5)
+        self.assertIsNone(report_page.next_cursor)
+        self.assertTrue(all(report.report_type == 'customer_x_daily' for report in report_page.reports))
+
+    def test_reports_of_the_same_day_are_ordered_by_creation(self):
+        # Saved in this order, with report_ids in the opposite order.
+        yesterday = date.today() - timedelta(days=1)
+        created_at = datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+        report_ids = [UUID(int=3), UUID(int=2), UUID(int=1)]
+        save_many_to_db(self.session, [
+            {
+                **self.make_report_details('customer_x_weekly', yesterday),
+                'report_id': report_id,
+                'created_at': created_at + timedelta(minutes=minutes),
+            }
+            for minutes, report_id in enumerate(report_ids)
+        ])
+
+        [latest_report] = get_latest_reports(self.session, ['customer_x_weekly'])
+        self.assertEqual(latest_report.report_id, UUID(int=1))
+        self.assertEqual(find_delta_base(self.session, 'customer_x_weekly', 'csv', date.today(), 7).report_id, UUID(int=1))
+        self.assertEqual(
+            find_existing_report(self.session, 'customer_x_weekly', yesterday, get_report_parameters(report_format='csv')).report_id,
+            UUID(int=1)
+        )
+
+        reports, cursor = [], None
+        while True:
+            report_page = get_reports_between(
+                self.session, yesterday, yesterday, report_type='customer_x_weekly', page_size=1, cursor=cursor
+            )
+            reports.extend(report_page.reports)
+            cursor = report_page.next_cursor
+            if cursor is None:
+                break
+        self.assertEqual([report.report_id for report in reports], [UUID(int=1), UUID(int=2), UUID(int=3)])
+
+    def test_get_reports_between_with_an_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            get_reports_between(self.session, date.today(), date.today(), cursor='yesterday')
+
+
+class TestGenerateReportReuse(unittest.TestCase):
+    @patch('report.generator._build_and_upload_report')
+    @patch('report.report_details.get_download_link_if_exists', return_value='fresh_download_link')
+    @patch('report.generator.find_existing_report')
+    @patch('report.generator.get_postgres_session_class', MagicMock())
+    def test_existing_report_is_reused(self, mock_find_existing_report, mock_get_link, mock_build):
+        mock_find_existing_report.return_value = MagicMock(s3_bucket='test-bucket', s3_object_key='report.csv')
+
+        download_link = generator.generate_report('customer_x')
+
+        self.assertEqual(download_link, 'fresh_download_link')
+        mock_get_link.assert_called_once_with('test-bucket', 'report.csv', None)
+        mock_build.assert_not_called()
+
+    @patch('report.generator.save_to_db')
+    @patch('report.generator._build_and_upload_report', return_value='new_download_link')
+    @patch('report.generator.find_existing_report')
+    @patch('report.generator.get_postgres_session_class', MagicMock())
+    def test_force_refresh_generates_the_report_again(self, mock_find_existing_report, mock_build, mock_save_to_db):
+        download_link = generator.generate_report('customer_x', force_refresh=True)
+
+        self.assertEqual(download_link, 'new_download_link')
+        mock_find_existing_report.assert_not_called()
+        saved_attributes = mock_save_to_db.call_args.args[1]
+        self.assertEqual(saved_attributes['report_parameters'], get_report_parameters(report_format='csv'))
+        self.assertEqual(json.loads(saved_attributes['metrics'])['report_type'], 'customer_x')
+
+    def test_settings_that_change_the_content_are_in_the_reuse_parameters(self):
+        self.assertEqual(get_reuse_parameters('customer_x', 'csv'), '{"report_format":"csv"}')
+        with patch.object(settings, 'report_typed_schema', True):
+            self.assertEqual(get_reuse_parameters('customer_x', 'csv'), '{"report_format":"csv","typed_schema":true}')
+        with patch.object(settings, 'report_daily_days', 14):
+            daily_parameters = get_reuse_parameters('customer_x_daily', 'csv')
+        self.assertEqual(daily_parameters, '{"daily_days":14,"report_format":"csv"}')
+        self.assertNotEqual(daily_parameters, get_reuse_parameters('customer_x_daily', 'csv'))
+
+
+if __name__ == '__main__':
+    unittest.main()